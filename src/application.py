@@ -1,12 +1,21 @@
+import os
 import re
+import queue
 import shutil
 import datetime
+import importlib
+import threading
 
 import customtkinter
 from customtkinter import filedialog
 
-from meetingMinutes import meeting_minutes_main
-from convertMKVtoMP3 import convert_mkv_to_mp3, cutting_mp3
+from pipelineRun import PipelineRun, PipelineCancelled, job_directory
+
+# Startup
+# The processing modules and their dependencies are imported in the background once the window is displayed,
+# so that the window appears without waiting for them
+preloaded_modules = ['meetingMinutes', 'convertMKVtoMP3', 'groq', 'docx']
+preload_delay = 100  # Milliseconds between the display of the window and the start of the imports
 
 
 class MyFileDialogFrame(customtkinter.CTkFrame):
@@ -154,6 +163,56 @@ class MyRadioButtonFrame(customtkinter.CTkFrame):
         self.variable.set(value)
 
 
+class MyProgressFrame(customtkinter.CTkFrame):
+    """
+    Make a frame to follow the progress of the program.
+    """
+
+    def __init__(self, master):
+        """
+        Initialise and configure the frame to follow the progress of the program.
+        :param master:
+        """
+        super().__init__(master)
+
+        # Display configuration
+        self.grid_columnconfigure(0, weight=1)
+
+        self.progress_bar = customtkinter.CTkProgressBar(self)
+        self.progress_bar.grid(row=0, column=0, padx=10, pady=(10, 5), sticky="ew")
+        self.progress_bar.set(0)
+
+        self.status = customtkinter.CTkLabel(self, text="Ready")
+        self.status.grid(row=1, column=0, padx=10, pady=(0, 5), sticky="w")
+
+    def set(self, stage, done=None, total=None):
+        """
+        Display the progress of a stage.
+        :param stage: Stage name
+        :param done: Units of work done (optional)
+        :param total: Total units of work (optional)
+        """
+        if total:
+            self.progress_bar.stop()
+            self.progress_bar.configure(mode="determinate")
+            self.progress_bar.set(done / total)
+            self.status.configure(text=f"{stage}: {done}/{total}")
+        else:
+            self.progress_bar.configure(mode="indeterminate")
+            self.progress_bar.start()
+            self.status.configure(text=f"{stage}...")
+
+    def stop(self, message):
+        """
+        Display the end of the program.
+        :param message: Final message
+        """
+        self.progress_bar.stop()
+        self.progress_bar.configure(mode="determinate")
+        self.progress_bar.set(0)
+        self.status.configure(text=message)
+
+
 class App(customtkinter.CTk):
     """
     Main application code.
@@ -167,7 +226,7 @@ class App(customtkinter.CTk):
 
         # Window configuration
         self.title("Meeting Minutes")
-        self.geometry("600x420")
+        self.geometry("600x500")
         self.resizable(False, False)
 
         self.grid_columnconfigure((0, 1), weight=1)
@@ -179,7 +238,7 @@ class App(customtkinter.CTk):
         self.file_selection_frame.grid(row=0, column=0, padx=10, pady=(10, 5), sticky="nsew", columnspan=2)
 
         self.file_name_selection_frame = MyEntryFrame(self, "File names", data_titles=["Audio file:", "Meeting file:"],
-                                                      placeholders=["audio_[date].mp3", "meeting_minutes_[date].docx"])
+                                                      placeholders=["audio_[date].ogg", "meeting_minutes_[date].docx"])
         self.file_name_selection_frame.grid(row=1, column=0, padx=10, pady=5, sticky="nsew", columnspan=2)
 
         self.timecode_selection_frame = MyEntryFrame(self, "Start/End Times", data_titles=["Start:", "End:"],
@@ -190,14 +249,38 @@ class App(customtkinter.CTk):
         self.radio_button_selection_frame.grid(row=2, column=1, padx=(5, 10), pady=5, sticky="nsew")
 
         self.button = customtkinter.CTkButton(self, text="Run the program", command=self.code_execution)
-        self.button.grid(row=3, column=0, padx=10, pady=10, sticky="ew", columnspan=2)
+        self.button.grid(row=3, column=0, padx=(10, 5), pady=10, sticky="ew")
+        self.cancel_button = customtkinter.CTkButton(self, text="Cancel", command=self.cancel_execution,
+                                                     state="disabled")
+        self.cancel_button.grid(row=3, column=1, padx=(5, 10), pady=10, sticky="ew")
+
+        self.progress_frame = MyProgressFrame(self)
+        self.progress_frame.grid(row=4, column=0, padx=10, pady=(0, 10), sticky="nsew", columnspan=2)
 
         # Setup
         self.radio_button_selection_frame.set("Transcription only")
+        self.run = None
+        self.events = queue.Queue()
+        self.after(preload_delay, self.preload)
+
+    @staticmethod
+    def preload():
+        """
+        Import the processing modules in the background, before the first run needs them.
+        A missing module is reported by the run instead.
+        """
+        def load():
+            for name in preloaded_modules:
+                try:
+                    importlib.import_module(name)
+                except ImportError:
+                    pass
+
+        threading.Thread(target=load, daemon=True).start()
 
     def code_execution(self):
         """
-        Code execution and processing.
+        Code execution: read the settings and start the processing in the background.
         """
         # Getting data
         start_time = self.timecode_selection_frame.get()[0]
@@ -206,6 +289,72 @@ class App(customtkinter.CTk):
         radio = self.radio_button_selection_frame.get()
         name_mp3 = self.file_name_selection_frame.get()[0]
         name_docx = self.file_name_selection_frame.get()[1]
+
+        if path == "":
+            return
+
+        self.run = PipelineRun(progress=lambda stage, done, total: self.events.put(('progress', stage, done, total)))
+        self.button.configure(state="disabled")
+        self.cancel_button.configure(state="normal")
+        self.progress_frame.set("Starting")
+
+        thread = threading.Thread(target=self.processing, daemon=True,
+                                  args=(self.run, path, radio, name_mp3, name_docx, start_time, end_time))
+        thread.start()
+        self.after(100, self.poll_events)
+
+    def cancel_execution(self):
+        """
+        Cancel the processing in progress.
+        """
+        if self.run is not None:
+            self.run.cancel()
+            self.cancel_button.configure(state="disabled")
+            self.progress_frame.set("Cancelling")
+
+    def poll_events(self):
+        """
+        Display the events sent by the processing, until it ends.
+        """
+        finished = False
+        while not self.events.empty():
+            event = self.events.get()
+            if event[0] == 'progress':
+                self.progress_frame.set(*event[1:])
+            else:
+                self.progress_frame.stop(event[1])
+                finished = True
+
+        if finished:
+            self.run = None
+            self.button.configure(state="normal")
+            self.cancel_button.configure(state="disabled")
+        else:
+            self.after(100, self.poll_events)
+
+    def processing(self, run, path, radio, name_mp3, name_docx, start_time, end_time):
+        """
+        Processing in the background, the result is sent as an event.
+        """
+        try:
+            message = self.code_processing(run, path, radio, name_mp3, name_docx, start_time, end_time)
+        except PipelineCancelled:
+            message = "Cancelled"
+        except (Exception, SystemExit) as e:
+            message = f"Error: {e!r}"
+        self.events.put(('end', message))
+
+    @staticmethod
+    def code_processing(run, path, radio, name_mp3, name_docx, start_time, end_time):
+        """
+        Code processing.
+        :return: Final message
+        """
+        # Already imported by `preload` unless the run starts right after the window is displayed
+        from meetingMinutes import meeting_minutes_main, silence_trimming
+        from convertMKVtoMP3 import ingest_audio
+        from audioCache import AudioCache
+
         new_path = False
 
         # Checks whether the format of the start and end times is correct
@@ -213,30 +362,32 @@ class App(customtkinter.CTk):
         start_time_good = True if re.match(motif, start_time) else False
         end_time_good = True if re.match(motif, end_time) else False
 
-        # Convert file to mp3
-        if path.endswith('.mkv'):
-            path = convert_mkv_to_mp3(path, name_mp3) if name_mp3 else convert_mkv_to_mp3(path)
-            new_path = True
+        # Resume the job of a previous run on the same file with the same times
+        run.job_dir = job_directory(path, start_time if start_time_good else None, end_time if end_time_good else None)
 
-        # Cutting up the file
-        if path.endswith('.mp3') and (start_time_good or end_time_good):
-            cut_params = {}
+        # Convert and cut the file in a single pass, encoding it for the upload
+        if path.endswith('.mkv') or (path.endswith('.mp3') and (start_time_good or end_time_good)):
+            ingest_params = {}
             if name_mp3:
-                cut_params['name_mp3_file'] = name_mp3
+                ingest_params['name_audio_file'] = name_mp3
             if start_time_good:
-                cut_params['start_time'] = start_time
+                ingest_params['start_time'] = start_time
             if end_time_good:
-                cut_params['end_time'] = end_time
+                ingest_params['end_time'] = end_time
 
-            path = cutting_mp3(path, **cut_params)
+            converted_path = run.load('audio')
+            if converted_path is None or not os.path.exists(converted_path):
+                converted_path = ingest_audio(path, run=run, trim=silence_trimming, cache=AudioCache(), **ingest_params)
+                run.save('audio', converted_path)
+            path = converted_path
             new_path = True
 
         # Running the MeetingMinutes
-        if path.endswith('.mp3'):
+        if path.endswith(('.mp3', '.ogg')):
             name_docx = name_docx if name_docx != "" else None
             action_type = "Full" if radio == "Full execution" else "Transcription"
 
-            meeting_minutes_main(path, action_type, name_docx)
+            filename = meeting_minutes_main(path, action_type, name_docx, run=run)
 
             if not new_path:
                 output_dir = "output"
@@ -246,8 +397,12 @@ class App(customtkinter.CTk):
                     shutil.copy(path, f"{output_dir}/audio_{formatted_date}.mp3")
                 else:
                     shutil.copy(path, f"{output_dir}/{name_mp3}.mp3")
-        elif path != "":
+
+            run.finish()
+            return f"Done: {filename}"
+        else:
             print("Erreur sur le type de fichier")
+            return "Erreur sur le type de fichier"
 
 
 if __name__ == '__main__':
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+
+# Configuration
+cache_dir = os.path.join("output", "audio_cache")
+cache_max_size = 2 * 1024 * 1024 * 1024  # Maximum size of the cached recordings in bytes
+digest_block_size = 1024 * 1024  # Bytes read at once when hashing a recording
+
+
+def file_digest(file_path):
+    """
+    Hash the content of a file, reading it block by block.
+    :param file_path: Path to the file
+    :return: SHA-256 digest of the content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(digest_block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def audio_key(digest, **params):
+    """
+    Build the cache key of a recording from its content and the settings of the audio prepared from it.
+    :param digest: Digest of the content of the recording (`file_digest`)
+    :param params: Settings affecting the prepared audio (encoding profile, cutting times, silence trimming...)
+    :return: Cache key
+    """
+    settings = json.dumps(params, sort_keys=True)
+    return "{}_{}".format(digest, hashlib.sha256(settings.encode('utf-8')).hexdigest()[:16])
+
+
+class AudioCache:
+    """
+    On-disk cache of the recordings prepared for the upload, keyed by the content of the recording they come from,
+    with least recently used eviction.
+    Each entry gives the prepared recording (None if the recording is used as it is) and its time map.
+    """
+
+    def __init__(self, directory=cache_dir, max_size=cache_max_size):
+        """
+        Open the cache, creating its directory if necessary.
+        :param directory: Directory of the cached recordings (optional)
+        :param max_size: Maximum size of the cached recordings in bytes (optional)
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+
+    def entry_path(self, key):
+        """
+        Get the path to the description of an entry.
+        :param key: Cache key
+        :return: Path to the JSON file of the entry
+        """
+        return os.path.join(self.directory, f"{key}.json")
+
+    def temp_path(self, extension):
+        """
+        Get a path in the cache directory where a recording can be prepared, before it is added with `put`.
+        :param extension: Extension of the recording
+        :return: Path to the temporary recording
+        """
+        return os.path.join(self.directory, f"{uuid.uuid4().hex}.tmp{extension}")
+
+    def get(self, key):
+        """
+        Get a cached entry, marking it as recently used.
+        :param key: Cache key
+        :return: Prepared recording ('path'), its time map ('pieces') and the digest of its content ('digest'),
+            or None if the entry is not in the cache
+        """
+        path = self.entry_path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry['path'] is not None and not os.path.exists(entry['path']):
+            return None
+        now = time.time()
+        os.utime(path, (now, now))
+        return entry
+
+    def put(self, key, pieces=None, file_path=None):
+        """
+        Add an entry to the cache, evicting the least recently used ones beyond the maximum size.
+        :param key: Cache key
+        :param pieces: Time map of the prepared recording, None if it was not trimmed (optional)
+        :param file_path: Prepared recording, moved into the cache (optional, the recording is used as it is)
+        :return: Entry added
+        """
+        entry = {'path': None, 'pieces': pieces, 'digest': None}
+        if file_path is not None:
+            entry['path'] = os.path.join(self.directory, key + os.path.splitext(file_path)[1])
+            entry['digest'] = file_digest(file_path)
+            os.replace(file_path, entry['path'])
+        path = self.entry_path(key)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(temp_path, path)
+        self.evict(keep=path)
+        return entry
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries while the cache exceeds its maximum size.
+        :param keep: Path to the description of an entry never removed, the one just added (optional)
+        """
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    recording = json.load(f)['path']
+                size = os.path.getsize(path) + (os.path.getsize(recording) if recording is not None else 0)
+                last_used = os.path.getmtime(path)
+            except (OSError, ValueError, KeyError):
+                continue
+            total_size += size
+            if path != keep:
+                entries.append((last_used, path, recording, size))
+
+        for _, path, recording, size in sorted(entries, key=lambda entry: entry[0]):
+            if total_size <= self.max_size:
+                break
+            for file_path in (path, recording):
+                if file_path is not None and os.path.exists(file_path):
+                    os.remove(file_path)
+            total_size -= size
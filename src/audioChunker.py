@@ -0,0 +1,309 @@
+import os
+
+import ffmpeg
+import numpy as np
+
+from convertMKVtoMP3 import encoding_profiles, profile_options
+
+# Limits
+max_upload_size = 25 * 1024 * 1024  # 25 MB, size limit of the transcription API
+size_margin = 0.9  # Fraction of the limit targeted, bitrates are never perfectly constant
+
+# Chunk boundaries
+chunk_overlap = 1.0  # Seconds shared by consecutive chunks, the repeated text is removed when merging
+silence_window = 10.0  # Seconds searched for a silence before each target cut point
+analysis_rate = 8000  # Sample rate of the decimated audio used to look for silences (Hz)
+frame_duration = 0.02  # Length of the frames whose energy is measured (s)
+smoothing_duration = 0.3  # Shortest silence considered as a cut point (s)
+bitrate_sample_duration = 60.0  # Seconds encoded to measure the bitrate of an encoding profile
+seekable_formats = ('.ogg', '.opus', '.flac', '.wav')  # Formats where ffmpeg seeks in constant time (not MP3)
+seek_read_ratio = 20.0  # Speed of the other seeks, which read the audio before them, relative to its decoding
+block_duration = 600.0  # Seconds of audio decoded at once by the analyses of whole files, the memory used stays flat
+
+# Containers that ffmpeg can write to a pipe when copying the audio stream
+pipe_formats = {
+    '.mp3': 'mp3',
+    '.ogg': 'ogg',
+    '.opus': 'ogg',
+    '.flac': 'flac',
+    '.wav': 'wav',
+}
+
+
+class AudioChunk:
+    """
+    Part of an audio file, only extracted from the source file when it is read.
+    """
+
+    def __init__(self, file_path, index, start, end, overlap=0.0, profile=None):
+        """
+        Initialise the chunk.
+        :param file_path: Path to the source audio file
+        :param index: Position of the chunk in the file
+        :param start: Start of the chunk in seconds
+        :param end: End of the chunk in seconds
+        :param overlap: Seconds shared with the previous chunk (optional)
+        :param profile: Encoding profile of the chunk, None to copy the encoded audio of the source (optional)
+        """
+        self.file_path = file_path
+        self.index = index
+        self.start = start
+        self.end = end
+        self.overlap = overlap
+        self.profile = profile
+        if profile is None:
+            self.extension = os.path.splitext(file_path)[1].lower()
+        else:
+            self.extension = encoding_profiles[profile]['extension']
+
+    @property
+    def duration(self):
+        """
+        Duration of the chunk in seconds.
+        """
+        return self.end - self.start
+
+    @property
+    def filename(self):
+        """
+        Name given to the chunk when it is uploaded.
+        """
+        return f"chunk_{self.index:04d}{self.extension}"
+
+    def read(self):
+        """
+        Extract the chunk from the source file, copying the encoded audio stream without decoding it,
+        or encoding it with the profile of the chunk.
+        :return: Encoded chunk
+        """
+        if self.profile is None:
+            options = {'fflags': '+bitexact', 'format': pipe_formats[self.extension], 'acodec': 'copy'}
+        else:
+            options = profile_options(self.profile)
+        data, _ = (
+            ffmpeg
+            .input(self.file_path, ss=self.start, t=self.duration)
+            .output('pipe:', vn=None, **options)
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+        return data
+
+
+def probe_audio(file_path):
+    """
+    Read the duration and the encoded bitrate of an audio file.
+    :param file_path: Path to the audio file
+    :return: Duration in seconds and bitrate in bits per second
+    """
+    file_format = ffmpeg.probe(file_path)['format']
+    duration = float(file_format['duration'])
+    bit_rate = file_format.get('bit_rate')
+    if bit_rate is None:
+        bit_rate = os.path.getsize(file_path) * 8 / duration
+    return duration, float(bit_rate)
+
+
+def measure_bitrate(file_path, duration, profile):
+    """
+    Measure the real bitrate of an encoding profile by encoding a sample from the middle of the audio file.
+    :param file_path: Path to the audio file
+    :param duration: Duration of the audio file in seconds
+    :param profile: Name of the encoding profile
+    :return: Bitrate in bits per second
+    """
+    sample_duration = min(bitrate_sample_duration, duration)
+    sample = AudioChunk(file_path, 0, (duration - sample_duration) / 2, (duration + sample_duration) / 2,
+                        profile=profile)
+    return len(sample.read()) * 8 / sample_duration
+
+
+def read_pcm(file_path, start, duration, sample_rate=analysis_rate):
+    """
+    Decode a window of the audio file into mono PCM samples at a reduced sample rate.
+    :param file_path: Path to the audio file
+    :param start: Start of the window in seconds
+    :param duration: Duration of the window in seconds
+    :param sample_rate: Sample rate of the decoded samples (optional)
+    :return: 16-bit samples
+    """
+    data, _ = (
+        ffmpeg
+        .input(file_path, ss=start, t=duration)
+        .output('pipe:', format='s16le', acodec='pcm_s16le', ac=1, ar=sample_rate)
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    return np.frombuffer(data, dtype=np.int16)
+
+
+def read_blocks(file_path, sample_rate=analysis_rate, duration=block_duration, run=None, input_options=None):
+    """
+    Decode an audio file into mono PCM samples, block by block, with a single ffmpeg process.
+    :param file_path: Path to the audio file
+    :param sample_rate: Sample rate of the decoded samples (optional)
+    :param duration: Seconds of audio in each block (optional)
+    :param run: Pipeline run, the decoding is killed and stopped before the next block if it is cancelled (optional)
+    :param input_options: ffmpeg options of the input, such as its start and end times ('ss', 'to') (optional)
+    :return: Generator of the start in seconds and the 16-bit samples of each block
+    """
+    process = (
+        ffmpeg
+        .input(file_path, **(input_options or {}))
+        .output('pipe:', format='s16le', acodec='pcm_s16le', ac=1, ar=sample_rate)
+        .global_args('-loglevel', 'error')
+        .run_async(pipe_stdout=True)
+    )
+    if run is not None:
+        run.attach_process(process)
+    block_bytes = 2 * int(sample_rate * duration)
+    position = 0
+    try:
+        while True:
+            if run is not None:
+                run.check()
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            samples = np.frombuffer(data[:len(data) // 2 * 2], dtype=np.int16)
+            yield position / sample_rate, samples
+            position += len(samples)
+        process.wait()
+        # A cancellation kills ffmpeg, which ends its output like the end of the file
+        if run is not None:
+            run.check()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if run is not None:
+            run.detach_process(process)
+
+
+def frame_energy(samples, sample_rate=analysis_rate):
+    """
+    Compute the RMS energy of consecutive frames of samples.
+    :param samples: PCM samples
+    :param sample_rate: Sample rate of the samples (optional)
+    :return: Energy of each frame
+    """
+    frame_length = int(sample_rate * frame_duration)
+    frame_count = len(samples) // frame_length
+    frames = samples[:frame_count * frame_length].astype(np.float32).reshape(frame_count, frame_length)
+    return np.sqrt(np.mean(frames ** 2, axis=1))
+
+
+def find_silence(energy, first_frame, start, end):
+    """
+    Find the quietest point of a window of the audio file, the latest one in case of a tie.
+    :param energy: Energy of the decoded frames (`frame_energy`), the window included
+    :param first_frame: Index in the audio file of the first frame of `energy`
+    :param start: Start of the window in seconds
+    :param end: End of the window in seconds
+    :return: Time of the quietest point in seconds
+    """
+    window_first = max(0, round(start / frame_duration) - first_frame)
+    window = energy[window_first:max(window_first, round(end / frame_duration) - first_frame)]
+    if len(window) == 0:
+        return end
+
+    width = max(1, round(smoothing_duration / frame_duration))
+    smoothed = np.convolve(window, np.ones(width) / width, mode='same')
+    quietest = len(smoothed) - 1 - np.argmin(smoothed[::-1])
+    return float(first_frame + window_first + quietest + 0.5) * frame_duration
+
+
+def plan_chunk_boundaries(file_path, duration, chunk_length, overlap=chunk_overlap, silence_aware=True):
+    """
+    Choose the cut points of the audio file, preferably in a silence shortly before each target cut point.
+    Only the windows searched are decoded, unless seeking to them costs more than a single decoding pass from the
+    first window to the last one: in MP3 files, each seek reads the file from its start, the cost of the seeks grows
+    with the square of the audio length while the single pass stays linear.
+    Nothing is decoded when the file fits in a single chunk.
+    :param file_path: Path to the audio file
+    :param duration: Duration of the audio file in seconds
+    :param chunk_length: Maximum length of a chunk in seconds, overlap included
+    :param overlap: Seconds shared by consecutive chunks (optional)
+    :param silence_aware: Look for silences instead of cutting at fixed offsets (optional)
+    :return: Start and end of each chunk in seconds
+    """
+    step = chunk_length - overlap
+    if step <= 0:
+        raise ValueError("The overlap must be shorter than the chunks: {}s".format(overlap))
+
+    def next_window(cut):
+        target = cut + step
+        return max(cut + step / 2, target - silence_window), target
+
+    # Costs of the seeks and of the single pass in seconds of audio decoded, from the targets of cuts at fixed offsets
+    targets = []
+    position = 0.0
+    while duration - position > chunk_length:
+        position += step
+        targets.append(position)
+    # (the single pass seeks to the first window)
+    seek_cost = len(targets) * silence_window
+    pass_cost = targets[-1] - targets[0] + silence_window if targets else 0.0
+    if targets and os.path.splitext(file_path)[1].lower() not in seekable_formats:
+        seek_cost += sum(targets) / seek_read_ratio
+        pass_cost += targets[0] / seek_read_ratio
+
+    cuts = [0.0]
+    if silence_aware and targets and seek_cost <= pass_cost:
+        while duration - cuts[-1] > chunk_length:
+            window_start, target = next_window(cuts[-1])
+            first_frame = int(window_start / frame_duration)
+            samples = read_pcm(file_path, first_frame * frame_duration, target - first_frame * frame_duration)
+            cuts.append(find_silence(frame_energy(samples), first_frame, window_start, target))
+    elif silence_aware and targets:
+        # Only the frames from the start of the current window are kept, the memory used stays flat
+        window_start, target = next_window(0.0)
+        first_frame = int(window_start / frame_duration)
+        energy = np.empty(0, dtype=np.float32)
+        blocks = read_blocks(file_path, input_options={'ss': first_frame * frame_duration})
+        try:
+            for _, samples in blocks:
+                energy = np.concatenate([energy, frame_energy(samples)])
+                while duration - cuts[-1] > chunk_length and (first_frame + len(energy)) * frame_duration >= target:
+                    cuts.append(find_silence(energy, first_frame, window_start, target))
+                    window_start, target = next_window(cuts[-1])
+                    dropped = min(len(energy), max(0, int(window_start / frame_duration) - first_frame))
+                    energy = energy[dropped:]
+                    first_frame += dropped
+                if duration - cuts[-1] <= chunk_length:
+                    break
+        finally:
+            blocks.close()
+        # The decoding ends before the probed duration: the last windows are searched in what was decoded
+        while duration - cuts[-1] > chunk_length:
+            cuts.append(find_silence(energy, first_frame, window_start, target))
+            window_start, target = next_window(cuts[-1])
+    while duration - cuts[-1] > chunk_length:
+        cuts.append(cuts[-1] + step)
+    cuts.append(duration)
+
+    return [(max(0.0, start - overlap) if i > 0 else start, end)
+            for i, (start, end) in enumerate(zip(cuts[:-1], cuts[1:]))]
+
+
+def split_audio_stream(file_path, max_size=max_upload_size, overlap=chunk_overlap, silence_aware=True, profile=None):
+    """
+    Cut the audio file into chunks close to the size limit of the API, without loading the file into memory.
+    The chunk length is computed from the encoded bitrate of the chunks, each chunk is extracted by ffmpeg when read.
+    :param file_path: Path to audio file
+    :param max_size: Maximum size of a chunk in bytes (optional)
+    :param overlap: Seconds shared by consecutive chunks (optional)
+    :param silence_aware: Cut in silences instead of at fixed offsets (optional)
+    :param profile: Encoding profile of the chunks, None to copy the encoded audio of the file (optional)
+    :return: Generator of audio chunks
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if profile is None and extension not in pipe_formats:
+        raise ValueError("Unsupported audio format: {}".format(extension))
+
+    duration, bit_rate = probe_audio(file_path)
+    if profile is not None:
+        bit_rate = measure_bitrate(file_path, duration, profile)
+    chunk_length = size_margin * max_size * 8 / bit_rate
+
+    boundaries = plan_chunk_boundaries(file_path, duration, chunk_length, overlap, silence_aware)
+    for index, (start, end) in enumerate(boundaries):
+        yield AudioChunk(file_path, index, start, end, overlap if index > 0 else 0.0, profile)
@@ -0,0 +1,498 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import ffmpeg
+import numpy as np
+
+from convertMKVtoMP3 import encoding_profiles, ingest_audio, profile_options, upload_profile
+from audioChunker import probe_audio, split_audio_stream, plan_chunk_boundaries
+from meetingMinutes import create_backend, transcribe_audio, meeting_minutes_main
+from pipelineRun import PipelineRun, job_directory
+from runReport import summarize_operations
+from transcriptSegments import segments_text
+from speakerDiarization import diarize
+from fakeGroqServer import FakeGroqServer
+
+# Configuration
+backend_names = ['groq', 'local']
+fixtures_dir = os.path.join("output", "benchmark_fixtures")
+fixture_durations = [600, 3600, 14400]  # Synthetic meetings of 10 minutes, 1 hour and 4 hours
+chunk_lengths = [60, 300, 600]  # Chunk lengths in seconds of the boundary planning benchmark
+
+# Synthetic speech: a voice-like tone with varying pitch, 7 seconds of speech then 2 seconds of silence
+synthetic_speech = ("0.3*sin(2*PI*(180+60*sin(2*PI*0.5*t))*t)*(0.6+0.4*sin(2*PI*4*t))*lt(mod(t,9),7)"
+                    "+0.002*(random(0)-0.5)")
+
+# Synthetic meeting of three speakers taking turns every 9 seconds, each with its own pitch and timbre
+speakers_speech = ("0.3*(sin(2*PI*F*t)+0.5*eq(K,1)*sin(4*PI*F*t)+0.6*eq(K,2)*sin(6*PI*F*t))"
+                   "*(0.6+0.4*sin(2*PI*4*t))*lt(mod(t,9),7)+0.002*(random(0)-0.5)"
+                   .replace('F', "(110+80*K)").replace('K', "mod(floor(t/9),3)"))
+speakers_turn = 9  # Seconds between two speakers of the synthetic meeting
+speakers_total = 3  # Speakers of the synthetic meeting
+
+# Startup
+startup_modules = ['application', 'meetingMinutes', 'cli']  # Entry points whose import time is measured
+deferred_modules = ['groq', 'pydub', 'docx', 'dotenv']  # Dependencies that importing an entry point must not load
+startup_budget = 0.5  # Seconds allowed between the start of the interpreter and the display of the window
+startup_repeats = 5  # Fresh interpreters started per entry point, the median is kept
+
+# Script run by each fresh interpreter: it imports an entry point, then opens the window of the application
+startup_script = '''
+import sys, json, time
+start = time.perf_counter()
+module = __import__(sys.argv[1])
+imported = time.perf_counter()
+window = None
+if hasattr(module, 'App'):
+    try:
+        app = module.App()
+        app.update()
+        window = time.perf_counter()
+        app.destroy()
+    except Exception:
+        pass
+print(json.dumps({'import_s': imported - start, 'window_s': None if window is None else window - start,
+                  'loaded': [name for name in sys.argv[2:] if name in sys.modules]}))
+'''
+
+
+def print_table(results, columns):
+    """
+    Print benchmark results as a table.
+    :param results: One dictionary per line
+    :param columns: Keys of the columns to print
+    """
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in columns]
+    print(" | ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    print("-|-".join("-" * width for width in widths))
+    for result in results:
+        print(" | ".join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def benchmark_profiles(recording, profiles=None):
+    """
+    Measure the bytes uploaded and the number of chunks of a recording for each encoding profile.
+    :param recording: Path to the reference recording
+    :param profiles: Names of the encoding profiles (optional, all by default)
+    :return: Results for each profile
+    """
+    profiles = list(encoding_profiles) if profiles is None else profiles
+
+    results = []
+    for profile in profiles:
+        start = time.perf_counter()
+        path = ingest_audio(recording, f"benchmark_{profile}", profile=profile)
+        encode_time = time.perf_counter() - start
+        try:
+            sizes = [len(chunk.read()) for chunk in split_audio_stream(path, silence_aware=False)]
+        finally:
+            os.remove(path)
+        results.append({
+            'profile': profile,
+            'encode_s': round(encode_time, 1),
+            'chunks': len(sizes),
+            'uploaded_MB': round(sum(sizes) / 1024 / 1024, 2),
+            'largest_MB': round(max(sizes) / 1024 / 1024, 2),
+        })
+    return results
+
+
+def benchmark_backends(recording, backends=None):
+    """
+    Measure the real-time factor of each transcription backend: transcription time divided by audio duration.
+    The same chunks are transcribed by each backend, without the transcription cache.
+    :param recording: Path to the reference recording
+    :param backends: Names of the transcription backends (optional, all by default)
+    :return: Results for each backend
+    """
+    backends = backend_names if backends is None else backends
+
+    path = ingest_audio(recording, "benchmark_backends")
+    try:
+        duration, _ = probe_audio(path)
+        chunks = list(split_audio_stream(path))
+        results = []
+        for name in backends:
+            start = time.perf_counter()
+            backend = create_backend(name)
+            load_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            transcription = segments_text(transcribe_audio(backend, chunks))
+            transcribe_time = time.perf_counter() - start
+            results.append({
+                'backend': name,
+                'model': backend.model,
+                'load_s': round(load_time, 1),
+                'audio_s': round(duration, 1),
+                'transcribe_s': round(transcribe_time, 1),
+                'rtf': round(transcribe_time / duration, 3),
+                'chars': len(transcription),
+            })
+    finally:
+        os.remove(path)
+    return results
+
+
+def synthetic_recording(duration, directory=fixtures_dir, speech=synthetic_speech, name="meeting"):
+    """
+    Generate a synthetic meeting recording, reused by the following benchmarks.
+    :param duration: Duration in seconds
+    :param directory: Directory of the fixtures (optional)
+    :param speech: ffmpeg expression of the signal (optional)
+    :param name: Name of the fixture (optional)
+    :return: Path to the recording (`.mp3`)
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    path = os.path.abspath(os.path.join(directory, f"{name}_{duration}s.mp3"))
+    if not os.path.exists(path):
+        source = "aevalsrc={}:s=16000:d={}".format(speech.replace(',', '\\,'), duration)
+        temp_path = f"{path}.tmp.mp3"
+        ffmpeg.input(source, f='lavfi').output(temp_path, ac=1, audio_bitrate='64k').run(quiet=True,
+                                                                                          overwrite_output=True)
+        os.replace(temp_path, path)
+    return path
+
+
+def upload_recording(recording):
+    """
+    Encode a synthetic meeting with the upload profile, reused by the following benchmarks.
+    :param recording: Path to the synthetic meeting
+    :return: Path to the encoded recording
+    """
+    path = os.path.splitext(recording)[0] + encoding_profiles[upload_profile]['extension']
+    if not os.path.exists(path):
+        temp_path = f"{path}.tmp{encoding_profiles[upload_profile]['extension']}"
+        ffmpeg.input(recording).output(temp_path, **profile_options(upload_profile)).run(quiet=True,
+                                                                                         overwrite_output=True)
+        os.replace(temp_path, path)
+    return path
+
+
+def benchmark_chunking(durations=None, lengths=None):
+    """
+    Measure the planning of the silence-aware chunk boundaries on synthetic meetings, in MP3 and in the upload format.
+    The speech of the synthetic meetings pauses during the last 2 seconds of every 9, where the cuts should fall.
+    :param durations: Durations of the synthetic meetings in seconds (optional, one hour by default)
+    :param lengths: Chunk lengths in seconds (optional, `chunk_lengths` by default)
+    :return: Results for each meeting, format and chunk length
+    """
+    durations = [3600] if durations is None else durations
+    lengths = chunk_lengths if lengths is None else lengths
+    results = []
+    for duration, recording in [(duration, path) for duration in durations
+                                for path in (synthetic_recording(duration),
+                                             upload_recording(synthetic_recording(duration)))]:
+        audio_seconds, _ = probe_audio(recording)
+        for length in lengths:
+            start = time.perf_counter()
+            boundaries = plan_chunk_boundaries(recording, audio_seconds, length)
+            wall_time = time.perf_counter() - start
+            cuts = [end for _, end in boundaries[:-1]]
+            results.append({
+                'audio_s': duration,
+                'format': os.path.splitext(recording)[1][1:],
+                'chunk_s': length,
+                'chunks': len(boundaries),
+                'plan_s': round(wall_time, 2),
+                'ms_per_cut': round(wall_time * 1000 / len(cuts), 1) if cuts else None,
+                'cuts_in_silence': round(sum(1 for cut in cuts if cut % 9 >= 7) / len(cuts), 3) if cuts else None,
+            })
+    return results
+
+
+def peak_rss():
+    """
+    Get the peak resident memory of the current process.
+    :return: Peak RSS in MB, None if it cannot be measured on this system
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_pipeline(recording, choice, work_dir):
+    """
+    Run the whole pipeline on a recording (in a worker process, so that its peak memory is measured alone).
+    :param recording: Path to the recording
+    :param choice: 'Full' or 'Transcription'
+    :param work_dir: Directory where the outputs, the cache and the checkpoints are written
+    :return: Measures of the run
+    """
+    os.chdir(work_dir)
+    run = PipelineRun(job_dir=job_directory(recording))
+    meeting_minutes_main(recording, choice, "benchmark", run=run)
+    wall_time, stages = run.timings()
+    run.finish()
+    return {
+        'wall_time': wall_time,
+        'stages': stages,
+        'operations': summarize_operations(run.events),
+        'peak_rss_MB': peak_rss(),
+    }
+
+
+def benchmark_pipeline(durations=None, choice='Full', latency=0.2, latency_per_mb=0.5, rate_limit=None):
+    """
+    Measure the whole pipeline on synthetic meetings, against a local stand-in for the API.
+    :param durations: Durations of the synthetic meetings in seconds (optional, `fixture_durations` by default)
+    :param choice: 'Full' or 'Transcription' (optional)
+    :param latency: Seconds spent by the fake API on each request (optional)
+    :param latency_per_mb: Seconds added per MB of uploaded audio (optional)
+    :param rate_limit: Requests accepted per minute by the fake API (optional, no limit)
+    :return: Results for each meeting
+    """
+    durations = fixture_durations if durations is None else durations
+
+    server = FakeGroqServer(latency, latency_per_mb, rate_limit).start()
+    environment = {name: os.environ.get(name) for name in ('GROQ_BASE_URL', 'GROQ_API_KEY')}
+    os.environ['GROQ_BASE_URL'] = server.url
+    os.environ['GROQ_API_KEY'] = "benchmark"
+    results = []
+    try:
+        for duration in durations:
+            recording = synthetic_recording(duration)
+            requests, rate_limited = server.requests, server.rate_limited
+            work_dir = tempfile.mkdtemp(prefix="benchmark_")
+            try:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    measures = executor.submit(run_pipeline, recording, choice, work_dir).result()
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+            stages = measures['stages']
+            results.append({
+                'audio_s': duration,
+                'wall_s': round(measures['wall_time'], 1),
+                'x_realtime': round(duration / measures['wall_time'], 1),
+                'MB_per_s': round(os.path.getsize(recording) / 1024 / 1024 / measures['wall_time'], 2),
+                'peak_rss_MB': None if measures['peak_rss_MB'] is None else round(measures['peak_rss_MB']),
+                'split_s': round(stages.get("Splitting", 0.0), 1),
+                'transcription_s': round(stages.get("Transcription", 0.0), 1),
+                'extraction_s': round(stages.get("Extraction", 0.0), 1),
+                'saving_s': round(stages.get("Saving", 0.0), 1),
+                'requests': server.requests - requests,
+                'rate_limited': server.rate_limited - rate_limited,
+                'operations': measures['operations'],
+            })
+    finally:
+        server.stop()
+        for name, value in environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    return results
+
+
+def diarization_accuracy(turns):
+    """
+    Measure the fraction of the speech of the synthetic meeting attributed to the right speaker.
+    Each speaker found is matched with the true speaker it overlaps the most.
+    :param turns: Speaker turns found
+    :return: Accuracy between 0 and 1
+    """
+    step = 0.25
+    overlaps = {}
+    for turn in turns:
+        for time_point in np.arange(turn['start'], turn['end'], step):
+            if time_point % speakers_turn < speakers_turn - 2:
+                truth = int(time_point // speakers_turn) % speakers_total
+                key = (turn['speaker'], truth)
+                overlaps[key] = overlaps.get(key, 0) + 1
+    matches = {}
+    for (speaker, truth), count in overlaps.items():
+        if count > overlaps.get((speaker, matches.get(speaker)), 0):
+            matches[speaker] = truth
+    total = sum(overlaps.values())
+    return sum(count for (speaker, truth), count in overlaps.items() if matches[speaker] == truth) / total \
+        if total else 0.0
+
+
+def benchmark_diarization(durations=None, speakers=None):
+    """
+    Measure the speed and the accuracy of the speaker diarization on synthetic meetings of three speakers.
+    :param durations: Durations of the synthetic meetings in seconds (optional, `fixture_durations` by default)
+    :param speakers: Number of speakers given to the diarization (optional, found by default)
+    :return: Results for each meeting
+    """
+    durations = fixture_durations if durations is None else durations
+    results = []
+    for duration in durations:
+        recording = synthetic_recording(duration, speech=speakers_speech, name="speakers")
+        start = time.perf_counter()
+        turns = diarize(recording, speakers)
+        wall_time = time.perf_counter() - start
+        results.append({
+            'audio_s': duration,
+            'diarization_s': round(wall_time, 1),
+            'x_realtime': round(duration / wall_time, 1),
+            'speakers': len({turn['speaker'] for turn in turns}),
+            'turns': len(turns),
+            'accuracy': round(diarization_accuracy(turns), 3),
+        })
+    return results
+
+
+def startup_time(module):
+    """
+    Start a fresh interpreter, import an entry point in it and open its window if it has one.
+    :param module: Name of the entry point
+    :return: Seconds to start the interpreter, to import the module and to display the window (None without window),
+        and deferred dependencies loaded by the import
+    """
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', startup_script, module] + deferred_modules,
+                               cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                               check=True)
+    total = time.perf_counter() - start
+    measures = json.loads(completed.stdout.strip().splitlines()[-1])
+    # The interpreter starts before the script measures anything, its exit is not part of the startup
+    interpreter = total - (measures['window_s'] or measures['import_s'])
+    return {
+        'interpreter_s': max(0.0, interpreter),
+        'import_s': measures['import_s'],
+        'window_s': measures['window_s'],
+        'loaded': measures['loaded'],
+    }
+
+
+def benchmark_startup(modules=None, repeats=startup_repeats):
+    """
+    Measure the cold start of the entry points, each in fresh interpreters.
+    :param modules: Entry points to measure (optional, `startup_modules` by default)
+    :param repeats: Interpreters started per entry point (optional)
+    :return: Results for each entry point
+    """
+    modules = startup_modules if modules is None else modules
+    results = []
+    for module in modules:
+        measures = [startup_time(module) for _ in range(repeats)]
+        windows = [measure['window_s'] for measure in measures if measure['window_s'] is not None]
+        interpreter = statistics.median(measure['interpreter_s'] for measure in measures)
+        window = statistics.median(windows) if windows else None
+        results.append({
+            'module': module,
+            'interpreter_ms': round(interpreter * 1000),
+            'import_ms': round(statistics.median(measure['import_s'] for measure in measures) * 1000),
+            'window_ms': None if window is None else round(window * 1000),
+            'time_to_window_ms': None if window is None else round((interpreter + window) * 1000),
+            'deferred_loaded': ",".join(sorted({name for measure in measures for name in measure['loaded']})) or "-",
+        })
+    return results
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    :param argv: Command line arguments (optional)
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks of the meeting minutes pipeline.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    profiles_parser = commands.add_parser('profiles', help="bytes uploaded and chunk count per encoding profile")
+    profiles_parser.add_argument('recording', help="reference recording (.mkv or .mp3)")
+    profiles_parser.add_argument('--profile', action='append', choices=list(encoding_profiles),
+                                 help="profile to measure, can be repeated (default: all)")
+
+    backends_parser = commands.add_parser('backends', help="real-time factor of each transcription backend")
+    backends_parser.add_argument('recording', help="reference recording (.mkv or .mp3)")
+    backends_parser.add_argument('--backend', action='append', choices=backend_names,
+                                 help="backend to measure, can be repeated (default: all)")
+
+    pipeline_parser = commands.add_parser('pipeline', help="whole pipeline on synthetic meetings, offline")
+    pipeline_parser.add_argument('--duration', type=int, action='append',
+                                 help="duration of a synthetic meeting in seconds, can be repeated "
+                                      "(default: 10 minutes, 1 hour and 4 hours)")
+    pipeline_parser.add_argument('--transcription-only', action='store_true', help="skip the extractions")
+    pipeline_parser.add_argument('--latency', type=float, default=0.2,
+                                 help="seconds spent by the fake API per request")
+    pipeline_parser.add_argument('--latency-per-mb', type=float, default=0.5,
+                                 help="seconds added per MB of uploaded audio")
+    pipeline_parser.add_argument('--rate-limit', type=int, default=None,
+                                 help="requests accepted per minute by the fake API (default: no limit)")
+    pipeline_parser.add_argument('--json', help="file where the results are saved, to compare commits")
+
+    chunking_parser = commands.add_parser('chunking', help="planning of the chunk boundaries in silences")
+    chunking_parser.add_argument('--duration', type=int, action='append',
+                                 help="duration of a synthetic meeting in seconds, can be repeated (default: 1 hour)")
+    chunking_parser.add_argument('--chunk-length', type=float, action='append',
+                                 help="chunk length in seconds, can be repeated (default: 60, 300 and 600)")
+
+    diarization_parser = commands.add_parser('diarization', help="speed and accuracy of the speaker diarization")
+    diarization_parser.add_argument('--duration', type=int, action='append',
+                                    help="duration of a synthetic meeting in seconds, can be repeated "
+                                         "(default: 10 minutes, 1 hour and 4 hours)")
+    diarization_parser.add_argument('--speakers', type=int, default=None,
+                                    help="number of speakers given to the diarization (default: found)")
+
+    startup_parser = commands.add_parser('startup', help="import time and time to window of the entry points")
+    startup_parser.add_argument('--module', action='append', choices=startup_modules,
+                                help="entry point to measure, can be repeated (default: all)")
+    startup_parser.add_argument('--repeats', type=int, default=startup_repeats,
+                                help="fresh interpreters started per entry point, the median is kept")
+    startup_parser.add_argument('--budget', type=float, default=startup_budget,
+                                help="seconds allowed to display the window (to import the application "
+                                     "without display), the command fails above it")
+
+    args = parser.parse_args(argv)
+    if args.command == 'profiles':
+        results = benchmark_profiles(args.recording, args.profile)
+        print_table(results, ['profile', 'encode_s', 'chunks', 'uploaded_MB', 'largest_MB'])
+    elif args.command == 'backends':
+        results = benchmark_backends(args.recording, args.backend)
+        print_table(results, ['backend', 'model', 'load_s', 'audio_s', 'transcribe_s', 'rtf', 'chars'])
+    elif args.command == 'pipeline':
+        choice = 'Transcription' if args.transcription_only else 'Full'
+        results = benchmark_pipeline(args.duration, choice, args.latency, args.latency_per_mb, args.rate_limit)
+        print_table(results, ['audio_s', 'wall_s', 'x_realtime', 'MB_per_s', 'peak_rss_MB', 'split_s',
+                              'transcription_s', 'extraction_s', 'saving_s', 'requests', 'rate_limited'])
+        if args.json is not None:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+    elif args.command == 'chunking':
+        results = benchmark_chunking(args.duration, args.chunk_length)
+        print_table(results, ['audio_s', 'format', 'chunk_s', 'chunks', 'plan_s', 'ms_per_cut', 'cuts_in_silence'])
+    elif args.command == 'diarization':
+        results = benchmark_diarization(args.duration, args.speakers)
+        print_table(results, ['audio_s', 'diarization_s', 'x_realtime', 'speakers', 'turns', 'accuracy'])
+    elif args.command == 'startup':
+        results = benchmark_startup(args.module, args.repeats)
+        print_table(results, ['module', 'interpreter_ms', 'import_ms', 'window_ms', 'time_to_window_ms',
+                              'deferred_loaded'])
+        failures = []
+        for result in results:
+            if result['module'] != 'application':
+                continue
+            startup = result['time_to_window_ms']
+            if startup is None:
+                # Without display, the window cannot be opened: the import of the application is measured instead
+                startup = result['interpreter_ms'] + result['import_ms']
+            if startup > args.budget * 1000:
+                failures.append(f"the application starts in {startup} ms, over the budget of "
+                                f"{args.budget * 1000:.0f} ms")
+            if result['deferred_loaded'] != "-":
+                failures.append(f"importing the application loads {result['deferred_loaded']}")
+        for failure in failures:
+            print(f"Startup budget exceeded: {failure}.")
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+import os
+import re
+import sys
+import glob
+import json
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from meetingMinutes import meeting_minutes_main, transcription_backend, speaker_diarization
+from outputWriters import output_writers
+from convertMKVtoMP3 import ingest_audio
+from audioCache import AudioCache
+from pipelineRun import PipelineRun, job_directory
+import meetingMinutes
+import runReport
+
+# Configuration
+manifest_path = os.path.join("output", "batch_manifest.json")
+audio_extensions = ('.mkv', '.mp3')
+timecode_pattern = r'^([0-5]?[0-9]):([0-5]?[0-9]):([0-5]?[0-9])$'
+
+
+def find_recordings(patterns):
+    """
+    List the recordings designated by paths, directories or glob patterns.
+    :param patterns: Paths to files or directories, or glob patterns
+    :return: Paths to the recordings, without duplicates
+    """
+    recordings = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            paths = glob.glob(pattern)
+        recordings.extend(path for path in sorted(paths)
+                          if os.path.isfile(path) and path.lower().endswith(audio_extensions))
+    return list(dict.fromkeys(os.path.abspath(path) for path in recordings))
+
+
+def output_names(recordings):
+    """
+    Give each recording a distinct name for its output files.
+    :param recordings: Paths to the recordings
+    :return: Output name of each recording
+    """
+    names = {}
+    used = set()
+    for path in recordings:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name = stem
+        index = 2
+        while name in used:
+            name = f"{stem}_{index}"
+            index += 1
+        used.add(name)
+        names[path] = name
+    return names
+
+
+def load_manifest(path):
+    """
+    Load the status of the recordings of a previous batch.
+    :param path: Path to the manifest
+    :return: Status of each recording
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path):
+    """
+    Save the status of the recordings, replacing the manifest atomically.
+    :param manifest: Status of each recording
+    :param path: Path to the manifest
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def prepare_audio(path, name, job_dir, start_time=None, end_time=None):
+    """
+    Convert and cut a recording in a single pass to get the audio file to transcribe (run in a worker process).
+    :param path: Path to the recording (`.mkv` or `.mp3`)
+    :param name: Name of the output audio file
+    :param job_dir: Job directory of the recording
+    :param start_time: Start of cutting time (optional)
+    :param end_time: End of cutting time (optional)
+    :return: Path to the audio file, and the measures of the conversion
+    """
+    if not path.lower().endswith('.mkv') and start_time is None and end_time is None:
+        return path, []
+
+    run = PipelineRun(job_dir=job_dir)
+    audio_path = run.load('audio')
+    if audio_path is None or not os.path.exists(audio_path):
+        audio_path = ingest_audio(path, name, start_time, end_time, run=run, trim=meetingMinutes.silence_trimming,
+                                  cache=AudioCache())
+        run.save('audio', audio_path)
+    return audio_path, run.events
+
+
+def process_audio(audio_path, choice, name, job_dir, backend=None, events=None, diarization=None):
+    """
+    Transcribe an audio file and create its minutes, resuming its job.
+    :param audio_path: Path to the audio file
+    :param choice: Choice between transcribing only or performing all actions ('Full' or 'Transcription')
+    :param name: Name of the output text file
+    :param job_dir: Job directory of the recording
+    :param backend: Transcription backend, 'groq' or 'local' (optional)
+    :param events: Measures of the conversion, added to the run report (optional)
+    :param diarization: Label the speakers of the transcript (optional)
+    :return: Path to the output text file
+    """
+    run = PipelineRun(job_dir=job_dir)
+    run.events.extend(events or [])
+    filename = meeting_minutes_main(audio_path, choice, name, run=run, backend=backend,
+                                    diarization=diarization)
+    run.finish()
+    return filename
+
+
+def run_batch(recordings, choice, start_time=None, end_time=None, manifest_file=manifest_path,
+              process_workers=None, io_workers=2, backend=None, diarization=None):
+    """
+    Process recordings in parallel, resuming the batch recorded in the manifest.
+    The ffmpeg stages run in a process pool, the API stages in a thread pool.
+    Each recording has a job directory, so an interrupted recording resumes from its last completed chunk.
+    :param recordings: Paths to the recordings
+    :param choice: Choice between transcribing only or performing all actions ('Full' or 'Transcription')
+    :param start_time: Start of cutting time (optional)
+    :param end_time: End of cutting time (optional)
+    :param manifest_file: Path to the manifest (optional)
+    :param process_workers: Number of recordings converted at the same time (optional, one per CPU by default)
+    :param io_workers: Number of recordings transcribed at the same time (optional)
+    :param backend: Transcription backend, 'groq' or 'local' (optional, `transcription_backend` by default)
+    :param diarization: Label the speakers of the transcripts (optional, `speaker_diarization` by default)
+    :return: Status of each recording
+    """
+    manifest = load_manifest(manifest_file)
+    names = output_names(recordings)
+
+    def update(path, **fields):
+        entry = manifest.setdefault(path, {})
+        entry.update(fields, updated=datetime.datetime.now().isoformat(timespec='seconds'))
+        save_manifest(manifest, manifest_file)
+
+    with ProcessPoolExecutor(max_workers=process_workers) as processes, \
+            ThreadPoolExecutor(max_workers=io_workers) as threads:
+        pending = {}
+        job_dirs = {}
+        for path in recordings:
+            entry = manifest.get(path, {})
+            if entry.get('status') == 'done':
+                print(f"Skipping '{path}': already processed.")
+                continue
+            job_dirs[path] = job_directory(path, start_time, end_time)
+            if entry.get('status') == 'prepared' and os.path.exists(entry['audio']):
+                future = threads.submit(process_audio, entry['audio'], choice, names[path], job_dirs[path], backend,
+                                        diarization=diarization)
+                pending[future] = (path, 'minutes')
+            else:
+                future = processes.submit(prepare_audio, path, names[path], job_dirs[path], start_time, end_time)
+                pending[future] = (path, 'audio')
+            update(path, status='pending', error=None)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, stage = pending.pop(future)
+                try:
+                    result = future.result()
+                except (Exception, SystemExit) as e:
+                    print(f"Processing of '{path}' failed at the {stage} stage: {e!r}")
+                    update(path, status='failed', error=f"{stage}: {e!r}")
+                    continue
+
+                if stage == 'audio':
+                    audio_path, events = result
+                    update(path, status='prepared', audio=audio_path)
+                    future = threads.submit(process_audio, audio_path, choice, names[path], job_dirs[path], backend,
+                                            events, diarization)
+                    pending[future] = (path, 'minutes')
+                else:
+                    update(path, status='done', docx=result)
+                    print(f"'{path}' processed into '{result}'.")
+
+    return manifest
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    :param argv: Command line arguments (optional)
+    """
+    parser = argparse.ArgumentParser(description="Create meeting minutes from a batch of recordings.")
+    parser.add_argument('inputs', nargs='+', help="recordings (.mkv or .mp3), directories or glob patterns")
+    parser.add_argument('--full', action='store_true',
+                        help="extract the summary, key points and action items, not only the transcription")
+    parser.add_argument('--start', help="start of cutting time (HH:MM:SS)")
+    parser.add_argument('--end', help="end of cutting time (HH:MM:SS)")
+    parser.add_argument('--manifest', default=manifest_path,
+                        help="status file of the batch, used to resume an interrupted batch")
+    parser.add_argument('--process-workers', type=int, default=None,
+                        help="recordings converted at the same time (default: one per CPU)")
+    parser.add_argument('--io-workers', type=int, default=2, help="recordings transcribed at the same time")
+    parser.add_argument('--backend', choices=['groq', 'local'], default=transcription_backend,
+                        help="transcription backend: the Groq API, or Whisper on the CPU of this machine")
+    parser.add_argument('--diarize', action='store_true', default=speaker_diarization,
+                        help="label the speakers of the transcript (offline, on the CPU)")
+    parser.add_argument('--format', action='append', choices=list(output_writers),
+                        help="format of the minutes, can be repeated (default: docx)")
+    parser.add_argument('--metrics-dir', help="directory where the Prometheus metrics of each recording are written")
+    args = parser.parse_args(argv)
+
+    for timecode in (args.start, args.end):
+        if timecode is not None and not re.match(timecode_pattern, timecode):
+            parser.error(f"invalid time '{timecode}', expected HH:MM:SS")
+
+    recordings = find_recordings(args.inputs)
+    if not recordings:
+        print("No recording found.")
+        sys.exit(1)
+
+    if args.metrics_dir is not None:
+        runReport.metrics_dir = args.metrics_dir
+    if args.format is not None:
+        meetingMinutes.output_formats = args.format
+
+    choice = 'Full' if args.full else 'Transcription'
+    manifest = run_batch(recordings, choice, args.start, args.end, args.manifest, args.process_workers,
+                         args.io_workers, args.backend, args.diarize)
+
+    failed = [path for path in recordings if manifest.get(path, {}).get('status') != 'done']
+    print(f"{len(recordings) - len(failed)}/{len(recordings)} recordings processed.")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,88 +1,161 @@
 import os
 import sys
+import time
+import shutil
 import datetime
 
 import ffmpeg
 
-
-def convert_mkv_to_mp3(mkv_file_path, name_mp3_file=None):
+from pipelineRun import PipelineCancelled
+from audioCache import audio_key, file_digest
+
+# Upload formats: speech recognition works on 16 kHz mono audio
+# 'vbr': 'constrained' keeps the Opus bitrate close to the target, so that the chunk sizes are predictable
+encoding_profiles = {
+    'mp3-192k': {'extension': '.mp3', 'format': 'mp3', 'codec': 'libmp3lame', 'sample_rate': 44100, 'channels': 2,
+                 'bitrate': '192k'},
+    'speech-mp3': {'extension': '.mp3', 'format': 'mp3', 'codec': 'libmp3lame', 'sample_rate': 16000, 'channels': 1,
+                   'bitrate': '48k'},
+    'speech-opus': {'extension': '.ogg', 'format': 'ogg', 'codec': 'libopus', 'sample_rate': 16000, 'channels': 1,
+                    'bitrate': '32k', 'vbr': 'constrained'},
+    'speech-opus-low': {'extension': '.ogg', 'format': 'ogg', 'codec': 'libopus', 'sample_rate': 16000,
+                        'channels': 1, 'bitrate': '16k', 'vbr': 'constrained'},
+    'speech-flac': {'extension': '.flac', 'format': 'flac', 'codec': 'flac', 'sample_rate': 16000, 'channels': 1},
+}
+upload_profile = "speech-opus"
+
+
+def profile_options(profile):
     """
-    Convert an `.mkv` file into an `.mp3` file.
-    :param mkv_file_path: Path to the input file (`.mkv`)
-    :param name_mp3_file: Name of output audio file (optional)
-    :return: Path to the new file
+    Get the ffmpeg output options of an encoding profile.
+    The output is bit exact, so that the same audio always gives the same bytes (and the same cache key).
+    :param profile: Name of the encoding profile
+    :return: ffmpeg output options
     """
-    # Check that the output directory is present
-    output_dir = "output"
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    # Creating name of the output file
-    if name_mp3_file is None:
-        now = datetime.datetime.now()
-        formatted_date = now.strftime("%Y-%m-%d_%H-%M-%S")
-        name_mp3_file = f"{output_dir}/audio_{formatted_date}.mp3"
-    else:
-        name_mp3_file = f"{output_dir}/{name_mp3_file}.mp3"
-
-    # Attempt to convert the file
-    try:
-        ffmpeg.input(mkv_file_path).output(name_mp3_file, audio_bitrate='192k').run(overwrite_output=True)
-        print(f"The file '{mkv_file_path}' has been successfully converted to '{name_mp3_file}'.")
-
-        return name_mp3_file
-    except ffmpeg.Error as e:
-        print(f"Conversion error: {e}")
-        sys.exit(1)
-
-
-def cutting_mp3(mp3_file_path, name_mp3_file=None, start_time=None, end_time=None):
+    settings = encoding_profiles[profile]
+    options = {
+        'fflags': '+bitexact',
+        'format': settings['format'],
+        'acodec': settings['codec'],
+        'ar': settings['sample_rate'],
+        'ac': settings['channels'],
+    }
+    if 'bitrate' in settings:
+        options['audio_bitrate'] = settings['bitrate']
+    if 'vbr' in settings:
+        options['vbr'] = settings['vbr']
+    return options
+
+
+def run_ffmpeg(stream, run=None, operation=None, input_path=None, output_path=None):
+    """
+    Run an ffmpeg command, killing it if the pipeline run is cancelled.
+    :param stream: ffmpeg command
+    :param run: Pipeline run (optional)
+    :param operation: Operation name under which the run records the duration and the file sizes (optional)
+    :param input_path: Path to the input file, for the measures (optional)
+    :param output_path: Path to the output file, for the measures (optional)
+    """
+    if run is None:
+        stream.run(overwrite_output=True)
+        return
+
+    start = time.perf_counter()
+    process = stream.run_async(overwrite_output=True, pipe_stderr=True)
+    _, stderr = run.wait_process(process)
+    run.check()
+    if process.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', None, stderr)
+    if operation is not None:
+        run.record(operation, time.perf_counter() - start, bytes_in=os.path.getsize(input_path),
+                   bytes_out=os.path.getsize(output_path))
+
+
+def ingest_audio(input_file_path, name_audio_file=None, start_time=None, end_time=None, run=None, profile=None,
+                 trim=False, cache=None):
     """
-    Cutting the audio file to keep just a part of it.
-    :param mp3_file_path: Path to the input file (`.mp3`)
-    :param name_mp3_file: Name of output audio file (optional)
+    Extract the audio of a recording, cut it and encode it for the upload in a single ffmpeg pass.
+    Only the audio stream is decoded, and only between the start and end times.
+    With the silence trimming, the long silences are left out of the encoding, after a first decoding to find them.
+    The audio prepared from the same recording with the same settings by a previous run is reused from the cache,
+    which also marks the new file as ready for the upload, with its time map.
+    :param input_file_path: Path to the input file (`.mkv` or `.mp3`)
+    :param name_audio_file: Name of output audio file (optional)
     :param start_time: Start of cutting time (optional)
     :param end_time: End of cutting time (optional)
+    :param run: Pipeline run, for progress and cancellation (optional)
+    :param profile: Name of the encoding profile (optional, `upload_profile` by default)
+    :param trim: Remove the long silences, the time map being kept by the audio cache (optional)
+    :param cache: Audio cache (`AudioCache`, optional, needed by the silence trimming)
     :return: Path to the new file
     """
+    # voiceActivity imports this module
+    from voiceActivity import trim_silence, trimming_settings
+
+    if trim and cache is None:
+        raise ValueError("The silence trimming needs the audio cache, which keeps the time map")
+
+    profile = upload_profile if profile is None else profile
+    extension = encoding_profiles[profile]['extension']
+
+    if run is not None:
+        run.start_stage("Conversion")
+
     # Check that the output directory is present
     output_dir = "output"
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Modification of the file converted as a temporary file
-    temp_input_mp3_file = mp3_file_path
-    if os.path.exists(os.path.join(output_dir, os.path.basename(mp3_file_path))):
-        os.rename(mp3_file_path, f"{output_dir}/temp.mp3")
-        temp_input_mp3_file = f"{output_dir}/temp.mp3"
-
     # Creating name of the output file
-    if name_mp3_file is None:
+    if name_audio_file is None:
         now = datetime.datetime.now()
         formatted_date = now.strftime("%Y-%m-%d_%H-%M-%S")
-        name_mp3_file = f"{output_dir}/audio_{formatted_date}.mp3"
+        name_audio_file = f"{output_dir}/audio_{formatted_date}{extension}"
     else:
-        name_mp3_file = f"{output_dir}/{name_mp3_file}.mp3"
-
-    # Attempt to cut the file
+        name_audio_file = f"{output_dir}/{name_audio_file}{extension}"
+
+    # Configuring the seeking options of the input
+    input_options = {}
+    if start_time is not None:
+        input_options['ss'] = start_time
+    if end_time is not None:
+        input_options['to'] = end_time
+
+    # Attempt to convert the file, unless a previous run already did
+    key = entry = None
+    if cache is not None:
+        start = time.perf_counter()
+        key = audio_key(file_digest(input_file_path), profile=profile, start_time=start_time, end_time=end_time,
+                        trimming=trimming_settings() if trim else None)
+        entry = cache.get(key)
     try:
-        # Configuring options for ffmpeg
-        ffmpeg_options = {}
-
-        if start_time is not None:
-            ffmpeg_options['ss'] = start_time
-
-        if end_time is not None:
-            ffmpeg_options['to'] = end_time
-
-        # Running ffmpeg with the options configured
-        ffmpeg.input(temp_input_mp3_file, **ffmpeg_options).output(name_mp3_file, c='copy').run(overwrite_output=True)
-        print(f"The file '{mp3_file_path}' has been successfully cut to '{name_mp3_file}'.")
-
-        # Cleaning
-        os.remove(f"{output_dir}/temp.mp3")
-
-        return name_mp3_file
+        if entry is None or entry['path'] is None:
+            output_path = name_audio_file if cache is None else cache.temp_path(extension)
+            try:
+                time_map = trim_silence(input_file_path, output_path, profile, run, input_options) if trim else None
+                if time_map is None:
+                    stream = ffmpeg.input(input_file_path, **input_options).output(
+                        output_path, vn=None, **profile_options(profile))
+                    run_ffmpeg(stream, run, 'conversion', input_file_path, output_path)
+            except BaseException:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                raise
+            if cache is not None:
+                entry = cache.put(key, time_map.to_list() if time_map is not None else None, output_path)
+        elif run is not None:
+            run.record('audio_cache_hit', time.perf_counter() - start, bytes_in=os.path.getsize(input_file_path))
+        if cache is not None:
+            shutil.copyfile(entry['path'], name_audio_file)
+            # The new file is ready for the upload: it is split as it is, and its times restored with its time map
+            cache.put(audio_key(entry['digest'], upload=profile), entry['pieces'])
+        print(f"The file '{input_file_path}' has been successfully converted to '{name_audio_file}'.")
+
+        return name_audio_file
+    except PipelineCancelled:
+        if os.path.exists(name_audio_file):
+            os.remove(name_audio_file)
+        raise
     except ffmpeg.Error as e:
-        print(f"Cutting error: {e}")
+        print(f"Conversion error: {e}")
         sys.exit(1)
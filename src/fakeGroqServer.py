@@ -0,0 +1,182 @@
+import json
+import time
+import threading
+import itertools
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from meetingMinutes import estimate_tokens
+
+# Text returned by the fake endpoints
+fake_sentences = [
+    "今天的会议主要讨论了项目的进度和下一阶段的计划。",
+    "开发团队已经完成了大部分功能，测试将在下周开始。",
+    "市场部希望在发布之前收到最终的产品说明。",
+    "我们决定由王经理负责协调各部门之间的工作。",
+    "预算方面还需要财务部门进一步确认。",
+    "下一次会议将在周五下午举行。",
+]
+fake_answer_chars = 400  # Length of the answers of the chat endpoint
+fake_segment_chars = 20  # Length of the timestamped segments of the transcription endpoint
+
+
+def fake_text(length):
+    """
+    Build a fake transcript of a given length.
+    :param length: Number of characters
+    :return: Text
+    """
+    text = "".join(itertools.islice(itertools.cycle(fake_sentences), length // 20 + 1))
+    return text[:max(1, length)]
+
+
+class FakeGroqServer:
+    """
+    Local stand-in for the transcription and chat endpoints of the Groq API, with a latency and a rate limit.
+    The API client is pointed to it with the `GROQ_BASE_URL` variable, so that benchmarks run offline.
+    """
+
+    def __init__(self, latency=0.2, latency_per_mb=0.5, rate_limit=None, chars_per_kb=1.0, upload_kbps=32.0, port=0):
+        """
+        Initialise the server.
+        :param latency: Seconds spent on each request (optional)
+        :param latency_per_mb: Seconds added per MB of uploaded audio (optional)
+        :param rate_limit: Requests accepted per minute, the others are refused with a 429 error (optional, no limit)
+        :param chars_per_kb: Characters of transcript returned per kB of uploaded audio (optional)
+        :param upload_kbps: Bitrate of the uploaded audio, giving the times of the timestamped segments (optional)
+        :param port: Port to listen to (optional, a free port by default)
+        """
+        self.latency = latency
+        self.latency_per_mb = latency_per_mb
+        self.rate_limit = rate_limit
+        self.chars_per_kb = chars_per_kb
+        self.upload_kbps = upload_kbps
+        self.port = port
+        self.lock = threading.Lock()
+        self.request_times = deque()
+        self.requests = 0
+        self.rate_limited = 0
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        """
+        Base URL of the server, to use as `GROQ_BASE_URL`.
+        """
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def start(self):
+        """
+        Start serving in a background thread.
+        :return: The server
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                retry_after = fake.admit()
+                if retry_after is not None:
+                    self.send_json(429, {'error': {'message': "Rate limit reached", 'type': "requests",
+                                                   'code': "rate_limit_exceeded"}},
+                                   {'retry-after': "{:.2f}".format(retry_after)})
+                elif self.path.endswith('/audio/transcriptions'):
+                    self.send_json(200, fake.transcription(body))
+                elif self.path.endswith('/chat/completions'):
+                    self.send_json(200, fake.chat_completion(json.loads(body)))
+                else:
+                    self.send_json(404, {'error': {'message': "Unknown endpoint"}})
+
+            def send_json(self, status, value, headers=None):
+                data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, header in (headers or {}).items():
+                    self.send_header(name, header)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the server.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def admit(self):
+        """
+        Count a request against the rate limit.
+        :return: Seconds to wait before retrying if the request is refused, None if it is accepted
+        """
+        with self.lock:
+            self.requests += 1
+            if self.rate_limit is None:
+                return None
+            now = time.monotonic()
+            while self.request_times and now - self.request_times[0] >= 60:
+                self.request_times.popleft()
+            if len(self.request_times) >= self.rate_limit:
+                self.rate_limited += 1
+                return 60 - (now - self.request_times[0])
+            self.request_times.append(now)
+            return None
+
+    def transcription(self, body):
+        """
+        Answer a transcription request after a latency depending on the size of the upload.
+        The segments are spread evenly over the duration of the upload if timestamps are requested.
+        :param body: Multipart body of the request
+        :return: Transcription
+        """
+        time.sleep(self.latency + self.latency_per_mb * len(body) / 1024 / 1024)
+        text = fake_text(int(len(body) / 1024 * self.chars_per_kb))
+        if b'verbose_json' not in body:
+            return {'text': text}
+
+        duration = len(body) * 8 / 1000 / self.upload_kbps
+        pieces = [text[i:i + fake_segment_chars] for i in range(0, len(text), fake_segment_chars)]
+        step = duration / len(pieces)
+        segments = [{'id': index, 'start': index * step, 'end': (index + 1) * step, 'text': piece, 'avg_logprob': -0.2}
+                    for index, piece in enumerate(pieces)]
+        return {'text': text, 'duration': duration, 'segments': segments}
+
+    def chat_completion(self, request):
+        """
+        Answer a chat request, in JSON if it is asked by the request.
+        :param request: Body of the request
+        :return: Chat completion
+        """
+        time.sleep(self.latency)
+        content = fake_text(fake_answer_chars)
+        if (request.get('response_format') or {}).get('type') == 'json_object':
+            content = json.dumps({section: content for section in ('abstract_summary', 'key_points', 'action_items')},
+                                 ensure_ascii=False)
+        prompt_tokens = sum(estimate_tokens(message.get('content') or "") for message in request['messages'])
+        completion_tokens = estimate_tokens(content)
+        return {
+            'id': "chatcmpl-fake",
+            'object': "chat.completion",
+            'created': int(time.time()),
+            'model': request.get('model'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': "assistant", 'content': content},
+                'finish_reason': "stop",
+                'logprobs': None,
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        }
@@ -0,0 +1,488 @@
+import os
+import sys
+import time
+import datetime
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+import numpy as np
+from pydub import AudioSegment
+
+from audioChunker import frame_duration, frame_energy
+from meetingMinutes import (model_gpt, transcription_backend, max_input_tokens, call_with_backoff, create_client,
+                            create_backend, transcribe_chunk, abstract_summary_extraction, estimate_tokens,
+                            extract_sections, map_reduce_extraction, extraction_mode, record_completion,
+                            format_timestamp)
+from outputWriters import MinutesOutput, output_writers
+from transcriptSegments import segments_text
+from pipelineRun import PipelineRun
+import meetingMinutes
+import runReport
+
+# Input
+live_sample_rate = 16000  # Sample rate of the decoded stream (Hz)
+poll_interval = 0.5  # Seconds between two reads of a growing file at its end
+idle_timeout = 30.0  # Seconds without growth after which a recording is considered finished
+read_block_size = 64 * 1024  # Bytes read from the recording at once
+decode_block_duration = 0.1  # Seconds of samples read from ffmpeg at once
+probe_size = 1024 * 1024  # Bytes read by ffmpeg to detect the format, kept small to start decoding early
+
+# Speech segments
+speech_threshold = 300.0  # RMS energy of a frame containing speech (16-bit samples)
+min_silence = 0.6  # Seconds of silence closing a segment
+min_segment_duration = 5.0  # Segments are not closed before this length, short ones transcribe poorly
+max_segment_duration = 30.0  # Segments are cut at their quietest point beyond this length
+cut_search_duration = 5.0  # Seconds searched for the quietest point of a segment too long
+min_speech_duration = 0.3  # Segments with less speech are dropped
+speech_padding = 0.3  # Seconds kept before the first speech frame of a segment
+
+# Rolling summary
+summary_interval = 60.0  # Seconds of new speech between two updates of the summary
+
+
+def tail_file(file_path, run, timeout=idle_timeout):
+    """
+    Read a file while it is being written, waiting for it to appear if necessary.
+    :param file_path: Path to the recording
+    :param run: Pipeline run, reading stops when it is cancelled
+    :param timeout: Seconds without growth after which the recording is considered finished (optional)
+    :return: Generator of the blocks of the file
+    """
+    last_growth = time.monotonic()
+    while not os.path.exists(file_path):
+        if run.cancelled or time.monotonic() - last_growth > timeout:
+            return
+        time.sleep(poll_interval)
+
+    with open(file_path, 'rb') as f:
+        while not run.cancelled:
+            block = f.read(read_block_size)
+            if block:
+                last_growth = time.monotonic()
+                yield block
+            elif time.monotonic() - last_growth > timeout:
+                return
+            else:
+                time.sleep(poll_interval)
+
+
+def decode_stream(source, run, timeout=idle_timeout):
+    """
+    Decode a recording into mono PCM samples while it is being written.
+    :param source: Path to a growing recording, or '-' to read the audio from the standard input
+    :param run: Pipeline run, decoding stops when it is cancelled
+    :param timeout: Seconds without growth after which a recording is considered finished (optional)
+    :return: Generator of blocks of 16-bit samples
+    """
+    from_stdin = source == '-'
+    process = (
+        ffmpeg
+        .input('pipe:', probesize=probe_size)
+        .output('pipe:', format='s16le', acodec='pcm_s16le', ac=1, ar=live_sample_rate)
+        .global_args('-loglevel', 'error')
+        .run_async(pipe_stdin=not from_stdin, pipe_stdout=True)
+    )
+    run.attach_process(process)
+
+    def feed():
+        try:
+            for block in tail_file(source, run, timeout):
+                process.stdin.write(block)
+        except OSError:
+            # ffmpeg has stopped, killed by a cancellation or on an invalid stream
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    if not from_stdin:
+        threading.Thread(target=feed, daemon=True).start()
+
+    decoded = 0
+    block_bytes = 2 * int(live_sample_rate * decode_block_duration)
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            decoded += len(data)
+            yield np.frombuffer(data[:len(data) // 2 * 2], dtype=np.int16)
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        run.detach_process(process)
+
+    run.check()
+    if decoded == 0:
+        raise ValueError("No audio could be decoded from {}".format(source))
+
+
+class SpeechSegmenter:
+    """
+    Cut a stream of samples into speech segments, each one closed at the first long enough silence.
+    """
+
+    def __init__(self, sample_rate=live_sample_rate):
+        """
+        Initialise the segmenter.
+        :param sample_rate: Sample rate of the stream (optional)
+        """
+        self.sample_rate = sample_rate
+        self.frame_length = int(sample_rate * frame_duration)
+        self.remainder = np.zeros(0, dtype=np.int16)
+        self.frames = deque()
+        self.energies = deque()
+        self.start_frame = 0
+        self.speech_frames = 0
+        self.silent_frames = 0
+
+    def feed(self, samples):
+        """
+        Analyse new samples of the stream.
+        :param samples: 16-bit samples
+        :return: Segments closed by the samples, as (start in seconds, samples)
+        """
+        samples = np.concatenate([self.remainder, samples])
+        frame_count = len(samples) // self.frame_length
+        self.remainder = samples[frame_count * self.frame_length:]
+        frames = samples[:frame_count * self.frame_length].reshape(frame_count, self.frame_length)
+
+        segments = []
+        for frame, energy in zip(frames, frame_energy(frames.ravel(), self.sample_rate)):
+            segment = self.add_frame(frame, energy)
+            if segment is not None:
+                segments.append(segment)
+        return segments
+
+    def add_frame(self, frame, energy):
+        """
+        Add a frame to the current segment, closing the segment if it ends with a long enough silence.
+        :param frame: Samples of the frame
+        :param energy: RMS energy of the frame
+        :return: Closed segment, or None
+        """
+        self.frames.append(frame)
+        self.energies.append(energy)
+        speech = energy > speech_threshold
+
+        if self.speech_frames == 0 and not speech:
+            # No speech yet: only keep the padding before the first speech frame
+            if len(self.frames) * frame_duration > speech_padding:
+                self.frames.popleft()
+                self.energies.popleft()
+                self.start_frame += 1
+            return None
+
+        if speech:
+            self.speech_frames += 1
+            self.silent_frames = 0
+        else:
+            self.silent_frames += 1
+
+        duration = len(self.frames) * frame_duration
+        if self.silent_frames * frame_duration >= min_silence and duration >= min_segment_duration:
+            return self.close(len(self.frames))
+        if duration >= max_segment_duration:
+            search_frames = int(cut_search_duration / frame_duration)
+            energies = list(self.energies)[-search_frames:]
+            return self.close(len(self.frames) - len(energies) + int(np.argmin(energies)) + 1)
+        return None
+
+    def close(self, frame_count=None):
+        """
+        Close the current segment, the frames after the cut start the next segment.
+        :param frame_count: Number of frames in the closed segment (optional, all by default)
+        :return: Closed segment, or None if it contains too little speech
+        """
+        frame_count = len(self.frames) if frame_count is None else frame_count
+        frames = [self.frames.popleft() for _ in range(frame_count)]
+        energies = [self.energies.popleft() for _ in range(frame_count)]
+        start = self.start_frame * frame_duration
+        self.start_frame += frame_count
+
+        self.speech_frames = sum(1 for energy in self.energies if energy > speech_threshold)
+        self.silent_frames = 0
+        speech_frames = sum(1 for energy in energies if energy > speech_threshold)
+        if not frames or speech_frames * frame_duration < min_speech_duration:
+            return None
+        return start, np.concatenate(frames)
+
+    def flush(self):
+        """
+        Close the last segment at the end of the stream.
+        :return: Last segment, or None
+        """
+        if self.speech_frames == 0:
+            return None
+        return self.close()
+
+
+def update_summary(client, summary, transcription, run=None):
+    """
+    Update the summary of a meeting with the new part of its transcript.
+    :param summary: Summary of the meeting so far (empty at the start of the meeting)
+    :param transcription: New part of the transcript
+    :param run: Pipeline run, recording the duration and token usage of the request (optional)
+    :return: Updated summary
+    """
+    if not summary:
+        return abstract_summary_extraction(client, transcription, run)
+
+    start = time.perf_counter()
+    response = call_with_backoff(
+        client.chat.completions.create,
+        run=run,
+        model=model_gpt,
+        temperature=0,
+        messages=[
+            {
+                "role": "system",
+                "content": "您是一位训练有素、高度熟练的人工智能，能够理解和综合语言。以下是一场仍在进行的会议到目前为止的摘要，以及会议记录的新内容。请将新内容整合到摘要中，输出更新后的完整摘要，仍然是一个抽象且简洁的段落。请保留最重要的要点，避免不必要的细节或无关要点。"
+            },
+            {
+                "role": "user",
+                "content": f"目前的摘要：\n{summary}\n\n会议记录的新内容：\n{transcription}"
+            }
+        ]
+    )
+    response_dict = response.model_dump()
+    record_completion(run, 'llm_rolling_summary', start, response_dict)
+    return response_dict['choices'][0]['message']['content']
+
+
+class RollingMinutes:
+    """
+    Transcript and summary of a meeting, updated as its speech segments are transcribed.
+    """
+
+    def __init__(self, client, transcriber, transcript_path, summary_path=None, run=None, workers=None, output=None):
+        """
+        Initialise the minutes.
+        :param client: API client of the summary (None without summary)
+        :param transcriber: Transcription backend
+        :param transcript_path: Path to the transcript, written as the segments are transcribed
+        :param summary_path: Path to the summary, written at each update (optional, no summary by default)
+        :param run: Pipeline run, for progress and cancellation (optional)
+        :param workers: Maximum number of segments transcribed at the same time (optional, set by the backend)
+        :param output: Output files of the minutes, where the segments are written as they are transcribed (optional)
+        """
+        self.client = client
+        self.transcriber = transcriber
+        self.summary_path = summary_path
+        self.output = output
+        self.run = PipelineRun() if run is None else run
+        self.executor = ThreadPoolExecutor(max_workers=transcriber.workers if workers is None else workers)
+        self.summarizer = ThreadPoolExecutor(max_workers=1)
+        self.transcript_file = open(transcript_path, 'w', encoding='utf-8')
+        self.pending = deque()
+        self.texts = []
+        self.summary = ""
+        self.summarized = 0
+        self.summary_future = None
+
+    def add_segment(self, start, samples):
+        """
+        Start the transcription of a speech segment.
+        :param start: Start of the segment in seconds
+        :param samples: 16-bit samples of the segment
+        """
+        audio = AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=live_sample_rate, channels=1)
+        end = start + len(samples) / live_sample_rate
+        future = self.executor.submit(transcribe_chunk, self.transcriber, audio, run=self.run, offset=start)
+        self.pending.append((start, end, future))
+        self.collect()
+
+    def collect(self, wait=False):
+        """
+        Add the transcribed segments to the transcript in their order, then update the summary if it is due.
+        :param wait: Wait for all the segments (optional)
+        """
+        while self.pending and (wait or self.pending[0][2].done()):
+            start, end, future = self.pending.popleft()
+            segments = future.result()
+            text = segments_text(segments)
+            self.run.advance()
+            if not text:
+                continue
+            if self.output is not None:
+                self.output.add_segments(segments)
+            self.texts.append((start, end, text))
+            line = f"[{format_timestamp(start)}] {text}"
+            print(line)
+            self.transcript_file.write(line + "\n")
+            self.transcript_file.flush()
+
+        if self.summary_path is not None:
+            self.summarize()
+
+    def summarize(self, final=False):
+        """
+        Update the summary in the background once enough new speech has been transcribed.
+        :param final: Summarize all the new speech, even if it is shorter than `summary_interval` (optional)
+        """
+        if self.summary_future is not None:
+            if not self.summary_future.done():
+                return
+            self.summary, self.summarized = self.summary_future.result()
+            self.summary_future = None
+            with open(self.summary_path, 'w', encoding='utf-8') as f:
+                f.write(self.summary)
+
+        texts = self.texts[self.summarized:]
+        if not texts or (not final and texts[-1][1] - texts[0][0] < summary_interval):
+            return
+        transcription = " ".join(text for _, _, text in texts)
+        self.summary_future = self.summarizer.submit(
+            lambda summary, count: (update_summary(self.client, summary, transcription, self.run), count),
+            self.summary, len(self.texts))
+
+    def final_summary(self):
+        """
+        Wait for the summary of the whole transcript.
+        :return: Summary of the meeting
+        """
+        while self.summary_future is not None or self.summarized < len(self.texts):
+            if self.summary_future is not None:
+                self.summary_future.exception()
+            self.summarize(final=True)
+        return self.summary
+
+    @property
+    def transcription(self):
+        """
+        Transcript of the segments transcribed so far.
+        """
+        return " ".join(text for _, _, text in self.texts)
+
+    def close(self):
+        """
+        Stop the transcriptions still running and close the transcript.
+        """
+        self.executor.shutdown(cancel_futures=True)
+        self.summarizer.shutdown(cancel_futures=True)
+        self.transcript_file.close()
+
+
+def live_minutes_main(source, choice, name_docx=None, run=None, client=None, timeout=idle_timeout, backend=None,
+                      formats=None):
+    """
+    Main code for transcribing a recording while it is being written.
+    The transcript and the summary are updated during the meeting, so that the minutes are ready soon after its end.
+    :param source: Path to a growing recording, or '-' to read the audio from the standard input
+    :param choice: Choice between transcribing only or performing all actions ('Full' or 'Transcription')
+    :param name_docx: Name of output text file (optional)
+    :param run: Pipeline run, for progress and cancellation (optional)
+    :param client: API client (optional, created from the `GROQ_API_KEY` variable by default)
+    :param timeout: Seconds without growth after which a recording is considered finished (optional)
+    :param backend: Transcription backend, 'groq' or 'local' (optional, `transcription_backend` by default)
+    :param formats: Formats of the output files (optional, `output_formats` of `meetingMinutes` by default)
+    :return: Path to the output text file (the first format)
+    """
+    run = PipelineRun() if run is None else run
+    if choice not in ('Full', 'Transcription'):
+        print("Invalid option. Exiting.")
+        sys.exit(1)
+
+    backend = transcription_backend if backend is None else backend
+    if client is None and (backend == 'groq' or choice == 'Full'):
+        client = create_client()
+    transcriber = create_backend(backend, client)
+
+    output_dir = "output"
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    if name_docx is None:
+        now = datetime.datetime.now()
+        name_docx = "meeting_minutes_{}".format(now.strftime("%Y-%m-%d_%H-%M-%S"))
+    summary_path = f"{output_dir}/{name_docx}_summary.txt" if choice == 'Full' else None
+
+    # Transcribe the segments as they are closed, while the recording goes on
+    # The segments are also written to the output files, completed with the sections at the end of the meeting
+    run.start_stage("Live transcription")
+    segmenter = SpeechSegmenter()
+    output = MinutesOutput(f"{output_dir}/{name_docx}", meetingMinutes.output_formats if formats is None else formats)
+    try:
+        minutes = RollingMinutes(client, transcriber, f"{output_dir}/{name_docx}_transcript.txt", summary_path, run,
+                                 output=output)
+        try:
+            for samples in decode_stream(source, run, timeout):
+                for start, segment in segmenter.feed(samples):
+                    minutes.add_segment(start, segment)
+                minutes.collect()
+            last_segment = segmenter.flush()
+            if last_segment is not None:
+                minutes.add_segment(*last_segment)
+
+            # The recording is finished: only its end remains to be transcribed and summarized
+            minutes.collect(wait=True)
+            transcription = minutes.transcription
+            result = {
+                'complete_transcription': transcription
+            }
+            if choice == 'Full':
+                run.start_stage("Extraction")
+                minutes.summarize(final=True)
+                sections = ['key_points', 'action_items']
+                if estimate_tokens(transcription) > max_input_tokens:
+                    extracted = map_reduce_extraction(client, transcription, extraction_mode, sections, run)
+                else:
+                    extracted = extract_sections(client, transcription, extraction_mode, sections, run)
+                result['abstract_summary'] = minutes.final_summary()
+                result.update(extracted)
+        finally:
+            minutes.close()
+
+        run.start_stage("Saving")
+        start = time.perf_counter()
+        output.add_sections(result)
+        output.close()
+    except BaseException:
+        # A cancelled or failed run leaves no partial minutes under the final names
+        output.discard()
+        raise
+    run.record('output', time.perf_counter() - start, bytes_out=sum(os.path.getsize(path) for path in output.paths))
+    filename = output.paths[0]
+
+    report_path = runReport.save_run_report(run, filename, recording=source, choice=choice, backend=backend, live=True)
+    print(f"Run report saved in '{report_path}'.")
+    return filename
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    :param argv: Command line arguments (optional)
+    """
+    parser = argparse.ArgumentParser(description="Create meeting minutes while the meeting is being recorded.")
+    parser.add_argument('source', help="recording being written (.mkv or .mp3), or '-' to read the audio from a pipe")
+    parser.add_argument('--full', action='store_true',
+                        help="keep a rolling summary and extract the key points and action items at the end")
+    parser.add_argument('--name', help="name of the output files (default: meeting_minutes_<date>)")
+    parser.add_argument('--backend', choices=['groq', 'local'], default=transcription_backend,
+                        help="transcription backend: the Groq API, or Whisper on the CPU of this machine")
+    parser.add_argument('--format', action='append', choices=list(output_writers),
+                        help="format of the minutes, can be repeated (default: docx)")
+    parser.add_argument('--idle-timeout', type=float, default=idle_timeout,
+                        help="seconds without growth after which the recording is considered finished")
+    parser.add_argument('--metrics-dir', help="directory where the Prometheus metrics of the run are written")
+    args = parser.parse_args(argv)
+
+    if args.metrics_dir is not None:
+        runReport.metrics_dir = args.metrics_dir
+    if args.format is not None:
+        meetingMinutes.output_formats = args.format
+
+    choice = 'Full' if args.full else 'Transcription'
+    filename = live_minutes_main(args.source, choice, args.name, timeout=args.idle_timeout, backend=args.backend)
+    print(f"Minutes saved in '{filename}'.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import io
+import os
+import threading
+
+try:
+    from faster_whisper import WhisperModel, BatchedInferencePipeline
+except ImportError:
+    WhisperModel = None
+
+from meetingMinutes import TranscriptionBackend
+
+# Configuration
+local_model = "large-v3"  # faster-whisper model name, or path to a converted CTranslate2 model
+local_compute_type = "int8"  # Quantization of the weights, int8 is the fastest on the CPU
+local_batch_size = 8  # 30-second windows of a chunk decoded in one inference call
+local_language = None  # Language of the meetings ('zh', 'en'...), None to detect it
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """
+    Offline transcription by a quantized Whisper model running on the CPU (faster-whisper / CTranslate2).
+    Each chunk is cut into 30-second windows decoded in batches, one chunk at a time using all the cores.
+    The backend is shared by the runs of the process, which take turns to decode their chunks.
+    """
+    name = "local"
+    workers = 1
+
+    def __init__(self, model=local_model, compute_type=local_compute_type, batch_size=local_batch_size,
+                 threads=None, language=local_language):
+        """
+        Load the model.
+        :param model: Model name or path (optional)
+        :param compute_type: Quantization of the weights (optional)
+        :param batch_size: Windows decoded in one inference call (optional)
+        :param threads: Number of CPU threads (optional, all the cores by default)
+        :param language: Language of the meetings (optional, detected by default)
+        """
+        if WhisperModel is None:
+            raise ImportError("The local transcription backend needs faster-whisper: pip install faster-whisper")
+        self.model = f"faster-whisper:{model}:{compute_type}"
+        self.batch_size = batch_size
+        self.language = language
+        threads = os.cpu_count() if threads is None else threads
+        whisper = WhisperModel(model, device='cpu', compute_type=compute_type, cpu_threads=threads)
+        self.pipeline = BatchedInferencePipeline(model=whisper)
+        self.lock = threading.Lock()
+
+    def transcribe_segments(self, filename, data, run=None):
+        """
+        Convert an encoded audio chunk into timestamped segments of text, decoding it in memory.
+        :param filename: Name of the chunk
+        :param data: Encoded chunk
+        :param run: Pipeline run, whose cancellation stops the decoding between two segments (optional)
+        :return: Segments, with their start and end in seconds from the start of the chunk and their log probability
+        """
+        # The segments are decoded as they are iterated over, by a single chunk at a time
+        results = []
+        with self.lock:
+            segments, _ = self.pipeline.transcribe(io.BytesIO(data), batch_size=self.batch_size,
+                                                   language=self.language)
+            for segment in segments:
+                if run is not None:
+                    run.check()
+                results.append({'start': segment.start, 'end': segment.end, 'text': segment.text,
+                                'avg_logprob': segment.avg_logprob})
+        return results
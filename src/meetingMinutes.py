@@ -1,72 +1,397 @@
 import os
 import sys
+import time
+import random
 import datetime
-import uuid
 import math
+import difflib
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import dotenv
-from groq import Groq
-from pydub import AudioSegment
-from docx import Document
+import ffmpeg
+
+from audioChunker import AudioChunk, max_upload_size, split_audio_stream
+from convertMKVtoMP3 import encoding_profiles, profile_options, upload_profile
+from transcriptionCache import TranscriptionCache, cache_key
+from audioCache import AudioCache, audio_key, file_digest
+from pipelineRun import PipelineRun, PipelineCancelled, job_directory
+from runReport import save_run_report, usage_measures
+from transcriptSegments import (Segment, segments_from_response, filter_segments, segments_text, segments_in_range,
+                                format_timestamp)
+from outputWriters import MinutesOutput, transcript_section
+from searchIndex import SearchIndex
+from voiceActivity import TimeMap, trim_silence, trimming_settings
+from speakerDiarization import diarize, assign_speakers, speaker_turns, format_speaker_transcript
 
 # Models
+transcription_backend = "groq"  # 'groq' (API) or 'local' (Whisper on the CPU of this machine, see localWhisper.py)
 model_whisper = "whisper-large-v3"
 #model_gpt = "llama3-groq-70b-8192-tool-use-preview"
 model_gpt = "llama-3.1-70b-versatile"
 
+# Extractions
+# 'sequential': one request after the other, 'concurrent': the three requests in parallel,
+# 'single': one request returning the three sections as JSON (falls back to 'concurrent' if the answer is invalid)
+extraction_mode = "concurrent"
+max_input_tokens = 6000  # Estimated transcript tokens sent in one request, longer transcripts are processed in segments
+
+# Silences
+silence_trimming = True  # Remove the long silences before the upload, the times of the transcript are restored
+
+# Output
+output_formats = ['docx']  # Formats of the minutes: 'docx', 'md', 'txt', 'srt', 'vtt' and 'json', written in one pass
+
+search_indexing = True  # Add each meeting to the search index of all the meetings (see searchIndex.py)
+
+# Speakers
+speaker_diarization = False  # Label the speaker of each part of the transcript (offline, see speakerDiarization.py)
+speaker_count = None  # Number of speakers of the meetings, None to find it
+
+# Concurrency
+max_workers = 4  # Number of chunks exported and uploaded at the same time
+max_retries = 5  # Number of attempts for a request refused by the provider
+backoff_base = 1.0  # Delay in seconds before the first retry, doubled on each attempt
+
+# Merging of overlapping chunks
+overlap_search_chars = 80  # Characters compared at each join
+overlap_min_chars = 4  # Shortest repeated text removed at a join
+overlap_slack_chars = 12  # Characters tolerated around the repeated text (words garbled at the cut)
+
+# Raw sample formats of ffmpeg, by sample width in bytes
+pcm_formats = {1: 'u8', 2: 's16le', 4: 's32le'}
+
+# API clients created by `create_client`, by key and server
+# groq, docx and dotenv are imported by the functions using them, so that importing this module stays fast
+clients = {}
+clients_lock = threading.Lock()
+
+# Local transcription backends created by `create_backend`, by name: their model is loaded once per process
+local_backends = {}
+local_backends_lock = threading.Lock()
+
 
-def split_audio(file_path):
+def encode_chunk(chunk, profile):
     """
-    Cutting the audio file so that it can be processed within the limits of the API.
-    :param file_path: Path to audio file
-    :return: Audio file cut into chunks
+    Encode an audio chunk with an encoding profile, in memory: the samples are piped to ffmpeg and back.
+    :param chunk: Audio chunk (`AudioSegment`)
+    :param profile: Name of the encoding profile
+    :return: Encoded chunk
     """
-    audio = AudioSegment.from_mp3(file_path)
-    max_size = 25 * 1024 * 1024  # 25 MB
-    chunk_length_ms = math.floor(0.9 * 1000 * (max_size / (audio.frame_rate * audio.frame_width)))
-    chunks = [audio[i:i + chunk_length_ms] for i in range(0, len(audio), int(chunk_length_ms))]
-    return chunks
+    data, _ = (
+        ffmpeg
+        .input('pipe:', format=pcm_formats[chunk.sample_width], ar=chunk.frame_rate, ac=chunk.channels)
+        .output('pipe:', **profile_options(profile))
+        .run(input=chunk.raw_data, capture_stdout=True, capture_stderr=True)
+    )
+    return data
+
+
+def call_with_backoff(request, *args, run=None, **kwargs):
+    """
+    Send a request to the API, retrying with an exponential backoff when the provider is rate limiting or unavailable.
+    :param request: API method to call
+    :param run: Pipeline run, whose cancellation stops the retries and interrupts the wait between them (optional)
+    :return: API response
+    """
+    from groq import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+
+    run = PipelineRun() if run is None else run
+    for attempt in range(max_retries):
+        run.check()
+        try:
+            return request(*args, **kwargs)
+        except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as e:
+            if attempt == max_retries - 1:
+                raise
+            delay = backoff_base * 2 ** attempt + random.uniform(0, backoff_base)
+            response = getattr(e, 'response', None)
+            retry_after = response.headers.get('retry-after') if response is not None else None
+            if retry_after is not None:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            print(f"Request failed ({type(e).__name__}), retrying in {delay:.1f}s.")
+            if run.cancel_event.wait(delay):
+                raise PipelineCancelled()
 
 
-def transcribe_audio(client,audio_chunks):
+def create_client():
+    """
+    Create the API client from the `GROQ_API_KEY` variable, exiting if it is not set.
+    The client is created once per key and server, and reused by the following runs with its open connections.
+    :return: API client
+    """
+    import dotenv
+    from groq import Groq
+
+    dotenv.load_dotenv()
+    api_key = os.getenv('GROQ_API_KEY')
+    if api_key is None:
+        print("API_KEY variable is not set: set it.")
+        sys.exit(1)
+    key = (api_key, os.getenv('GROQ_BASE_URL'))
+    with clients_lock:
+        if key not in clients:
+            clients[key] = Groq(api_key=api_key)
+        return clients[key]
+
+
+class TranscriptionBackend:
+    """
+    Engine converting encoded audio chunks into text.
+    """
+    name = None
+    model = None  # Identifies the engine and its settings in the transcription cache
+    max_size = None  # Largest chunk accepted in bytes, None if unlimited
+    workers = 1  # Number of chunks transcribed at the same time
+
+    def transcribe_segments(self, filename, data, run=None):
+        """
+        Convert an encoded audio chunk into timestamped segments of text.
+        Backends without timestamps return the whole text as a single segment, ending at the end of the chunk.
+        :param filename: Name of the chunk, its extension gives the audio format
+        :param data: Encoded chunk
+        :param run: Pipeline run, whose cancellation stops the transcription (optional)
+        :return: Segments, with their start and end in seconds from the start of the chunk (None for the end),
+            and the average log probability of their tokens (`avg_logprob`) if the backend gives it
+        """
+        raise NotImplementedError
+
+
+class GroqBackend(TranscriptionBackend):
+    """
+    Transcription by the Whisper model of the Groq API.
+    """
+    name = "groq"
+    max_size = max_upload_size
+
+    def __init__(self, client, model=model_whisper, workers=None):
+        """
+        Initialise the backend.
+        :param client: API client
+        :param model: Transcription model (optional)
+        :param workers: Number of chunks uploaded at the same time (optional, `max_workers` by default)
+        """
+        self.client = client
+        self.model = model
+        self.workers = max_workers if workers is None else workers
+
+    def transcribe_segments(self, filename, data, run=None):
+        """
+        Upload an encoded audio chunk to the API and get its timestamped segments.
+        :param filename: Name of the chunk, its extension gives the audio format
+        :param data: Encoded chunk
+        :param run: Pipeline run, whose cancellation stops the retries of the upload (optional)
+        :return: Segments, with their start and end in seconds from the start of the chunk
+        """
+        transcription = call_with_backoff(self.client.audio.transcriptions.create, file=(filename, data),
+                                          model=self.model, response_format='verbose_json', run=run)
+        segments = transcription.model_dump().get('segments')
+        if not segments:
+            return [{'start': 0.0, 'end': None, 'text': transcription.text}]
+        return [{'start': segment['start'], 'end': segment['end'], 'text': segment['text'],
+                 'avg_logprob': segment.get('avg_logprob')} for segment in segments]
+
+
+def create_backend(name=None, client=None):
+    """
+    Create the transcription backend of a run.
+    The local backend is created once, and shared by the following runs without loading its model again.
+    :param name: 'groq' or 'local' (optional, `transcription_backend` by default)
+    :param client: API client of the 'groq' backend (optional, created from the `GROQ_API_KEY` variable by default)
+    :return: Transcription backend
+    """
+    name = transcription_backend if name is None else name
+    if name == 'groq':
+        return GroqBackend(create_client() if client is None else client)
+    if name == 'local':
+        from localWhisper import LocalWhisperBackend
+        with local_backends_lock:
+            if name not in local_backends:
+                local_backends[name] = LocalWhisperBackend()
+            return local_backends[name]
+    raise ValueError("Unknown transcription backend: {}".format(name))
+
+
+def as_backend(client):
+    """
+    Get the transcription backend of a client.
+    :param client: Transcription backend, or API client used with the 'groq' backend
+    :return: Transcription backend
     """
-    Convert audio files that have been cut into chunks into text.
+    return client if isinstance(client, TranscriptionBackend) else GroqBackend(client)
+
+
+def transcribe_chunk(client, chunk, cache=None, profile=None, run=None, chunk_id=None, offset=None):
+    """
+    Convert a single audio chunk into timestamped segments of text.
+    The chunk is encoded in memory and uploaded without going through a temporary file.
+    :param client: Transcription backend, or API client used with the 'groq' backend
+    :param chunk: Audio chunk (`AudioChunk` or `AudioSegment`)
+    :param cache: Transcription cache, a cached chunk is not uploaded (optional)
+    :param profile: Name of the encoding profile of an `AudioSegment` (optional, `upload_profile` by default)
+    :param run: Pipeline run, recording the measures of the export and of the transcription (optional)
+    :param chunk_id: Index of the chunk in the recording (optional)
+    :param offset: Start of the chunk in the recording in seconds (optional, given by an `AudioChunk` by default)
+    :return: Segments of the chunk, timed from the start of the recording, without the hallucinations
+    """
+    run = PipelineRun() if run is None else run
+    start = time.perf_counter()
+    if isinstance(chunk, AudioChunk):
+        filename, data = chunk.filename, chunk.read()
+        audio_seconds = chunk.duration
+        chunk_id = chunk.index if chunk_id is None else chunk_id
+    else:
+        profile = upload_profile if profile is None else profile
+        filename, data = "chunk{}".format(encoding_profiles[profile]['extension']), encode_chunk(chunk, profile)
+        audio_seconds = chunk.duration_seconds
+    run.record('chunk_export', time.perf_counter() - start, bytes_out=len(data), audio_seconds=audio_seconds)
+
+    backend = as_backend(client)
+    if backend.max_size is not None and len(data) > backend.max_size:
+        raise ValueError("Audio chunk is too large: {} bytes".format(len(data)))
+
+    raw_segments = None
+    if cache is not None:
+        key = cache_key(data, backend.model, response_format='verbose_json')
+        cached = cache.get(key)
+        if cached is not None:
+            raw_segments = json.loads(cached)
+            run.record('cache_hit', 0.0, bytes_in=len(data), audio_seconds=audio_seconds)
+
+    if raw_segments is None:
+        start = time.perf_counter()
+        raw_segments = backend.transcribe_segments(filename, data, run)
+        value = json.dumps(raw_segments, ensure_ascii=False)
+        run.record('transcription', time.perf_counter() - start, backend=backend.name, bytes_in=len(data),
+                   bytes_out=len(value.encode('utf-8')), audio_seconds=audio_seconds)
+        if cache is not None:
+            cache.put(key, value)
+
+    offset = getattr(chunk, 'start', 0.0) if offset is None else offset
+    return filter_segments(segments_from_response(raw_segments, chunk_id, offset, audio_seconds))
+
+
+def overlap_length(previous, current):
+    """
+    Find the length of the beginning of a text that repeats the end of the previous text.
+    :param previous: Text of the previous chunk
+    :param current: Text of the current chunk
+    :return: Number of characters to remove at the beginning of the current text
+    """
+    tail = previous[-overlap_search_chars:]
+    head = current[:overlap_search_chars]
+    match = difflib.SequenceMatcher(None, tail, head, autojunk=False).find_longest_match(0, len(tail), 0, len(head))
+    if (match.size < overlap_min_chars or match.a + match.size < len(tail) - overlap_slack_chars
+            or match.b > overlap_slack_chars):
+        return 0
+    return match.b + match.size
+
+
+def merge_chunk_segments(merged, segments, overlaps=True):
+    """
+    Add the segments of a chunk to the segments of the previous chunks, removing what is repeated at the join.
+    The segments of an overlap already covered by the previous chunk are dropped, and the text repeated at the
+    beginning of the first segment kept (backends without timestamps return a whole chunk as one segment).
+    :param merged: Segments of the previous chunks, extended in place
+    :param segments: Segments of the chunk
+    :param overlaps: Whether the chunk overlaps the previous one (optional)
+    :return: Segments added
+    """
+    if merged and overlaps:
+        covered = merged[-1].end
+        segments = [segment for segment in segments if (segment.start + segment.end) / 2 >= covered]
+        if segments and segments[0].start < covered:
+            text = segments[0].text.strip()
+            repeated = overlap_length(merged[-1].text.strip(), text)
+            if repeated:
+                segments[0].text = text[repeated:]
+    added = [segment for segment in segments if segment.text.strip()]
+    merged.extend(added)
+    return added
+
+
+def transcribe_audio(client, audio_chunks, workers=None, cache=None, run=None, profile=None, output=None,
+                     time_map=None):
+    """
+    Convert audio files that have been cut into chunks into timestamped segments of text.
+    The chunks are exported and transcribed concurrently, the segments are joined in their original order.
+    :param client: Transcription backend, or API client used with the 'groq' backend
     :param audio_chunks: Audio file cut into chunks
-    :return: Audio file text
+    :param workers: Maximum number of chunks processed at the same time (optional, set by the backend by default)
+    :param cache: Transcription cache (optional)
+    :param run: Pipeline run, for progress, cancellation and checkpoints of each chunk (optional)
+    :param profile: Name of the encoding profile of `AudioSegment` chunks (optional, `upload_profile` by default)
+    :param output: Output files, where the segments are written as soon as the chunks before them are done (optional)
+    :param time_map: Time map of chunks cut from a trimmed recording, to time the segments in the original (optional)
+    :return: Segments of the audio file, timed from its start (`segments_text` gives the text)
     """
-    transcriptions = []
-    for chunk in audio_chunks:
-        temp_filename = "temp_audio_{}.mp3".format(uuid.uuid4())
-        temp_audio_path = os.path.join("output", temp_filename)
+    backend = as_backend(client)
+    workers = backend.workers if workers is None else workers
+    run = PipelineRun() if run is None else run
+    audio_chunks = list(audio_chunks)
+    run.start_stage("Transcription", len(audio_chunks))
 
-        chunk.export(temp_audio_path, format="mp3", bitrate="192k")  # You can adjust the bitrate as needed
-        file_size = os.path.getsize(temp_audio_path)
+    # An `AudioChunk` knows its start, `AudioSegment` chunks follow each other from the start of the recording
+    offsets = []
+    position = 0.0
+    for chunk in audio_chunks:
+        if isinstance(chunk, AudioChunk):
+            offsets.append(None)
+        else:
+            offsets.append(position)
+            position += chunk.duration_seconds
 
-        if file_size > 25 * 1024 * 1024:
-            os.remove(temp_audio_path)
-            raise ValueError("Audio chunk is too large: {} bytes".format(file_size))
+    def process(indexed_chunk):
+        index, chunk = indexed_chunk
+        run.check()
+        checkpoint = run.load(f"transcript_{index:04d}")
+        if checkpoint is None or 'segments' not in checkpoint:
+            segments = transcribe_chunk(backend, chunk, cache, profile, run, chunk_id=index, offset=offsets[index])
+            if time_map is not None:
+                time_map.restore(segments)
+            run.save(f"transcript_{index:04d}", {'segments': [segment.to_dict() for segment in segments]})
+        else:
+            segments = [Segment.from_dict(fields) for fields in checkpoint['segments']]
+        run.advance()
+        return segments, getattr(chunk, 'overlap', 0) > 0
 
-        with open(temp_audio_path, 'rb') as f:
-            transcription = client.audio.transcriptions.create(file=f, model=model_whisper)
-            
-        if "请不吝点赞 订阅 转发 打赏支持明镜与点点栏目" in transcription.text:
-            continue
-        
-        transcriptions.append(transcription.text)
+    # The results arrive in the order of the chunks, each one is merged as soon as it is available
+    merged = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for segments, overlaps in executor.map(process, enumerate(audio_chunks)):
+            added = merge_chunk_segments(merged, segments, overlaps)
+            if output is not None:
+                output.add_segments(added)
+    return merged
 
-        # Cleaning
-        os.remove(temp_audio_path)
 
-    return " ".join(transcriptions)
+def record_completion(run, operation, start, response_dict):
+    """
+    Record the duration and the token usage of a chat completion.
+    :param run: Pipeline run (None to not record)
+    :param operation: Operation name
+    :param start: Time of the request (`time.perf_counter()`)
+    :param response_dict: Response of the API
+    """
+    if run is not None:
+        run.record(operation, time.perf_counter() - start, **usage_measures(response_dict))
 
 
-def abstract_summary_extraction(client,transcription):
+def abstract_summary_extraction(client,transcription,run=None):
     """
     From the audio file transcript, create a summary.
     :param transcription: Transcription of audio file
+    :param run: Pipeline run, recording the duration and token usage of the request (optional)
     :return: Abstract summary
     """
-    response = client.chat.completions.create(
+    start = time.perf_counter()
+    response = call_with_backoff(
+        client.chat.completions.create,
+        run=run,
         model=model_gpt,
         temperature=0,
         messages=[
@@ -81,16 +406,21 @@ def abstract_summary_extraction(client,transcription):
         ]
     )
     response_dict = response.model_dump()
+    record_completion(run, 'llm_abstract_summary', start, response_dict)
     return response_dict['choices'][0]['message']['content']
 
 
-def key_points_extraction(client,transcription):
+def key_points_extraction(client,transcription,run=None):
     """
     From the audio file transcript, create a list of key points.
     :param transcription: Transcription of audio file
+    :param run: Pipeline run, recording the duration and token usage of the request (optional)
     :return: Key points
     """
-    response = client.chat.completions.create(
+    start = time.perf_counter()
+    response = call_with_backoff(
+        client.chat.completions.create,
+        run=run,
         model=model_gpt,
         temperature=0,
         messages=[
@@ -105,22 +435,57 @@ def key_points_extraction(client,transcription):
         ]
     )
     response_dict = response.model_dump()
+    record_completion(run, 'llm_key_points', start, response_dict)
     return response_dict['choices'][0]['message']['content']
 
 
-def action_item_extraction(client,transcription):
+def action_item_extraction(client,transcription,run=None):
     """
     From the audio file transcript, create a list of action item.
     :param transcription: Transcription of audio file
+    :param run: Pipeline run, recording the duration and token usage of the request (optional)
     :return: Action item
     """
-    response = client.chat.completions.create(
+    start = time.perf_counter()
+    response = call_with_backoff(
+        client.chat.completions.create,
+        run=run,
+        model=model_gpt,
+        temperature=0,
+        messages=[
+            {
+                "role": "system",
+                "content": "您是一位训练有素的 AI，专门分析对话并提取需要执行的操作。根据以下文本，找出已达成一致或提及需要执行的任务、使命或操作。这些可能是分配给特定人员的任务，也可能是小组决定采取的常规操作。请列出这些操作的清晰简洁的清单。如果文本标注了说话人，请注明每项操作的负责人。"
+            },
+            {
+                "role": "user",
+                "content": transcription
+            }
+        ]
+    )
+    response_dict = response.model_dump()
+    record_completion(run, 'llm_action_items', start, response_dict)
+    return response_dict['choices'][0]['message']['content']
+
+
+def structured_extraction(client,transcription,run=None):
+    """
+    From the audio file transcript, create the summary, the key points and the action items in a single request.
+    :param transcription: Transcription of audio file
+    :param run: Pipeline run, recording the duration and token usage of the request (optional)
+    :return: Abstract summary, key points and action items
+    """
+    start = time.perf_counter()
+    response = call_with_backoff(
+        client.chat.completions.create,
+        run=run,
         model=model_gpt,
         temperature=0,
+        response_format={"type": "json_object"},
         messages=[
             {
                 "role": "system",
-                "content": "您是一位训练有素的 AI，专门分析对话并提取需要执行的操作。根据以下文本，找出已达成一致或提及需要执行的任务、使命或操作。这些可能是分配给特定人员的任务，也可能是小组决定采取的常规操作。请列出这些操作的清晰简洁的清单。"
+                "content": "您是一位训练有素、高度熟练的人工智能，能够理解和综合语言，并分析对话。根据以下文本，完成三项任务：第一，用一个抽象且简洁的段落进行总结，帮助人们理解讨论的主要观点，而无需阅读全文；第二，识别并列出已讨论或提及的主要要点；第三，找出已达成一致或提及需要执行的任务、使命或操作，并列出清晰简洁的清单。请只返回一个 JSON 对象，包含三个字符串字段：\"abstract_summary\"、\"key_points\" 和 \"action_items\"。"
             },
             {
                 "role": "user",
@@ -129,90 +494,438 @@ def action_item_extraction(client,transcription):
         ]
     )
     response_dict = response.model_dump()
+    record_completion(run, 'llm_structured', start, response_dict)
+    return parse_structured_minutes(response_dict['choices'][0]['message']['content'])
+
+
+def parse_structured_minutes(content):
+    """
+    Validate the answer of a structured extraction.
+    :param content: JSON answer of the model
+    :return: Abstract summary, key points and action items
+    """
+    sections = json.loads(content or "null")
+    if not isinstance(sections, dict):
+        raise ValueError("The structured answer is not a JSON object")
+
+    minutes = {}
+    for key in ('abstract_summary', 'key_points', 'action_items'):
+        value = sections.get(key)
+        if isinstance(value, list) and all(isinstance(item, str) for item in value):
+            value = "\n".join(f"- {item}" for item in value)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError("The structured answer has no valid '{}' section".format(key))
+        minutes[key] = value
+    return minutes
+
+
+extractions = {
+    'abstract_summary': abstract_summary_extraction,
+    'key_points': key_points_extraction,
+    'action_items': action_item_extraction,
+}
+
+merge_prompts = {
+    'abstract_summary': "您是一位训练有素、高度熟练的人工智能，能够理解和综合语言。以下是同一次会议连续各部分的摘要。请将它们合并成一个抽象且简洁的段落，保留最重要的要点，提供一个连贯且可读的摘要。请避免重复、不必要的细节或无关要点。",
+    'key_points': "您是一位训练有素的人工智能，专门从关键点中提取信息。以下是同一次会议连续各部分的要点清单。请将它们合并成一份清单，去除重复的要点，只保留对讨论本质至关重要的想法、结果或主题。",
+    'action_items': "您是一位训练有素的 AI，专门分析对话并提取需要执行的操作。以下是同一次会议连续各部分的操作清单。请将它们合并成一份清晰简洁的清单，去除重复的操作，并保留负责人员等信息。",
+}
+
+
+def merge_extraction(client,section,partials,run=None):
+    """
+    Merge the extractions made on segments of the transcript into a single one.
+    :param section: Extracted section ('abstract_summary', 'key_points' or 'action_items')
+    :param partials: Extractions of consecutive segments of the transcript
+    :param run: Pipeline run, recording the duration and token usage of the request (optional)
+    :return: Merged extraction
+    """
+    start = time.perf_counter()
+    response = call_with_backoff(
+        client.chat.completions.create,
+        run=run,
+        model=model_gpt,
+        temperature=0,
+        messages=[
+            {
+                "role": "system",
+                "content": merge_prompts[section]
+            },
+            {
+                "role": "user",
+                "content": "\n\n".join(f"第 {i + 1} 部分：\n{partial}" for i, partial in enumerate(partials))
+            }
+        ]
+    )
+    response_dict = response.model_dump()
+    record_completion(run, f'llm_merge_{section}', start, response_dict)
     return response_dict['choices'][0]['message']['content']
 
 
-def meeting_minutes(client,transcription):
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens of a text without calling the API.
+    CJK characters are counted as one token each, other characters as one token every three characters.
+    :param text: Text
+    :return: Estimated number of tokens
+    """
+    cjk_count = len(re.findall(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]', text))
+    return cjk_count + math.ceil((len(text) - cjk_count) / 3)
+
+
+def split_transcription(transcription, max_tokens=None):
+    """
+    Split the transcript into segments under a token budget, at the end of sentences when possible.
+    :param transcription: Transcription of audio file
+    :param max_tokens: Maximum estimated tokens of a segment (optional, `max_input_tokens` by default)
+    :return: Segments of the transcript
+    """
+    max_tokens = max_input_tokens if max_tokens is None else max_tokens
+
+    segments = []
+    current = []
+    current_tokens = 0
+    for sentence in re.findall(r'[^。！？.!?]*[。！？.!?]*\s*', transcription):
+        tokens = estimate_tokens(sentence)
+        if tokens > max_tokens:
+            # Sentence too long on its own: cut it at a character count within the budget
+            step = max(1, len(sentence) * max_tokens // tokens)
+            pieces = [sentence[i:i + step] for i in range(0, len(sentence), step)]
+        else:
+            pieces = [sentence]
+        for piece in pieces:
+            tokens = estimate_tokens(piece)
+            if current and current_tokens + tokens > max_tokens:
+                segments.append("".join(current))
+                current = []
+                current_tokens = 0
+            current.append(piece)
+            current_tokens += tokens
+    if current:
+        segments.append("".join(current))
+    return [segment for segment in segments if segment.strip()]
+
+
+def extract_sections(client,transcription,mode,sections=None,run=None,save=True):
+    """
+    Execution of the extractions on a transcript that fits in a single request.
+    :param transcription: Transcription of audio file
+    :param mode: 'sequential', 'concurrent' or 'single'
+    :param sections: Names of the sections to extract (optional, all by default)
+    :param run: Pipeline run, recording the requests and saving each section as soon as it is extracted (optional)
+    :param save: Save the sections as checkpoints of the run, not done for a segment of the transcript (optional)
+    :return: Extracted sections
+    """
+    sections = list(extractions) if sections is None else sections
+    from groq import BadRequestError
+
+    run = PipelineRun() if run is None else run
+
+    if mode == 'single':
+        try:
+            minutes = structured_extraction(client,transcription,run)
+        except (ValueError, BadRequestError) as e:
+            print(f"Invalid structured answer ({e}), falling back to separate requests.")
+            mode = 'concurrent'
+        else:
+            for section in sections:
+                if save:
+                    run.save(f"section_{section}", minutes[section])
+            return {section: minutes[section] for section in sections}
+
+    results = {}
+    if mode == 'concurrent':
+        with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+            futures = {section: executor.submit(extractions[section], client, transcription, run)
+                       for section in sections}
+        error = None
+        for section, future in futures.items():
+            try:
+                results[section] = future.result()
+            except Exception as e:
+                error = e if error is None else error
+                continue
+            if save:
+                run.save(f"section_{section}", results[section])
+        if error is not None:
+            raise error
+    elif mode == 'sequential':
+        for section in sections:
+            results[section] = extractions[section](client,transcription,run)
+            if save:
+                run.save(f"section_{section}", results[section])
+    else:
+        raise ValueError("Unknown extraction mode: {}".format(mode))
+    return results
+
+
+def reduce_extractions(client,section,partials,run=None):
+    """
+    Merge the extractions of all the segments of the transcript, in several levels if they exceed the token budget.
+    :param section: Extracted section ('abstract_summary', 'key_points' or 'action_items')
+    :param partials: Extractions of consecutive segments of the transcript
+    :param run: Pipeline run, recording the requests (optional)
+    :return: Merged extraction
+    """
+    while len(partials) > 1:
+        groups = []
+        group_tokens = 0
+        for partial in partials:
+            tokens = estimate_tokens(partial)
+            if not groups or (len(groups[-1]) >= 2 and group_tokens + tokens > max_input_tokens):
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(partial)
+            group_tokens += tokens
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            partials = list(executor.map(
+                lambda group: merge_extraction(client, section, group, run) if len(group) > 1 else group[0], groups))
+    return partials[0]
+
+
+def map_reduce_extraction(client,transcription,mode,sections=None,run=None):
+    """
+    Execution of the extractions on a transcript too long for a single request.
+    Each segment of the transcript is extracted in parallel, then the partial extractions are merged.
+    :param transcription: Transcription of audio file
+    :param mode: 'sequential', 'concurrent' or 'single', used for each segment
+    :param sections: Names of the sections to extract (optional, all by default)
+    :param run: Pipeline run, recording the requests and saving each section as soon as it is merged (optional)
+    :return: Extracted sections
+    """
+    sections = list(extractions) if sections is None else sections
+    run = PipelineRun() if run is None else run
+
+    def reduce_section(section):
+        merged = reduce_extractions(client, section, [partial[section] for partial in partials], run)
+        run.save(f"section_{section}", merged)
+        return merged
+
+    segments = split_transcription(transcription)
+    print(f"Long transcript: extracting from {len(segments)} segments.")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        partials = list(executor.map(
+            lambda segment: extract_sections(client, segment, mode, sections, run, save=False), segments))
+        return dict(zip(sections, executor.map(reduce_section, sections)))
+
+
+def meeting_minutes(client,transcription,mode=None,run=None):
     """
     Execution of all extractions.
     :param transcription: Transcription of audio file
+    :param mode: 'sequential', 'concurrent' or 'single' (optional, `extraction_mode` by default)
+    :param run: Pipeline run, the sections already extracted by the job are reused (optional)
     :return: List of all extractions
     """
-    abstract_summary = abstract_summary_extraction(client,transcription)
-    key_points = key_points_extraction(client,transcription)
-    action_items = action_item_extraction(client,transcription)
+    mode = extraction_mode if mode is None else mode
+    run = PipelineRun() if run is None else run
+    start = time.perf_counter()
+
+    sections = {section: run.load(f"section_{section}") for section in extractions}
+    missing = [section for section, value in sections.items() if value is None]
+    if missing and estimate_tokens(transcription) > max_input_tokens:
+        sections.update(map_reduce_extraction(client,transcription,mode,missing,run))
+    elif missing:
+        sections.update(extract_sections(client,transcription,mode,missing,run))
+
+    print(f"Extractions completed in {time.perf_counter() - start:.1f}s ({mode} mode).")
     return {
         'complete_transcription': transcription,
-        'abstract_summary': abstract_summary,
-        'key_points': key_points,
-        'action_items': action_items
+        **sections
     }
 
 
-def save_as_docx(minutes, filename, output_dir):
+def diarize_recording(audio_file_path, run, speakers=None):
+    """
+    Find the speaker turns of a recording, reusing those found by a previous attempt of the job.
+    :param audio_file_path: Path to the audio file
+    :param run: Pipeline run
+    :param speakers: Number of speakers (optional, `speaker_count` by default)
+    :return: Speaker turns
+    """
+    turns = run.load('speakers')
+    if turns is None:
+        start = time.perf_counter()
+        turns = diarize(audio_file_path, speaker_count if speakers is None else speakers, run)
+        run.record('diarization', time.perf_counter() - start, audio_seconds=turns[-1]['end'] if turns else 0.0)
+        run.save('speakers', turns)
+        print(f"Speaker diarization: {len({turn['speaker'] for turn in turns})} speakers found.")
+    return turns
+
+
+def summarize_range(client, segments, start=None, end=None, mode=None):
+    """
+    Create the minutes of a part of the meeting from its segments, without transcribing it again.
+    :param segments: Segments of the recording, in order
+    :param start: Start of the part in seconds (optional, start of the recording by default)
+    :param end: End of the part in seconds (optional, end of the recording by default)
+    :param mode: 'sequential', 'concurrent' or 'single' (optional, `extraction_mode` by default)
+    :return: List of all extractions of the part
+    """
+    part = segments_in_range(segments, start, end)
+    if not part:
+        raise ValueError("No transcript between {} and {}".format(start, end))
+    return meeting_minutes(client, segments_text(part), mode)
+
+
+def prepare_recording(audio_file_path, run, trim=None):
     """
-    Save extraction as docx file.
-    :param minutes: List of texts to be added
-    :param filename: File name
-    :param output_dir: Output directory
+    Get the recording to split: the audio file itself if the ingest stage prepared it, or the audio file without
+    its long silences. The trimmed recording is kept in the audio cache, so that the following runs on the same
+    recording reuse it instead of trimming it again.
+    :param audio_file_path: Path to the audio file
+    :param run: Pipeline run
+    :param trim: Remove the long silences (optional, `silence_trimming` by default)
+    :return: Path to the recording to split, the time map of its segments (None if it was not trimmed), and whether
+        it is ready for the upload (prepared by the pipeline in the upload format) or must be encoded chunk by chunk
     """
-    # Vérifie si le répertoire de sortie existe, sinon le crée
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    trim = silence_trimming if trim is None else trim
+    cache = AudioCache()
+    start = time.perf_counter()
+    digest = file_digest(audio_file_path)
+    prepared = cache.get(audio_key(digest, upload=upload_profile))
+    if prepared is not None:
+        return audio_file_path, TimeMap(prepared['pieces']) if prepared['pieces'] is not None else None, True
+    if not trim:
+        return audio_file_path, None, False
 
-    doc = Document()
-    for key, value in minutes.items():
-        # Replace underscores with spaces and capitalize each word for the heading
-        heading = ' '.join(word.capitalize() for word in key.split('_'))
-        doc.add_heading(heading, level=1)
-        doc.add_paragraph(value)
-        # Add a line break between sections
-        doc.add_paragraph()
-    doc.save(filename)
+    key = audio_key(digest, profile=upload_profile, start_time=None, end_time=None, trimming=trimming_settings())
+    trimmed = cache.get(key)
+    if trimmed is None:
+        temp_path = cache.temp_path(encoding_profiles[upload_profile]['extension'])
+        time_map = trim_silence(audio_file_path, temp_path, upload_profile, run)
+        if time_map is None:
+            trimmed = cache.put(key)
+        else:
+            trimmed = cache.put(key, time_map.to_list(), temp_path)
+            cache.put(audio_key(trimmed['digest'], upload=upload_profile), trimmed['pieces'])
+    else:
+        run.record('audio_cache_hit', time.perf_counter() - start, bytes_in=os.path.getsize(audio_file_path))
+    if trimmed['path'] is None:
+        return audio_file_path, None, False
+    return trimmed['path'], TimeMap(trimmed['pieces']) if trimmed['pieces'] is not None else None, True
 
 
-def meeting_minutes_main(audio_file_path, choice, name_docx=None):
+def meeting_minutes_main(audio_file_path, choice, name_docx=None, run=None, backend=None, diarization=None,
+                         formats=None):
     """
     Main code for switching from an audio file to a transcription in a text file.
-    :param audio_file_path: Path to the audio file (`.mp3`)
+    :param audio_file_path: Path to the audio file (`.mp3` or `.ogg`)
     :param choice: Choice between transcribing only or performing all actions ('Full' or 'Transcription')
     :param name_docx: Name of output text file (optional)
+    :param run: Pipeline run, for progress, cancellation and checkpoints (optional, resumable job by default)
+    :param backend: Transcription backend, 'groq' or 'local' (optional, `transcription_backend` by default)
+    :param diarization: Label the speakers of the transcript (optional, `speaker_diarization` by default)
+    :param formats: Formats of the output files (optional, `output_formats` by default)
+    :return: Path to the output text file (the first format)
     """
-    # Configuration
-    dotenv.load_dotenv()
-    api_key = os.getenv('GROQ_API_KEY')
-    if api_key is None:
-        print("API_KEY variable is not set: set it.")
-        sys.exit(1)
-    client = Groq(api_key= api_key,)
-
-    # Split audio into chunks
-    audio_chunks = split_audio(audio_file_path)
-
-    # Always perform transcription
-    transcription = transcribe_audio(client,audio_chunks)
-
-    # Check user's choice
-    if choice == 'Full':
-        # If user chose 'full', perform all actions
-        minutes = meeting_minutes(client,transcription)
-        print("Minutes prepared.")
-    elif choice == 'Transcription':
-        # If user chose 'transcribe', only save the transcription
-        minutes = {
-            'complete_transcription': transcription
-        }
-        print("Transcription completed.")
-    else:
+    if choice not in ('Full', 'Transcription'):
         print("Invalid option. Exiting.")
         sys.exit(1)
 
-    # Creating the output file
+    owns_run = run is None
+    if owns_run:
+        run = PipelineRun(job_dir=job_directory(audio_file_path))
+
+    # Configuration: the API is only needed by the extractions when transcribing locally
+    backend = transcription_backend if backend is None else backend
+    client = create_client() if backend == 'groq' or choice == 'Full' else None
+    transcriber = create_backend(backend, client)
+
+    # Split audio into chunks, encoding them for the upload unless the pipeline already prepared the file
+    # The long silences are removed first, so that they are neither uploaded nor transcribed
+    run.start_stage("Splitting")
+    source_path, time_map, ready = prepare_recording(audio_file_path, run)
+    start = time.perf_counter()
+    chunk_plan = run.load('chunks')
+    if chunk_plan is None:
+        profile = None if ready else upload_profile
+        audio_chunks = list(split_audio_stream(source_path, profile=profile))
+        run.save('chunks', {
+            'profile': profile,
+            'chunks': [[chunk.start, chunk.end, chunk.overlap] for chunk in audio_chunks]
+        })
+    else:
+        audio_chunks = [AudioChunk(source_path, index, chunk_start, chunk_end, overlap, chunk_plan['profile'])
+                        for index, (chunk_start, chunk_end, overlap) in enumerate(chunk_plan['chunks'])]
+    run.record('split', time.perf_counter() - start, bytes_in=os.path.getsize(source_path),
+               audio_seconds=audio_chunks[-1].end if audio_chunks else 0.0)
+
+    # Output files, the transcript is written to them as the chunks are transcribed
     output_dir = "output"
     if name_docx is None:
         now = datetime.datetime.now()
         formatted_date = now.strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f"{output_dir}/meeting_minutes_{formatted_date}.docx"
+        base_path = f"{output_dir}/meeting_minutes_{formatted_date}"
     else:
-        filename = f"{output_dir}/{name_docx}.docx"
-    save_as_docx(minutes, filename, output_dir)
+        base_path = f"{output_dir}/{name_docx}"
+    output = MinutesOutput(base_path, output_formats if formats is None else formats)
+
+    try:
+        # Always perform transcription, reusing the chunks already transcribed
+        # The speakers are found on the CPU while the chunks are being transcribed
+        diarization = speaker_diarization if diarization is None else diarization
+        cache = TranscriptionCache()
+        try:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                speakers = executor.submit(diarize_recording, audio_file_path, run) if diarization else None
+                segments = transcribe_audio(transcriber, audio_chunks, cache=cache, run=run,
+                                            output=None if diarization else output, time_map=time_map)
+            stats = cache.stats()
+            print(f"Transcription cache: {stats['hits']} hits, {stats['misses']} misses.")
+        finally:
+            cache.close()
+
+        # The extractions read the transcript labelled with the speakers, the output shows each turn with its time
+        transcription = segments_text(segments)
+        if speakers is not None:
+            segments = speaker_turns(assign_speakers(segments, speakers.result()))
+            transcription = format_speaker_transcript(segments)
+            output.add_segments(segments)
+
+        # Check user's choice
+        if choice == 'Full':
+            # If user chose 'full', perform all actions
+            run.start_stage("Extraction")
+            minutes = meeting_minutes(client,transcription,run=run)
+            print("Minutes prepared.")
+        else:
+            # If user chose 'transcribe', only save the transcription
+            minutes = {
+                'complete_transcription': transcription
+            }
+            print("Transcription completed.")
+
+        # Completing the output files
+        run.start_stage("Saving")
+        start = time.perf_counter()
+        output.add_sections(minutes)
+        output.close()
+    except BaseException:
+        # A cancelled or failed run leaves no partial minutes under the final names
+        output.discard()
+        raise
+    run.record('output', time.perf_counter() - start, bytes_out=sum(os.path.getsize(path) for path in output.paths))
+    filename = output.paths[0]
+
+    # Indexing of the meeting, so that it can be found by a search over all the meetings
+    if search_indexing:
+        start = time.perf_counter()
+        index = SearchIndex()
+        try:
+            sections = {name: text for name, text in minutes.items() if name != transcript_section}
+            passages = index.add_meeting(os.path.basename(base_path), segments, sections, audio_file_path, filename)
+        finally:
+            index.close()
+        run.record('indexing', time.perf_counter() - start, passages=passages)
+
+    # Report of the measures of the run
+    report_path = save_run_report(run, filename, recording=audio_file_path, choice=choice, backend=backend,
+                                  diarization=diarization)
+    print(f"Run report saved in '{report_path}'.")
+
+    # The job is completed, its checkpoints are no longer needed
+    if owns_run:
+        run.finish()
+
+    return filename
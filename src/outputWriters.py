@@ -0,0 +1,328 @@
+import os
+import json
+
+from transcriptSegments import format_timestamp
+
+# Key of the transcript in the minutes, written segment by segment instead of as a section
+transcript_section = 'complete_transcription'
+partial_suffix = ".part"  # Added to the name of an output file while it is written, removed once it is complete
+
+
+def section_title(name):
+    """
+    Get the heading of a section of the minutes.
+    :param name: Key of the section
+    :return: Heading, the words of the key capitalized
+    """
+    return ' '.join(word.capitalize() for word in name.split('_'))
+
+
+def format_subtitle_time(seconds, separator):
+    """
+    Format a time of a subtitle file.
+    :param seconds: Time in seconds
+    :param separator: Separator of the milliseconds (',' for SRT, '.' for WebVTT)
+    :return: Time as HH:MM:SS,mmm
+    """
+    milliseconds = int(round(seconds * 1000))
+    return "{}{}{:03d}".format(format_timestamp(milliseconds // 1000), separator, milliseconds % 1000)
+
+
+def segment_label(segment):
+    """
+    Get the label of a segment: its time, and its speaker if it is known.
+    :param segment: Segment
+    :return: Label
+    """
+    label = f"[{format_timestamp(segment.start)}]"
+    return f"{label} {segment.speaker}：" if segment.speaker is not None else label
+
+
+class OutputWriter:
+    """
+    Output file of the minutes, written as the segments of the transcript arrive.
+    """
+    extension = None
+
+    def __init__(self, path):
+        """
+        Create the output file, under its partial name until it is complete.
+        :param path: Path to the file
+        """
+        self.path = path
+        self.partial_path = path + partial_suffix
+
+    def add_segments(self, segments):
+        """
+        Add segments of the transcript, in order.
+        :param segments: Segments
+        """
+        raise NotImplementedError
+
+    def add_section(self, name, text):
+        """
+        Add a section of the minutes, after the transcript.
+        :param name: Key of the section
+        :param text: Text of the section
+        """
+        raise NotImplementedError
+
+    def finish(self):
+        """
+        Write the end of the file, under its partial name.
+        """
+        raise NotImplementedError
+
+    def release(self):
+        """
+        Release the file without finishing it.
+        """
+
+    def close(self):
+        """
+        Finish the file and give it its final name.
+        """
+        self.finish()
+        os.replace(self.partial_path, self.path)
+
+    def discard(self):
+        """
+        Delete the unfinished file.
+        """
+        self.release()
+        if os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
+
+
+class TextOutputWriter(OutputWriter):
+    """
+    Output written to a text file, flushed after each batch of segments so that it can be followed.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.file = open(self.partial_path, 'w', encoding='utf-8')
+        self.write_header()
+
+    def write_header(self):
+        """
+        Write the beginning of the file.
+        """
+
+    def write_segment(self, segment):
+        """
+        Write a segment of the transcript.
+        :param segment: Segment
+        """
+        raise NotImplementedError
+
+    def add_segments(self, segments):
+        for segment in segments:
+            self.write_segment(segment)
+        self.file.flush()
+
+    def add_section(self, name, text):
+        pass
+
+    def finish(self):
+        self.file.close()
+
+    def release(self):
+        self.file.close()
+
+
+class PlainTextWriter(TextOutputWriter):
+    """
+    Plain text: one line per segment, then the sections.
+    """
+    extension = ".txt"
+
+    def write_segment(self, segment):
+        self.file.write(f"{segment_label(segment)} {segment.text.strip()}\n")
+
+    def add_section(self, name, text):
+        self.file.write(f"\n{section_title(name)}\n\n{text.strip()}\n")
+
+
+class MarkdownWriter(TextOutputWriter):
+    """
+    Markdown: a heading for the transcript, one paragraph per segment, then a heading per section.
+    """
+    extension = ".md"
+
+    def write_header(self):
+        self.file.write(f"# {section_title(transcript_section)}\n\n")
+
+    def write_segment(self, segment):
+        self.file.write(f"**{segment_label(segment)}** {segment.text.strip()}\n\n")
+
+    def add_section(self, name, text):
+        self.file.write(f"# {section_title(name)}\n\n{text.strip()}\n\n")
+
+
+class SrtWriter(TextOutputWriter):
+    """
+    SubRip subtitles, one cue per segment. The sections are not written.
+    """
+    extension = ".srt"
+    separator = ','
+
+    def __init__(self, path):
+        self.count = 0
+        super().__init__(path)
+
+    def cue(self, segment):
+        """
+        Format the cue of a segment.
+        :param segment: Segment
+        :return: Cue
+        """
+        return "{}\n{} --> {}\n{}\n\n".format(
+            self.count, format_subtitle_time(segment.start, self.separator),
+            format_subtitle_time(segment.end, self.separator),
+            f"{segment.speaker}：{segment.text.strip()}" if segment.speaker is not None else segment.text.strip())
+
+    def write_segment(self, segment):
+        self.count += 1
+        self.file.write(self.cue(segment))
+
+
+class VttWriter(SrtWriter):
+    """
+    WebVTT subtitles, one cue per segment. The sections are not written.
+    """
+    extension = ".vtt"
+    separator = '.'
+
+    def write_header(self):
+        self.file.write("WEBVTT\n\n")
+
+
+class JsonWriter(TextOutputWriter):
+    """
+    JSON object with the list of segments, streamed as they arrive, then the sections.
+    """
+    extension = ".json"
+
+    def __init__(self, path):
+        self.count = 0
+        self.sections = {}
+        super().__init__(path)
+
+    def write_header(self):
+        self.file.write('{"segments": [')
+
+    def write_segment(self, segment):
+        self.file.write(",\n  " if self.count else "\n  ")
+        self.file.write(json.dumps(segment.to_dict(), ensure_ascii=False))
+        self.count += 1
+
+    def add_section(self, name, text):
+        self.sections[name] = text
+
+    def finish(self):
+        self.file.write('\n], "sections": ')
+        self.file.write(json.dumps(self.sections, ensure_ascii=False, indent=2))
+        self.file.write('}\n')
+        super().finish()
+
+
+class DocxWriter(OutputWriter):
+    """
+    Word document: one paragraph per segment, starting with its time and speaker, then the sections.
+    """
+    extension = ".docx"
+
+    def __init__(self, path):
+        # python-docx is only imported when a Word document is written
+        from docx import Document
+
+        super().__init__(path)
+        self.document = Document()
+        self.document.add_heading(section_title(transcript_section), level=1)
+
+    def add_segments(self, segments):
+        for segment in segments:
+            paragraph = self.document.add_paragraph()
+            paragraph.add_run(segment_label(segment) + " ").bold = True
+            paragraph.add_run(segment.text.strip())
+
+    def add_section(self, name, text):
+        # A line break before each section
+        self.document.add_paragraph()
+        self.document.add_heading(section_title(name), level=1)
+        self.document.add_paragraph(text)
+
+    def finish(self):
+        self.document.save(self.partial_path)
+
+
+# Writers of each output format
+output_writers = {writer.extension[1:]: writer
+                  for writer in (DocxWriter, MarkdownWriter, PlainTextWriter, SrtWriter, VttWriter, JsonWriter)}
+
+
+class MinutesOutput:
+    """
+    All the output files of a run, written in a single pass over the segments and the sections.
+    """
+
+    def __init__(self, base_path, formats):
+        """
+        Create the output files.
+        :param base_path: Path to the files, without extension
+        :param formats: Output formats ('docx', 'md', 'txt', 'srt', 'vtt', 'json')
+        """
+        unknown = [name for name in formats if name not in output_writers]
+        if unknown:
+            raise ValueError("Unknown output format: {}".format(", ".join(unknown)))
+        directory = os.path.dirname(base_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.writers = []
+        try:
+            for name in dict.fromkeys(formats):
+                self.writers.append(output_writers[name](base_path + output_writers[name].extension))
+        except BaseException:
+            self.discard()
+            raise
+
+    @property
+    def paths(self):
+        """
+        Paths to the output files.
+        """
+        return [writer.path for writer in self.writers]
+
+    def add_segments(self, segments):
+        """
+        Add segments of the transcript to every file, in order.
+        :param segments: Segments
+        """
+        if segments:
+            for writer in self.writers:
+                writer.add_segments(segments)
+
+    def add_sections(self, minutes):
+        """
+        Add the sections of the minutes to every file.
+        :param minutes: Text of each section, the transcript being already written
+        """
+        for name, text in minutes.items():
+            if name != transcript_section:
+                for writer in self.writers:
+                    writer.add_section(name, text)
+
+    def close(self):
+        """
+        Finish every file and give it its final name.
+        """
+        for writer in self.writers:
+            writer.close()
+
+    def discard(self):
+        """
+        Delete every unfinished file, for a run that did not complete.
+        """
+        for writer in self.writers:
+            writer.discard()
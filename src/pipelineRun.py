@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import shutil
+import datetime
+import hashlib
+import threading
+
+# Configuration
+jobs_dir = os.path.join("output", "jobs")
+
+
+def job_directory(input_file_path, *settings):
+    """
+    Get the job directory of a recording: the same recording with the same settings always gets the same directory.
+    :param input_file_path: Path to the recording
+    :param settings: Settings affecting the results (start and end times...)
+    :return: Path to the job directory
+    """
+    stat = os.stat(input_file_path)
+    identity = json.dumps([os.path.abspath(input_file_path), stat.st_size, stat.st_mtime, *settings])
+    digest = hashlib.sha256(identity.encode('utf-8')).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(input_file_path))[0]
+    return os.path.join(jobs_dir, f"{stem}_{digest}")
+
+
+class PipelineCancelled(Exception):
+    """
+    Raised by the pipeline stages when the run has been cancelled.
+    """
+
+
+class PipelineRun:
+    """
+    State shared by the stages of a pipeline run: progress reporting, cancellation, checkpoints and measures.
+    """
+
+    def __init__(self, progress=None, job_dir=None):
+        """
+        Initialise the run.
+        :param progress: Function called with the stage name, the units done and the total units (optional)
+        :param job_dir: Directory where the completed units of work are saved, to resume the run (optional)
+        """
+        self.progress = progress
+        self.job_dir = job_dir
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+        self.processes = set()
+        self.stage = None
+        self.done = 0
+        self.total = None
+        self.started_at = datetime.datetime.now().isoformat(timespec='seconds')
+        self.started = time.perf_counter()
+        self.stage_started = None
+        self.stage_times = {}
+        self.events = []
+
+    @property
+    def cancelled(self):
+        """
+        Whether the run has been cancelled.
+        """
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        """
+        Cancel the run, killing the external processes still running.
+        """
+        self.cancel_event.set()
+        with self.lock:
+            processes = list(self.processes)
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+
+    def check(self):
+        """
+        Stop the current stage if the run has been cancelled.
+        """
+        if self.cancelled:
+            raise PipelineCancelled()
+
+    def start_stage(self, stage, total=None):
+        """
+        Report the start of a stage.
+        :param stage: Stage name
+        :param total: Number of units of work in the stage (optional)
+        """
+        self.check()
+        now = time.perf_counter()
+        with self.lock:
+            if self.stage is not None:
+                self.stage_times[self.stage] = self.stage_times.get(self.stage, 0.0) + now - self.stage_started
+            self.stage = stage
+            self.stage_started = now
+            self.done = 0
+            self.total = total
+        self.report()
+
+    def advance(self, count=1):
+        """
+        Report units of work done in the current stage.
+        :param count: Number of units done (optional)
+        """
+        with self.lock:
+            self.done += count
+        self.report()
+
+    def report(self):
+        """
+        Send the current progress to the progress function.
+        """
+        if self.progress is not None:
+            with self.lock:
+                stage, done, total = self.stage, self.done, self.total
+            self.progress(stage, done, total)
+
+    def record(self, operation, wall_time, **measures):
+        """
+        Record the measures of an operation of the run.
+        :param operation: Operation name ('conversion', 'upload', 'llm'...)
+        :param wall_time: Duration of the operation in seconds
+        :param measures: Other measures (bytes_in, bytes_out, audio_seconds, prompt_tokens, section...)
+        """
+        with self.lock:
+            self.events.append({'operation': operation, 'stage': self.stage, 'wall_time': wall_time, **measures})
+
+    def timings(self):
+        """
+        Get the wall time of the stages, the current stage being counted until now.
+        :return: Wall time of the run and of each stage in seconds
+        """
+        now = time.perf_counter()
+        with self.lock:
+            stage_times = dict(self.stage_times)
+            if self.stage is not None:
+                stage_times[self.stage] = stage_times.get(self.stage, 0.0) + now - self.stage_started
+        return now - self.started, stage_times
+
+    def attach_process(self, process):
+        """
+        Track an external process, killed if the run is cancelled.
+        :param process: Running process
+        """
+        with self.lock:
+            self.processes.add(process)
+        if self.cancelled:
+            process.kill()
+
+    def detach_process(self, process):
+        """
+        Stop tracking an external process.
+        :param process: Process
+        """
+        with self.lock:
+            self.processes.discard(process)
+
+    def wait_process(self, process):
+        """
+        Wait for an external process, which is killed if the run is cancelled.
+        :param process: Running process
+        :return: Standard output and error of the process
+        """
+        self.attach_process(process)
+        try:
+            return process.communicate()
+        finally:
+            self.detach_process(process)
+
+    def load(self, name):
+        """
+        Load a checkpoint of the job.
+        :param name: Checkpoint name
+        :return: Saved value, or None if the unit of work has not been completed
+        """
+        if self.job_dir is None:
+            return None
+        path = os.path.join(self.job_dir, f"{name}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, name, value):
+        """
+        Save a checkpoint of the job, replacing the file atomically.
+        :param name: Checkpoint name
+        :param value: Value to save
+        """
+        if self.job_dir is None:
+            return
+        if not os.path.exists(self.job_dir):
+            os.makedirs(self.job_dir, exist_ok=True)
+        path = os.path.join(self.job_dir, f"{name}.json")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def finish(self):
+        """
+        Delete the checkpoints of the job once it has been completed.
+        """
+        if self.job_dir is not None and os.path.exists(self.job_dir):
+            shutil.rmtree(self.job_dir)
@@ -0,0 +1,139 @@
+import os
+import json
+
+# Configuration
+metrics_dir = None  # Directory of the Prometheus text files, one per run (textfile collector format), None to disable
+metrics_prefix = "meeting_minutes"  # Prefix of the Prometheus metric names
+
+# Measures summed for each operation
+summed_measures = ['bytes_in', 'bytes_out', 'audio_seconds', 'saved_seconds', 'prompt_tokens', 'completion_tokens',
+                   'total_tokens']
+
+
+def usage_measures(response_dict):
+    """
+    Get the token usage of a chat completion.
+    :param response_dict: Response of the API (`response.model_dump()`)
+    :return: Prompt, completion and total tokens
+    """
+    usage = response_dict.get('usage') or {}
+    return {
+        'prompt_tokens': usage.get('prompt_tokens') or 0,
+        'completion_tokens': usage.get('completion_tokens') or 0,
+        'total_tokens': usage.get('total_tokens') or 0,
+    }
+
+
+def summarize_operations(events):
+    """
+    Aggregate the measures of the operations of a run.
+    :param events: Measures of each operation
+    :return: Number of calls, wall time and summed measures of each operation
+    """
+    operations = {}
+    for event in events:
+        summary = operations.setdefault(event['operation'], {'calls': 0, 'wall_time': 0.0, 'max_wall_time': 0.0})
+        summary['calls'] += 1
+        summary['wall_time'] += event['wall_time']
+        summary['max_wall_time'] = max(summary['max_wall_time'], event['wall_time'])
+        for measure in summed_measures:
+            if measure in event:
+                summary[measure] = summary.get(measure, 0) + event[measure]
+    return operations
+
+
+def build_report(run, **info):
+    """
+    Build the report of a pipeline run.
+    :param run: Pipeline run
+    :param info: Description of the run (recording, choice, backend...)
+    :return: Report
+    """
+    wall_time, stages = run.timings()
+    operations = summarize_operations(run.events)
+    totals = {measure: sum(summary.get(measure, 0) for summary in operations.values())
+              for measure in ['prompt_tokens', 'completion_tokens', 'total_tokens']}
+    return {
+        'started_at': run.started_at,
+        'wall_time': wall_time,
+        **info,
+        'stages': stages,
+        'operations': operations,
+        'totals': totals,
+        'events': run.events,
+    }
+
+
+def write_report(report, path):
+    """
+    Save a run report as JSON.
+    :param report: Run report
+    :param path: Path to the report
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def prometheus_metrics(report, labels):
+    """
+    Format a run report as Prometheus metrics (text exposition format).
+    :param report: Run report
+    :param labels: Labels added to every metric
+    :return: Metrics
+    """
+    def format_labels(**extra):
+        values = {**labels, **extra}
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for value in values.values())
+        return "{" + ",".join(f'{name}="{value}"' for name, value in zip(values, escaped)) + "}"
+
+    metrics = [
+        ('run_seconds', "Wall time of the run", [(format_labels(), report['wall_time'])]),
+        ('stage_seconds', "Wall time of each stage",
+         [(format_labels(stage=stage), seconds) for stage, seconds in report['stages'].items()]),
+        ('operation_calls', "Number of calls of each operation",
+         [(format_labels(operation=name), summary['calls']) for name, summary in report['operations'].items()]),
+        ('operation_seconds', "Wall time summed over the calls of each operation",
+         [(format_labels(operation=name), summary['wall_time'])
+          for name, summary in report['operations'].items()]),
+    ]
+    for measure in summed_measures:
+        metrics.append((measure, f"{measure.replace('_', ' ').capitalize()} of each operation",
+                        [(format_labels(operation=name), summary[measure])
+                         for name, summary in report['operations'].items() if measure in summary]))
+
+    lines = []
+    for name, description, samples in metrics:
+        if not samples:
+            continue
+        lines.append(f"# HELP {metrics_prefix}_{name} {description}")
+        lines.append(f"# TYPE {metrics_prefix}_{name} gauge")
+        lines.extend(f"{metrics_prefix}_{name}{sample_labels} {value}" for sample_labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+def save_run_report(run, output_path, directory=None, **info):
+    """
+    Save the JSON report of a run next to its output file, and its Prometheus metrics if enabled.
+    :param run: Pipeline run
+    :param output_path: Path to the output file of the run
+    :param directory: Directory of the Prometheus text files (optional, `metrics_dir` by default)
+    :param info: Description of the run (recording, choice, backend...)
+    :return: Path to the JSON report
+    """
+    directory = metrics_dir if directory is None else directory
+    name = os.path.splitext(os.path.basename(output_path))[0]
+    report = build_report(run, **info)
+
+    report_path = os.path.join(os.path.dirname(output_path), f"{name}_report.json")
+    write_report(report, report_path)
+
+    if directory is not None:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        metrics_path = os.path.join(directory, f"{name}.prom")
+        temp_path = f"{metrics_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(prometheus_metrics(report, {'run': name}))
+        os.replace(temp_path, metrics_path)
+    return report_path
@@ -0,0 +1,272 @@
+import os
+import time
+import sqlite3
+import argparse
+import threading
+
+from transcriptSegments import format_timestamp
+
+# Configuration
+index_path = os.path.join("output", "search_index.sqlite3")
+search_limit = 20  # Results returned by a search
+snippet_tokens = 16  # Length of the snippets of the results, in trigrams
+snippet_chars = 40  # Length of the snippets of the terms too short for the index, in characters on each side
+# The trigram tokenizer matches any part of a word, so that Chinese text without spaces can be searched
+index_tokenizer = "trigram"
+trigram_length = 3  # Shortest term found through the full-text index
+bigram_length = 2  # Length of the terms found through the character pairs of the passages, shorter terms by a scan
+
+
+class SearchIndex:
+    """
+    Full-text index of the transcripts and minutes of all the meetings (SQLite FTS5).
+    Each meeting is added on its own, the index is never rebuilt.
+    """
+
+    def __init__(self, path=index_path):
+        """
+        Open the index, creating it if necessary.
+        :param path: Path to the SQLite database (optional)
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS meetings ("
+                "id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, recording TEXT, output TEXT, indexed_at REAL)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS passages ("
+                "id INTEGER PRIMARY KEY, meeting_id INTEGER NOT NULL, kind TEXT NOT NULL, start REAL, "
+                "speaker TEXT, text TEXT NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS passages_meeting ON passages (meeting_id)")
+            # The full-text index reads the text of the passages table instead of keeping a copy
+            self.connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS passages_text USING fts5("
+                f"text, content='passages', content_rowid='id', tokenize='{index_tokenizer}')")
+            # Most Chinese words have two characters, too short for the trigrams: the passages are also indexed by
+            # their pairs of characters (the passages of an index created without them are added once)
+            created = self.connection.execute(
+                "SELECT name FROM sqlite_master WHERE name = 'passage_bigrams'").fetchone() is None
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS passage_bigrams ("
+                "bigram TEXT NOT NULL, passage_id INTEGER NOT NULL, PRIMARY KEY (bigram, passage_id)) WITHOUT ROWID")
+            if created:
+                for passage_id, text in self.connection.execute("SELECT id, text FROM passages").fetchall():
+                    self.add_bigrams(passage_id, text)
+
+    def add_meeting(self, name, segments=(), sections=None, recording=None, output=None):
+        """
+        Add a meeting to the index, replacing it if it was already indexed.
+        :param name: Name of the meeting (name of its output files)
+        :param segments: Segments of the transcript (optional)
+        :param sections: Text of each extracted section (optional)
+        :param recording: Path to the recording (optional)
+        :param output: Path to the minutes (optional)
+        :return: Number of passages indexed
+        """
+        passages = [('transcript', segment.start, segment.speaker, segment.text.strip())
+                    for segment in segments if segment.text.strip()]
+        passages += [(kind, None, None, text.strip()) for kind, text in (sections or {}).items() if text.strip()]
+
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT id FROM meetings WHERE name = ?", (name,)).fetchone()
+            if row is not None:
+                self.remove_passages(row[0])
+                self.connection.execute("UPDATE meetings SET recording = ?, output = ?, indexed_at = ? WHERE id = ?",
+                                        (recording, output, time.time(), row[0]))
+                meeting_id = row[0]
+            else:
+                meeting_id = self.connection.execute(
+                    "INSERT INTO meetings (name, recording, output, indexed_at) VALUES (?, ?, ?, ?)",
+                    (name, recording, output, time.time())).lastrowid
+
+            for kind, start, speaker, text in passages:
+                passage_id = self.connection.execute(
+                    "INSERT INTO passages (meeting_id, kind, start, speaker, text) VALUES (?, ?, ?, ?, ?)",
+                    (meeting_id, kind, start, speaker, text)).lastrowid
+                self.connection.execute("INSERT INTO passages_text (rowid, text) VALUES (?, ?)", (passage_id, text))
+                self.add_bigrams(passage_id, text)
+        return len(passages)
+
+    def add_bigrams(self, passage_id, text):
+        """
+        Index a passage by its pairs of characters (the lock must be held).
+        :param passage_id: Identifier of the passage
+        :param text: Text of the passage
+        """
+        self.connection.executemany("INSERT INTO passage_bigrams (bigram, passage_id) VALUES (?, ?)",
+                                    [(bigram, passage_id) for bigram in text_bigrams(text)])
+
+    def remove_passages(self, meeting_id):
+        """
+        Remove the passages of a meeting from the index (the lock must be held).
+        :param meeting_id: Identifier of the meeting
+        """
+        rows = self.connection.execute("SELECT id, text FROM passages WHERE meeting_id = ?", (meeting_id,)).fetchall()
+        self.connection.executemany(
+            "INSERT INTO passages_text (passages_text, rowid, text) VALUES ('delete', ?, ?)", rows)
+        self.connection.executemany("DELETE FROM passage_bigrams WHERE bigram = ? AND passage_id = ?",
+                                    [(bigram, passage_id) for passage_id, text in rows
+                                     for bigram in text_bigrams(text)])
+        self.connection.execute("DELETE FROM passages WHERE meeting_id = ?", (meeting_id,))
+
+    def remove_meeting(self, name):
+        """
+        Remove a meeting from the index.
+        :param name: Name of the meeting
+        :return: True if the meeting was indexed
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT id FROM meetings WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return False
+            self.remove_passages(row[0])
+            self.connection.execute("DELETE FROM meetings WHERE id = ?", (row[0],))
+            return True
+
+    def search(self, query, limit=search_limit):
+        """
+        Find the passages containing all the terms of a query, the most relevant first.
+        :param query: Terms separated by spaces
+        :param limit: Maximum number of results (optional)
+        :return: Meeting, recording, minutes, kind of passage, start in seconds, speaker and snippet of each result
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        indexed = [term for term in terms if len(term) >= trigram_length]
+        paired = [term.lower() for term in terms if len(term) == bigram_length]
+        scanned = [term for term in terms if len(term) < bigram_length]
+
+        conditions = ["EXISTS (SELECT 1 FROM passage_bigrams AS pair "
+                      "WHERE pair.bigram = ? AND pair.passage_id = passages.id)" for _ in paired]
+        conditions += ["passages.text LIKE ? ESCAPE '\\'" for _ in scanned]
+        params = paired + ["%" + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + "%"
+                           for term in scanned]
+        if indexed:
+            # Each term is a quoted string, so that the query syntax of FTS5 does not apply to the user input
+            match = " ".join('"{}"'.format(term.replace('"', '""')) for term in indexed)
+            sql = ("SELECT meetings.name, meetings.recording, meetings.output, passages.kind, passages.start, "
+                   f"passages.speaker, snippet(passages_text, 0, '[', ']', '…', {snippet_tokens}) "
+                   "FROM passages_text JOIN passages ON passages.id = passages_text.rowid "
+                   "JOIN meetings ON meetings.id = passages.meeting_id "
+                   "WHERE passages_text MATCH ? {} ORDER BY passages_text.rank LIMIT ?")
+            params = [match] + params
+        elif paired:
+            # The passages of the first pair are read from the most recent one, until enough match the other terms
+            sql = ("SELECT meetings.name, meetings.recording, meetings.output, passages.kind, passages.start, "
+                   "passages.speaker, passages.text "
+                   "FROM passage_bigrams JOIN passages ON passages.id = passage_bigrams.passage_id "
+                   "JOIN meetings ON meetings.id = passages.meeting_id "
+                   "WHERE passage_bigrams.bigram = ? {} ORDER BY passage_bigrams.passage_id DESC LIMIT ?")
+            # The first pair is matched by the table read, its parameter stays the first one
+            conditions = conditions[1:]
+        else:
+            sql = ("SELECT meetings.name, meetings.recording, meetings.output, passages.kind, passages.start, "
+                   "passages.speaker, passages.text "
+                   "FROM passages JOIN meetings ON meetings.id = passages.meeting_id "
+                   "WHERE 1 {} ORDER BY meetings.indexed_at DESC, passages.id LIMIT ?")
+        sql = sql.format("".join(" AND " + condition for condition in conditions))
+
+        with self.lock:
+            rows = self.connection.execute(sql, params + [limit]).fetchall()
+
+        results = []
+        for name, recording, output, kind, start, speaker, snippet in rows:
+            if not indexed:
+                snippet = scan_snippet(snippet, (paired + scanned)[0])
+            results.append({'meeting': name, 'recording': recording, 'output': output, 'kind': kind,
+                            'start': start, 'speaker': speaker, 'snippet': snippet})
+        return results
+
+    def stats(self):
+        """
+        Get the size of the index.
+        :return: Number of meetings and passages indexed
+        """
+        with self.lock:
+            meetings = self.connection.execute("SELECT COUNT(*) FROM meetings").fetchone()[0]
+            passages = self.connection.execute("SELECT COUNT(*) FROM passages").fetchone()[0]
+            return {'meetings': meetings, 'passages': passages}
+
+    def close(self):
+        """
+        Close the index.
+        """
+        with self.lock:
+            self.connection.close()
+
+
+def text_bigrams(text):
+    """
+    Get the pairs of consecutive characters of a text, through which the terms of two characters are found.
+    :param text: Text
+    :return: Distinct pairs of characters in lower case, without the pairs containing a space
+    """
+    text = text.lower()
+    return {text[i:i + bigram_length] for i in range(len(text) - bigram_length + 1)
+            if not any(char.isspace() for char in text[i:i + bigram_length])}
+
+
+def scan_snippet(text, term):
+    """
+    Cut the part of a passage around a term, marking the term like the snippets of the index.
+    :param text: Text of the passage
+    :param term: Term found in the passage
+    :return: Snippet
+    """
+    position = text.lower().find(term.lower())
+    if position < 0:
+        return text[:2 * snippet_chars]
+    start = max(0, position - snippet_chars)
+    end = min(len(text), position + len(term) + snippet_chars)
+    return "{}{}[{}]{}{}".format("…" if start > 0 else "", text[start:position],
+                                 text[position:position + len(term)], text[position + len(term):end],
+                                 "…" if end < len(text) else "")
+
+
+def format_result(result):
+    """
+    Format a search result for the terminal.
+    :param result: Search result
+    :return: Line of text
+    """
+    where = format_timestamp(result['start']) if result['start'] is not None else result['kind']
+    speaker = f" {result['speaker']}：" if result['speaker'] else " "
+    return f"{result['meeting']} [{where}]{speaker}{result['snippet']}"
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    :param argv: Command line arguments (optional)
+    """
+    parser = argparse.ArgumentParser(description="Search the transcripts and minutes of the meetings.")
+    parser.add_argument('query', nargs='+', help="terms to find, all of them must appear in a passage")
+    parser.add_argument('--limit', type=int, default=search_limit, help="maximum number of results")
+    parser.add_argument('--index', default=index_path, help="path to the search index")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.index):
+        print(f"No search index in '{args.index}': process a meeting first.")
+        return
+
+    index = SearchIndex(args.index)
+    try:
+        start = time.perf_counter()
+        results = index.search(" ".join(args.query), args.limit)
+        elapsed = time.perf_counter() - start
+        for result in results:
+            print(format_result(result))
+        stats = index.stats()
+        print(f"{len(results)} results in {elapsed * 1000:.1f} ms ({stats['meetings']} meetings indexed).")
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
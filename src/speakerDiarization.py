@@ -0,0 +1,303 @@
+import numpy as np
+
+from audioChunker import read_blocks
+from transcriptSegments import Segment, segments_text
+
+# Analysis
+diarization_rate = 16000  # Sample rate of the analysed audio (Hz)
+frame_length = 0.025  # Length of the frames of the spectral analysis (s)
+frame_step = 0.01  # Step between two frames (s)
+mel_bands = 24  # Bands of the mel filterbank
+cepstral_count = 20  # Cepstral coefficients per frame, the first one (loudness) is dropped
+dynamic_range = 50.0  # Range of the band energies (dB), quieter bands are raised to it so that noise does not count
+frame_batch = 4096  # Frames whose spectra are computed at once
+speech_rms = 300.0  # RMS energy of a frame containing speech (16-bit samples)
+
+# Speaker embeddings: mean and deviation of the cepstral coefficients over short windows
+window_duration = 1.5  # Length of a window (s)
+window_step = 0.75  # Step between two windows (s)
+min_speech_ratio = 0.5  # Fraction of speech frames of a window analysed
+
+# Clustering
+cluster_count = 16  # Clusters found by k-means before they are merged into speakers
+kmeans_iterations = 20  # Iterations of k-means
+merge_distance = 45.0  # Distance between the mean embeddings of two clusters below which they are the same speaker
+max_speakers = 8  # Maximum number of speakers
+smoothing_windows = 5  # Windows of the majority filter removing isolated speaker changes
+
+# Labels
+speaker_label = "说话人 {}"  # Name of a speaker in the transcript and the minutes
+
+
+def mel_filterbank(sample_rate, fft_size, bands=mel_bands):
+    """
+    Build a triangular mel filterbank.
+    :param sample_rate: Sample rate (Hz)
+    :param fft_size: Size of the FFT
+    :param bands: Number of bands (optional)
+    :return: Matrix mapping the power spectrum to the band energies
+    """
+    mel_max = 2595 * np.log10(1 + sample_rate / 2 / 700)
+    hertz = 700 * (10 ** (np.linspace(0, mel_max, bands + 2) / 2595) - 1)
+    bins = np.floor((fft_size + 1) * hertz / sample_rate).astype(int)
+
+    filters = np.zeros((fft_size // 2 + 1, bands), dtype=np.float32)
+    for band in range(bands):
+        left, center, right = bins[band], bins[band + 1], bins[band + 2]
+        if center > left:
+            filters[left:center, band] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            filters[center:right, band] = (right - np.arange(center, right)) / (right - center)
+    return filters
+
+
+def dct_matrix(bands=mel_bands, count=cepstral_count):
+    """
+    Build the matrix of the discrete cosine transform giving the cepstral coefficients.
+    :param bands: Number of bands (optional)
+    :param count: Number of coefficients (optional)
+    :return: Matrix mapping the log band energies to the cepstral coefficients
+    """
+    n = np.arange(bands)
+    return np.cos(np.pi / bands * (n[:, None] + 0.5) * np.arange(count)[None, :]).astype(np.float32)
+
+
+def frame_features(samples, sample_rate=diarization_rate):
+    """
+    Compute the cepstral coefficients of all the frames of a block.
+    :param samples: 16-bit samples
+    :param sample_rate: Sample rate of the samples (optional)
+    :return: Cepstral coefficients and speech flag of each frame
+    """
+    length = int(sample_rate * frame_length)
+    step = int(sample_rate * frame_step)
+    if len(samples) < length:
+        return np.zeros((0, cepstral_count - 1), dtype=np.float32), np.zeros(0, dtype=bool)
+
+    frames = np.lib.stride_tricks.sliding_window_view(samples, length)[::step]
+    fft_size = 1 << (length - 1).bit_length()
+    filters = mel_filterbank(sample_rate, fft_size)
+    window = np.hamming(length).astype(np.float32)
+    floor = dynamic_range / 10 * np.log(10)
+    dct = dct_matrix()
+
+    # The spectra are computed a batch of frames at a time, so that the memory used stays small
+    features = np.empty((len(frames), cepstral_count - 1), dtype=np.float32)
+    speech = np.empty(len(frames), dtype=bool)
+    for first in range(0, len(frames), frame_batch):
+        batch = frames[first:first + frame_batch].astype(np.float32)
+        speech[first:first + len(batch)] = np.sqrt(np.mean(batch ** 2, axis=1)) > speech_rms
+        spectrum = np.abs(np.fft.rfft(batch * window, n=fft_size)) ** 2
+        energies = np.log(spectrum @ filters + 1e-6)
+        energies = np.maximum(energies, energies.max(axis=1, keepdims=True) - floor)
+        features[first:first + len(batch)] = (energies @ dct)[:, 1:]
+    return features, speech
+
+
+def window_embeddings(features, speech, offset):
+    """
+    Summarise the speech frames into one embedding per window: the mean and the deviation of the coefficients.
+    :param features: Cepstral coefficients of each frame
+    :param speech: Speech flag of each frame
+    :param offset: Start of the block in seconds
+    :return: Start in seconds and embedding of each window containing speech
+    """
+    size = int(round(window_duration / frame_step))
+    step = int(round(window_step / frame_step))
+    if len(features) < size:
+        return np.zeros(0), np.zeros((0, 2 * features.shape[1]), dtype=np.float32)
+
+    # Sums over the speech frames of every window from cumulative sums, without a loop over the windows
+    starts = np.arange(0, len(features) - size + 1, step)
+    voiced = features.astype(np.float64) * speech[:, None]
+    zeros = np.zeros((1, features.shape[1]))
+    sums = np.concatenate([zeros, np.cumsum(voiced, axis=0)])
+    squares = np.concatenate([zeros, np.cumsum(voiced ** 2, axis=0)])
+    speech_counts = np.concatenate([[0], np.cumsum(speech)])
+
+    counts = np.maximum(speech_counts[starts + size] - speech_counts[starts], 1)[:, None]
+    mean = (sums[starts + size] - sums[starts]) / counts
+    deviation = np.sqrt(np.maximum((squares[starts + size] - squares[starts]) / counts - mean ** 2, 0))
+    kept = counts[:, 0] >= min_speech_ratio * size
+    embeddings = np.hstack([mean, deviation])[kept].astype(np.float32)
+    return offset + starts[kept] * frame_step, embeddings
+
+
+def extract_embeddings(file_path, run=None):
+    """
+    Compute the speaker embeddings of a recording, block by block.
+    :param file_path: Path to the audio file
+    :param run: Pipeline run, stopping the decoding if it is cancelled (optional)
+    :return: Start in seconds and embedding of each window containing speech
+    """
+    size = int(round(window_duration / frame_step))
+    step = int(round(window_step / frame_step))
+    hop = int(diarization_rate * frame_step)
+    all_starts = []
+    all_embeddings = []
+    remainder = np.zeros(0, dtype=np.int16)
+    for offset, samples in read_blocks(file_path, diarization_rate, run=run):
+        # The samples after the last window of the previous block start the next one, so that no window is lost
+        samples = np.concatenate([remainder, samples])
+        offset -= len(remainder) / diarization_rate
+        features, speech = frame_features(samples)
+        starts, embeddings = window_embeddings(features, speech, offset)
+        all_starts.append(starts)
+        all_embeddings.append(embeddings)
+        windows = (len(features) - size) // step + 1 if len(features) >= size else 0
+        remainder = samples[windows * step * hop:]
+    if not all_starts:
+        return np.zeros(0), np.zeros((0, 2 * (cepstral_count - 1)), dtype=np.float32)
+    return np.concatenate(all_starts), np.concatenate(all_embeddings)
+
+
+def normalize(vectors):
+    """
+    Scale vectors to unit length.
+    :param vectors: Vectors, one per line
+    :return: Normalized vectors
+    """
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+
+
+def cluster_speakers(embeddings, speakers=None):
+    """
+    Group the windows by speaker, in a time linear in the number of windows.
+    k-means first finds a fixed number of small clusters, which are then merged into speakers.
+    The merges compare the embeddings themselves, not their normalization over the recording: the voice of a single
+    speaker would otherwise be spread over the whole normalized range, and split.
+    :param embeddings: Embedding of each window
+    :param speakers: Number of speakers, if known (optional, found from `merge_distance` by default)
+    :return: Speaker index of each window
+    """
+    if len(embeddings) == 0:
+        return np.zeros(0, dtype=int)
+
+    # Normalization over the recording, then spherical k-means initialised on windows spread over the meeting
+    vectors = normalize((embeddings - embeddings.mean(axis=0)) / (embeddings.std(axis=0) + 1e-6))
+    count = min(cluster_count, len(vectors))
+    centroids = vectors[np.linspace(0, len(vectors) - 1, count).astype(int)]
+    for _ in range(kmeans_iterations):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        filled = np.bincount(labels, minlength=count) > 0
+        centroids[filled] = normalize(sums[filled])
+    labels = np.argmax(vectors @ centroids.T, axis=1)
+
+    # Agglomerative merge of the closest clusters, from the mean embedding of their windows
+    sums = np.zeros((count, embeddings.shape[1]))
+    np.add.at(sums, labels, embeddings)
+    sizes = np.bincount(labels, minlength=count)
+    groups = {cluster: [cluster] for cluster in np.unique(labels)}
+    group_sums = {cluster: sums[cluster] for cluster in groups}
+    group_sizes = {cluster: sizes[cluster] for cluster in groups}
+    target = 1 if speakers is None else speakers
+    while len(groups) > target:
+        keys = list(groups)
+        means = np.array([group_sums[key] / group_sizes[key] for key in keys])
+        distance = np.linalg.norm(means[:, None] - means[None, :], axis=2)
+        np.fill_diagonal(distance, np.inf)
+        first, second = np.unravel_index(np.argmin(distance), distance.shape)
+        if speakers is None and distance[first, second] > merge_distance and len(groups) <= max_speakers:
+            break
+        groups[keys[first]] += groups.pop(keys[second])
+        group_sums[keys[first]] = group_sums[keys[first]] + group_sums.pop(keys[second])
+        group_sizes[keys[first]] = group_sizes[keys[first]] + group_sizes.pop(keys[second])
+
+    mapping = np.zeros(count, dtype=int)
+    for index, members in enumerate(groups.values()):
+        mapping[members] = index
+    return mapping[labels]
+
+
+def smooth_labels(labels, width=smoothing_windows):
+    """
+    Replace each label by the most frequent label around it, removing isolated speaker changes.
+    :param labels: Speaker index of each window
+    :param width: Number of windows considered (optional)
+    :return: Smoothed labels
+    """
+    if len(labels) == 0 or width <= 1:
+        return labels
+    counts = np.eye(labels.max() + 1, dtype=np.int32)[labels]
+    cumulative = np.concatenate([np.zeros((1, counts.shape[1]), dtype=np.int32), np.cumsum(counts, axis=0)])
+    index = np.arange(len(labels))
+    low = np.maximum(index - width // 2, 0)
+    high = np.minimum(index + width // 2 + 1, len(labels))
+    return np.argmax(cumulative[high] - cumulative[low], axis=1)
+
+
+def diarize(file_path, speakers=None, run=None):
+    """
+    Find who speaks when in a recording, offline on the CPU.
+    :param file_path: Path to the audio file
+    :param speakers: Number of speakers, if known (optional)
+    :param run: Pipeline run, stopping the decoding if it is cancelled (optional)
+    :return: Speaker turns, with their start and end in seconds and the speaker name
+    """
+    starts, embeddings = extract_embeddings(file_path, run)
+    labels = smooth_labels(cluster_speakers(embeddings, speakers))
+
+    # Each window stands for the step at its center, so that consecutive windows tile the recording
+    margin = (window_duration - window_step) / 2
+    turns = []
+    names = {}
+    for start, label in zip(starts, labels):
+        name = names.setdefault(label, speaker_label.format(len(names) + 1))
+        start, end = float(start) + margin, float(start) + margin + window_step
+        if turns and turns[-1]['speaker'] == name and start - turns[-1]['end'] < window_step:
+            turns[-1]['end'] = end
+        else:
+            turns.append({'start': start, 'end': end, 'speaker': name})
+    return turns
+
+
+def assign_speakers(segments, turns):
+    """
+    Give each transcription segment the speaker who speaks the longest during it.
+    Segments without speech in the turns keep the speaker of the previous segment.
+    :param segments: Transcript segments (`Segment`), in order
+    :param turns: Speaker turns, in order
+    :return: The segments, with their speaker set
+    """
+    first = 0
+    speaker = None
+    for segment in segments:
+        while first < len(turns) and turns[first]['end'] <= segment.start:
+            first += 1
+        durations = {}
+        index = first
+        while index < len(turns) and turns[index]['start'] < segment.end:
+            overlap = min(turns[index]['end'], segment.end) - max(turns[index]['start'], segment.start)
+            durations[turns[index]['speaker']] = durations.get(turns[index]['speaker'], 0.0) + overlap
+            index += 1
+        if durations:
+            speaker = max(durations, key=durations.get)
+        segment.speaker = speaker
+    return segments
+
+
+def speaker_turns(segments):
+    """
+    Join the consecutive segments of the same speaker.
+    :param segments: Segments with their speaker, in order
+    :return: One segment per speaker turn
+    """
+    groups = []
+    for segment in segments:
+        if groups and groups[-1][0].speaker == segment.speaker:
+            groups[-1].append(segment)
+        else:
+            groups.append([segment])
+    return [Segment(group[0].start, group[-1].end, segments_text(group), group[0].chunk_id, speaker=group[0].speaker)
+            for group in groups]
+
+
+def format_speaker_transcript(turns):
+    """
+    Write the transcript with the name of the speaker of each turn, for the extractions.
+    :param turns: Speaker turns (segments)
+    :return: Transcript
+    """
+    return "\n".join(f"{turn.speaker or speaker_label.format('?')}：{turn.text}" for turn in turns)
@@ -0,0 +1,141 @@
+import math
+import bisect
+
+# Segments dropped from the transcript
+hallucination_phrases = [
+    "请不吝点赞 订阅 转发 打赏支持明镜与点点栏目",
+]  # Text produced by Whisper on silence or music, never said in a meeting
+min_confidence = None  # Segments less likely than this (0 to 1) are dropped, None to keep them all
+
+
+class Segment:
+    """
+    Part of the transcript, timed from the start of the recording.
+    """
+    __slots__ = ('start', 'end', 'text', 'chunk_id', 'confidence', 'speaker')
+
+    def __init__(self, start, end, text, chunk_id=None, confidence=None, speaker=None):
+        """
+        Initialise the segment.
+        :param start: Start in seconds
+        :param end: End in seconds
+        :param text: Text
+        :param chunk_id: Index of the chunk it was transcribed from (optional)
+        :param confidence: Probability of the text between 0 and 1, None if the backend does not give it (optional)
+        :param speaker: Name of the speaker (optional)
+        """
+        self.start = start
+        self.end = end
+        self.text = text
+        self.chunk_id = chunk_id
+        self.confidence = confidence
+        self.speaker = speaker
+
+    def __repr__(self):
+        return "Segment({:.2f}, {:.2f}, {!r})".format(self.start, self.end, self.text)
+
+    @property
+    def duration(self):
+        """
+        Duration in seconds.
+        """
+        return self.end - self.start
+
+    def to_dict(self):
+        """
+        Convert the segment for a JSON file.
+        :return: Fields of the segment
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, fields):
+        """
+        Create a segment read from a JSON file.
+        :param fields: Fields of the segment
+        :return: Segment
+        """
+        return cls(**fields)
+
+
+def format_timestamp(seconds):
+    """
+    Format a time in the recording.
+    :param seconds: Time in seconds
+    :return: Time as HH:MM:SS
+    """
+    seconds = int(seconds)
+    return "{:02d}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def segments_from_response(raw_segments, chunk_id=None, offset=0.0, duration=None):
+    """
+    Create the segments of a chunk from the segments returned by a backend, with absolute times.
+    :param raw_segments: Segments of the backend, timed from the start of the chunk (`avg_logprob` gives the confidence)
+    :param chunk_id: Index of the chunk (optional)
+    :param offset: Start of the chunk in the recording in seconds (optional)
+    :param duration: Duration of the chunk, the end of a segment without end (optional)
+    :return: Segments
+    """
+    segments = []
+    for raw in raw_segments:
+        end = raw.get('end')
+        if end is None:
+            end = raw['start'] if duration is None else duration
+        logprob = raw.get('avg_logprob')
+        confidence = None if logprob is None else min(1.0, math.exp(logprob))
+        segments.append(Segment(offset + raw['start'], offset + end, raw['text'], chunk_id, confidence))
+    return segments
+
+
+def is_hallucination(segment):
+    """
+    Check whether a segment is text the model made up rather than speech.
+    :param segment: Segment
+    :return: True if the segment must be dropped
+    """
+    if any(phrase in segment.text for phrase in hallucination_phrases):
+        return True
+    return min_confidence is not None and segment.confidence is not None and segment.confidence < min_confidence
+
+
+def filter_segments(segments):
+    """
+    Drop the empty segments and the hallucinations, keeping the rest of their chunk.
+    :param segments: Segments
+    :return: Kept segments
+    """
+    return [segment for segment in segments if segment.text.strip() and not is_hallucination(segment)]
+
+
+def segments_text(segments):
+    """
+    Join the text of segments, with a space between two segments unless one of them already has one at the join.
+    :param segments: Segments, in order
+    :return: Text
+    """
+    parts = []
+    for segment in segments:
+        if not segment.text:
+            continue
+        if parts and not parts[-1][-1].isspace() and not segment.text[0].isspace():
+            parts.append(" ")
+        parts.append(segment.text)
+    return "".join(parts).strip()
+
+
+def segments_in_range(segments, start=None, end=None):
+    """
+    Find the segments overlapping a time range, by binary search.
+    :param segments: Segments of the recording, in order
+    :param start: Start of the range in seconds (optional, start of the recording by default)
+    :param end: End of the range in seconds (optional, end of the recording by default)
+    :return: Segments of the range
+    """
+    ends = [segment.end for segment in segments]
+    first = 0 if start is None else bisect.bisect_right(ends, start)
+    last = len(segments)
+    if end is not None:
+        starts = [segment.start for segment in segments]
+        last = bisect.bisect_left(starts, end)
+    return segments[first:max(first, last)]
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Configuration
+cache_path = os.path.join("output", "transcription_cache.sqlite3")
+cache_max_size = 100 * 1024 * 1024  # Maximum size of the cached texts in bytes
+
+
+def cache_key(data, model, **params):
+    """
+    Build the cache key of an audio chunk from its content and the transcription settings.
+    :param data: Audio content of the chunk
+    :param model: Transcription model
+    :param params: Other parameters affecting the transcription
+    :return: Cache key
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    settings = json.dumps({'model': model, **params}, sort_keys=True)
+    return "{}:{}".format(digest, hashlib.sha256(settings.encode('utf-8')).hexdigest()[:16])
+
+
+class TranscriptionCache:
+    """
+    On-disk cache of chunk transcriptions, with least recently used eviction.
+    """
+
+    def __init__(self, path=cache_path, max_size=cache_max_size):
+        """
+        Open the cache, creating it if necessary.
+        :param path: Path to the SQLite database (optional)
+        :param max_size: Maximum size of the cached texts in bytes (optional)
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS transcriptions ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS transcriptions_last_used ON transcriptions (last_used)")
+
+    def get(self, key):
+        """
+        Get a cached transcription.
+        :param key: Cache key of the chunk
+        :return: Transcription, or None if the chunk is not in the cache
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT text FROM transcriptions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute("UPDATE transcriptions SET last_used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key, text):
+        """
+        Add a transcription to the cache, evicting the least recently used ones beyond the maximum size.
+        :param key: Cache key of the chunk
+        :param text: Transcription
+        """
+        size = len(text.encode('utf-8'))
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO transcriptions (key, text, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, text, size, time.time()))
+            total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM transcriptions").fetchone()[0]
+            if total_size <= self.max_size:
+                return
+            evicted = []
+            for old_key, old_size in self.connection.execute(
+                    "SELECT key, size FROM transcriptions ORDER BY last_used"):
+                if total_size <= self.max_size:
+                    break
+                evicted.append((old_key,))
+                total_size -= old_size
+            self.connection.executemany("DELETE FROM transcriptions WHERE key = ?", evicted)
+
+    def stats(self):
+        """
+        Get the usage counters of the cache.
+        :return: Number of hits, misses and cached transcriptions
+        """
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM transcriptions").fetchone()[0]
+            return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+    def close(self):
+        """
+        Close the cache.
+        """
+        with self.lock:
+            self.connection.close()
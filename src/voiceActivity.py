@@ -0,0 +1,207 @@
+import os
+import time
+import bisect
+
+import ffmpeg
+import numpy as np
+
+from audioChunker import analysis_rate, frame_duration, read_blocks
+from convertMKVtoMP3 import encoding_profiles, profile_options
+
+# Detection of the speech frames
+noise_percentile = 10  # Percentile of the frame energies taken as the noise floor of the recording
+speech_margin_db = 12.0  # Energy above the noise floor of a speech frame (dB)
+max_threshold_db = 46.0  # Highest speech threshold (dB of 16-bit RMS), so that a recording full of speech is kept
+unvoiced_zcr = 0.25  # Zero-crossing rate of unvoiced sounds (s, f, ch...), quieter than the voiced speech
+unvoiced_reach = 0.3  # Seconds around the voiced speech where unvoiced sounds are speech, elsewhere they are noise
+
+# Regions kept
+speech_padding = 0.5  # Seconds of audio kept around the speech, so that no word is cut
+min_silence = 2.0  # Shortest silence removed (s), shorter pauses are kept as they are
+min_saved = 30.0  # Seconds that must be saved for the recording to be trimmed at all
+
+
+class TimeMap:
+    """
+    Correspondence between the times of a trimmed recording and the times of the original recording.
+    """
+
+    def __init__(self, pieces):
+        """
+        Initialise the map.
+        :param pieces: Start in the original recording and duration of each kept piece, in order
+        """
+        self.pieces = [(float(start), float(duration)) for start, duration in pieces]
+        self.trimmed_starts = []
+        position = 0.0
+        for _, duration in self.pieces:
+            self.trimmed_starts.append(position)
+            position += duration
+        self.duration = position
+
+    def to_original(self, seconds):
+        """
+        Convert a time of the trimmed recording into a time of the original recording.
+        :param seconds: Time in the trimmed recording
+        :return: Time in the original recording
+        """
+        if not self.pieces:
+            return seconds
+        index = max(0, bisect.bisect_right(self.trimmed_starts, seconds) - 1)
+        start, duration = self.pieces[index]
+        return start + min(seconds - self.trimmed_starts[index], duration)
+
+    def restore(self, segments):
+        """
+        Give segments transcribed from the trimmed recording their times in the original recording.
+        :param segments: Segments, changed in place
+        :return: The segments
+        """
+        for segment in segments:
+            segment.start = self.to_original(segment.start)
+            segment.end = self.to_original(segment.end)
+        return segments
+
+    def to_list(self):
+        """
+        Convert the map for a JSON file.
+        :return: Kept pieces
+        """
+        return [list(piece) for piece in self.pieces]
+
+
+def trimming_settings():
+    """
+    Get the settings of the silence trimming, which identify a trimmed recording in the audio cache.
+    :return: Settings of the detection and of the regions kept
+    """
+    return {'noise_percentile': noise_percentile, 'speech_margin_db': speech_margin_db,
+            'max_threshold_db': max_threshold_db, 'unvoiced_zcr': unvoiced_zcr, 'unvoiced_reach': unvoiced_reach,
+            'speech_padding': speech_padding, 'min_silence': min_silence, 'min_saved': min_saved,
+            'analysis_rate': analysis_rate, 'frame_duration': frame_duration}
+
+
+def speech_frames(file_path, run=None, input_options=None):
+    """
+    Find the frames containing speech, from their energy and their zero-crossing rate.
+    Voiced speech is louder than the noise floor, unvoiced speech is quieter but crosses zero more often,
+    and only counts next to voiced speech since broadband noise crosses zero often too.
+    :param file_path: Path to the audio file
+    :param run: Pipeline run, stopping the decoding if it is cancelled (optional)
+    :param input_options: ffmpeg options of the input, such as its start and end times (optional)
+    :return: Speech flag of each frame
+    """
+    frame_length = int(analysis_rate * frame_duration)
+    energies = []
+    crossings = []
+    for _, samples in read_blocks(file_path, analysis_rate, run=run, input_options=input_options):
+        frame_count = len(samples) // frame_length
+        frames = samples[:frame_count * frame_length].astype(np.float32).reshape(frame_count, frame_length)
+        energies.append(np.sqrt(np.mean(frames ** 2, axis=1)))
+        crossings.append(np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1))
+    if not energies:
+        return np.zeros(0, dtype=bool)
+
+    levels = 20 * np.log10(np.concatenate(energies) + 1.0)
+    crossings = np.concatenate(crossings)
+    threshold = min(np.percentile(levels, noise_percentile) + speech_margin_db, max_threshold_db)
+    voiced = levels > threshold
+    reach = int(round(unvoiced_reach / frame_duration))
+    near_voiced = np.convolve(voiced.astype(np.int32), np.ones(2 * reach + 1, dtype=np.int32), mode='same') > 0
+    unvoiced = (crossings > unvoiced_zcr) & (levels > threshold - speech_margin_db / 2) & near_voiced
+    return voiced | unvoiced
+
+
+def speech_regions(speech):
+    """
+    Turn the speech frames into the regions of the recording to keep.
+    The speech is padded, and the silences shorter than `min_silence` are kept.
+    :param speech: Speech flag of each frame
+    :return: Start and end in seconds of each region
+    """
+    if not speech.any():
+        return []
+    padding = int(round(speech_padding / frame_duration))
+    kept = np.convolve(speech.astype(np.int32), np.ones(2 * padding + 1, dtype=np.int32), mode='same') > 0
+
+    # Runs of identical flags: the frame indexes where the flag changes
+    changes = np.flatnonzero(np.diff(np.concatenate([[False], kept, [False]]).astype(np.int8)))
+    starts, ends = changes[0::2], changes[1::2]
+    gaps = starts[1:] - ends[:-1]
+    joined = np.concatenate([[True], gaps >= int(round(min_silence / frame_duration))])
+    region_starts = starts[joined]
+    region_ends = np.concatenate([ends[:-1][joined[1:]], ends[-1:]])
+    return [(float(start * frame_duration), float(end * frame_duration))
+            for start, end in zip(region_starts, region_ends)]
+
+
+def trim_silence(file_path, output_path, profile, run=None, input_options=None):
+    """
+    Remove the long silences of a recording, encoding what is kept with an upload profile.
+    The recording is decoded once for the detection and once for the encoding, block by block.
+    It should be the original recording (or the video), so that its audio is encoded only once.
+    :param file_path: Path to the recording
+    :param output_path: Path to the trimmed recording
+    :param profile: Name of the encoding profile of the trimmed recording
+    :param run: Pipeline run, recording the seconds saved and running the decoders and the encoder (optional)
+    :param input_options: ffmpeg options of the input, such as its start and end times ('ss', 'to') (optional)
+    :return: Time map of the trimmed recording, None if no speech is detected or too little would be saved to trim it
+    """
+    start = time.perf_counter()
+    speech = speech_frames(file_path, run, input_options)
+    duration = len(speech) * frame_duration
+    regions = speech_regions(speech)
+    saved = duration - sum(end - region_start for region_start, end in regions)
+    # Without any speech detected the recording is kept as it is, rather than trimmed to nothing
+    if not regions or saved < min_saved:
+        if run is not None:
+            run.record('silence_trimming', time.perf_counter() - start, audio_seconds=duration, saved_seconds=0.0)
+        return None
+
+    # The regions are cut at whole samples, so that the time map matches the trimmed audio exactly
+    sample_rate = encoding_profiles[profile]['sample_rate']
+    bounds = np.array([[round(region_start * sample_rate), round(end * sample_rate)]
+                       for region_start, end in regions], dtype=np.int64)
+    encoder = (
+        ffmpeg
+        .input('pipe:', format='s16le', acodec='pcm_s16le', ac=1, ar=sample_rate)
+        .output(output_path, **profile_options(profile))
+        .global_args('-loglevel', 'error')
+        .overwrite_output()
+        .run_async(pipe_stdin=True)
+    )
+    if run is not None:
+        run.attach_process(encoder)
+    try:
+        position = 0
+        for _, samples in read_blocks(file_path, sample_rate, run=run, input_options=input_options):
+            # +1 where a region starts and -1 where it ends, the running sum is positive inside the regions
+            changes = np.zeros(len(samples) + 1, dtype=np.int32)
+            np.add.at(changes, np.clip(bounds[:, 0] - position, 0, len(samples)), 1)
+            np.add.at(changes, np.clip(bounds[:, 1] - position, 0, len(samples)), -1)
+            keep = np.cumsum(changes[:-1]) > 0
+            encoder.stdin.write(samples[keep].tobytes())
+            position += len(samples)
+        encoder.stdin.close()
+        if encoder.wait() != 0:
+            raise RuntimeError(f"Trimming of '{file_path}' failed")
+    except BaseException:
+        # A cancelled or failed trimming leaves no partial recording
+        encoder.kill()
+        encoder.wait()
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    finally:
+        if encoder.poll() is None:
+            encoder.kill()
+            encoder.wait()
+        if run is not None:
+            run.detach_process(encoder)
+
+    time_map = TimeMap((first / sample_rate, (last - first) / sample_rate) for first, last in bounds)
+    saved = duration - time_map.duration
+    if run is not None:
+        run.record('silence_trimming', time.perf_counter() - start, audio_seconds=duration, saved_seconds=saved)
+    print(f"Silence trimming: {saved:.0f}s of {duration:.0f}s removed.")
+    return time_map
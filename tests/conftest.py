@@ -0,0 +1,34 @@
+import os
+import sys
+import wave
+
+import numpy as np
+import pytest
+
+# The modules of src/ are imported as scripts, like the entry points do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    """
+    Run each test in its own directory, where the output files are written.
+    """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def make_wav(tmp_path):
+    """
+    Write mono 16-bit samples to a WAV file.
+    """
+    def make(samples, name="audio.wav", sample_rate=16000):
+        path = str(tmp_path / name)
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+            f.writeframes(np.asarray(samples, dtype=np.int16).tobytes())
+        return path
+    return make
@@ -0,0 +1,35 @@
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+import audioChunker
+from audioChunker import plan_chunk_boundaries, probe_audio
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+
+
+@pytest.fixture
+def meeting_mp3(make_wav, tmp_path):
+    """
+    Make a two-minute MP3 of tone pausing during the last 2 seconds of every 9.
+    """
+    times = np.arange(120 * 16000) / 16000
+    samples = np.where(times % 9 < 7, 8000 * np.sin(2 * np.pi * 200 * times), 0)
+    path = str(tmp_path / "meeting.mp3")
+    subprocess.run(['ffmpeg', '-v', 'error', '-i', make_wav(samples), path], check=True)
+    return path
+
+
+@pytest.mark.parametrize('seek_read_ratio', [1e9, 1e-9])
+def test_cuts_fall_in_the_pauses(meeting_mp3, monkeypatch, seek_read_ratio):
+    # The windows are decoded on their own with cheap seeks, in a single pass with costly ones
+    monkeypatch.setattr(audioChunker, 'seek_read_ratio', seek_read_ratio)
+    duration, _ = probe_audio(meeting_mp3)
+    boundaries = plan_chunk_boundaries(meeting_mp3, duration, 30.0)
+
+    assert len(boundaries) == 5
+    assert boundaries[-1][1] == duration
+    for (start, _), (_, end) in zip(boundaries[1:], boundaries[:-1]):
+        assert 7 <= end % 9 < 9 and start == pytest.approx(end - audioChunker.chunk_overlap)
@@ -0,0 +1,97 @@
+import sys
+import time
+import shutil
+import subprocess
+import threading
+from types import SimpleNamespace
+
+import ffmpeg
+import pytest
+
+from liveTranscription import live_minutes_main
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+
+# Fake recorder: copies a recording to a file block by block, as a recording application writes it
+writer_script = '''
+import sys, time
+source, destination = sys.argv[1], sys.argv[2]
+with open(source, 'rb') as f, open(destination, 'wb') as out:
+    while True:
+        block = f.read(4096)
+        if not block:
+            break
+        out.write(block)
+        out.flush()
+        time.sleep(0.1)
+'''
+
+
+class StubResponse:
+    """
+    Response of the stub client.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.text = fields.get('text')
+
+    def model_dump(self):
+        return self.fields
+
+
+class StubClient:
+    """
+    API client answering the transcriptions and the chat completions without the network.
+    """
+
+    def __init__(self, on_upload=None):
+        self.on_upload = on_upload
+        self.uploads = 0
+        self.completions = 0
+        self.lock = threading.Lock()
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self.transcribe))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.complete))
+
+    def transcribe(self, file, model, response_format=None):
+        with self.lock:
+            self.uploads += 1
+        if self.on_upload is not None:
+            self.on_upload()
+        text = "我们讨论了预算。"
+        return StubResponse({'text': text, 'segments': [{'start': 0.0, 'end': 1.0, 'text': text,
+                                                          'avg_logprob': -0.1}]})
+
+    def complete(self, model, messages, temperature=None, response_format=None):
+        with self.lock:
+            self.completions += 1
+        return StubResponse({'choices': [{'message': {'content': "会议要点。"}}], 'usage': {}})
+
+
+def test_live_minutes_of_a_growing_recording(work_dir):
+    # 21 seconds of speech-like tone: 5 seconds of speech then 2 seconds of silence, three times
+    source = str(work_dir / "source.mp3")
+    tone = "0.3*sin(2*PI*220*t)*lt(mod(t\\,7)\\,5)"
+    ffmpeg.input(f"aevalsrc={tone}:s=16000:d=21", f='lavfi').output(source, ac=1, audio_bitrate='64k').run(
+        quiet=True, overwrite_output=True)
+
+    recording = str(work_dir / "recording.mp3")
+    writer = subprocess.Popen([sys.executable, '-c', writer_script, source, recording])
+    writing = []
+    client = StubClient(on_upload=lambda: writing.append(writer.poll() is None))
+    try:
+        start = time.perf_counter()
+        filename = live_minutes_main(recording, 'Full', "live", client=client, timeout=2.0)
+        elapsed = time.perf_counter() - start
+    finally:
+        writer.wait()
+
+    # One transcription per speech segment, the first ones while the recording was still being written
+    assert client.uploads == 3
+    assert writing[0]
+    assert elapsed < 30
+    with open(work_dir / "output" / "live_transcript.txt", encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert [line[:10] for line in lines] == ["[00:00:00]", "[00:00:06]", "[00:00:13]"]
+    assert (work_dir / "output" / "live_summary.txt").read_text(encoding='utf-8') == "会议要点。"
+    assert filename.endswith("live.docx")
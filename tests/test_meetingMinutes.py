@@ -0,0 +1,270 @@
+import json
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from audioCache import AudioCache, audio_key, file_digest
+from audioChunker import AudioChunk
+from convertMKVtoMP3 import upload_profile
+from pipelineRun import PipelineRun, PipelineCancelled
+import meetingMinutes
+from meetingMinutes import (TranscriptionBackend, transcribe_audio, meeting_minutes, estimate_tokens, extractions,
+                            merge_prompts, call_with_backoff)
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+
+
+class LatencyBackend(TranscriptionBackend):
+    """
+    Transcription backend answering after a fixed delay, like a remote API.
+    """
+    name = "latency"
+    model = "latency"
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def transcribe_segments(self, filename, data, run=None):
+        time.sleep(self.latency)
+        return [{'start': 0.0, 'end': None, 'text': f" {filename}"}]
+
+
+@requires_ffmpeg
+def test_concurrent_transcription_is_faster(make_wav):
+    path = make_wav(np.zeros(16000 * 16))
+    chunks = [AudioChunk(path, index, 2.0 * index, 2.0 * (index + 1)) for index in range(8)]
+
+    timings = {}
+    for workers in (1, 4):
+        start = time.perf_counter()
+        segments = transcribe_audio(LatencyBackend(0.25), chunks, workers=workers)
+        timings[workers] = time.perf_counter() - start
+        # The segments are joined in the order of the chunks, whatever the order in which they were transcribed
+        assert [segment.text.strip() for segment in segments] == [chunk.filename for chunk in chunks]
+        assert [segment.start for segment in segments] == [chunk.start for chunk in chunks]
+
+    assert timings[4] < timings[1] / 2
+
+
+class StubChatClient:
+    """
+    Chat client answering without the API, recording the requests larger than its context limit.
+    """
+
+    def __init__(self, context_limit, answer_tokens):
+        self.context_limit = context_limit
+        self.answer_tokens = answer_tokens
+        self.requests = []
+        self.oversized = []
+        self.lock = threading.Lock()
+        self.chat = self
+        self.completions = self
+
+    def create(self, model, messages, temperature=None, response_format=None):
+        tokens = sum(estimate_tokens(message['content']) for message in messages)
+        system = messages[0]['content']
+        kind = next((f"merge_{section}" for section, prompt in merge_prompts.items() if prompt == system),
+                    "structured" if response_format is not None else "extraction")
+        with self.lock:
+            self.requests.append((kind, tokens))
+            if tokens > self.context_limit:
+                self.oversized.append((kind, tokens))
+
+        answer = "要点" * (self.answer_tokens // 2)
+        if kind == "structured":
+            answer = json.dumps({section: answer for section in extractions}, ensure_ascii=False)
+        elif kind.startswith("merge_"):
+            answer = kind + answer
+        return StubResponse(answer, tokens)
+
+
+class StubResponse:
+    """
+    Chat completion of the stub client.
+    """
+
+    def __init__(self, content, prompt_tokens):
+        self.content = content
+        self.prompt_tokens = prompt_tokens
+
+    def model_dump(self):
+        return {'choices': [{'message': {'content': self.content}}],
+                'usage': {'prompt_tokens': self.prompt_tokens, 'completion_tokens': estimate_tokens(self.content),
+                          'total_tokens': self.prompt_tokens + estimate_tokens(self.content)}}
+
+
+@pytest.mark.parametrize('mode', ['sequential', 'concurrent', 'single'])
+def test_long_transcript_stays_under_context_limit(monkeypatch, mode):
+    monkeypatch.setattr(meetingMinutes, 'max_input_tokens', 200)
+    client = StubChatClient(context_limit=400, answer_tokens=80)
+    transcription = "".join(f"第{index}项议题已经讨论完毕，大家同意下周继续。" for index in range(200))
+    assert estimate_tokens(transcription) > 10 * client.context_limit
+
+    minutes = meeting_minutes(client, transcription, mode)
+
+    assert client.oversized == []
+    # Each section is the answer of a last merge, after several levels of merges
+    for section in extractions:
+        assert minutes[section].startswith(f"merge_{section}")
+        assert sum(1 for kind, _ in client.requests if kind == f"merge_{section}") > 2
+    assert minutes['complete_transcription'] == transcription
+
+
+@requires_ffmpeg
+def test_audio_segment_chunks_are_timed_from_the_start():
+    from pydub import AudioSegment
+
+    chunks = [AudioSegment.silent(duration=duration, frame_rate=16000) for duration in (2000, 3000, 1500)]
+    segments = transcribe_audio(LatencyBackend(0.0), chunks)
+    assert [segment.start for segment in segments] == [0.0, 2.0, 5.0]
+    assert [segment.end for segment in segments] == [2.0, 5.0, 6.5]
+
+
+def test_cancel_interrupts_the_backoff():
+    import httpx
+    from groq import RateLimitError
+
+    attempts = []
+
+    def request():
+        attempts.append(time.perf_counter())
+        response = httpx.Response(429, headers={'retry-after': '60'}, request=httpx.Request('POST', "http://test"))
+        raise RateLimitError("Rate limit reached", response=response, body=None)
+
+    run = PipelineRun()
+    timer = threading.Timer(0.2, run.cancel)
+    timer.start()
+    start = time.perf_counter()
+    with pytest.raises(PipelineCancelled):
+        call_with_backoff(request, run=run)
+    # The cancellation ends the wait of the Retry-After delay instead of sending the request again after it
+    assert time.perf_counter() - start < 5
+    assert len(attempts) == 1
+
+
+def test_local_backend_is_loaded_once(monkeypatch):
+    import localWhisper
+
+    loads = []
+
+    def load_model(model, **options):
+        time.sleep(0.1)
+        loads.append(model)
+        return model
+
+    monkeypatch.setattr(localWhisper, 'WhisperModel', load_model)
+    monkeypatch.setattr(localWhisper, 'BatchedInferencePipeline', lambda model: model, raising=False)
+    monkeypatch.setattr(meetingMinutes, 'local_backends', {})
+
+    # Recordings of a batch starting at the same time share a single model
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        backends = list(executor.map(lambda _: meetingMinutes.create_backend('local'), range(4)))
+    assert len(loads) == 1
+    assert all(backend is backends[0] for backend in backends)
+
+
+class FlakyBackend(TranscriptionBackend):
+    """
+    Transcription backend failing once on a chunk, recording the chunks it transcribes.
+    """
+    name = "flaky"
+    model = "flaky"
+
+    def __init__(self, failing_chunk=None):
+        self.failing_chunk = failing_chunk
+        self.transcribed = []
+
+    def transcribe_segments(self, filename, data, run=None):
+        if filename == self.failing_chunk:
+            self.failing_chunk = None
+            raise RuntimeError("Upload failed")
+        self.transcribed.append(filename)
+        return [{'start': 0.0, 'end': None, 'text': f"第{len(data) % 7}段。"}]
+
+
+class FlakyChatClient:
+    """
+    Chat client failing once on the extraction of the action items, recording the sections it extracts.
+    """
+
+    def __init__(self):
+        self.failed = False
+        self.sections = []
+        self.chat = self
+        self.completions = self
+
+    def create(self, model, messages, temperature=None, response_format=None):
+        system = messages[0]['content']
+        section = ('action_items' if "操作" in system else 'key_points' if "关键点" in system
+                   else 'abstract_summary')
+        if section == 'action_items' and not self.failed:
+            self.failed = True
+            raise RuntimeError("Request failed")
+        self.sections.append(section)
+        return StubResponse(f"{section}内容", estimate_tokens(messages[1]['content']))
+
+
+@requires_ffmpeg
+def test_failed_run_resumes_from_its_checkpoints(make_wav, tmp_path):
+    path = make_wav(np.random.default_rng(0).integers(-1000, 1000, 16000 * 16))
+    chunks = [AudioChunk(path, index, 2.0 * index, 2.0 * (index + 1)) for index in range(8)]
+    job_dir = str(tmp_path / "job")
+
+    # First attempt: the upload of a chunk fails, the others are saved as checkpoints
+    # (the chunks not started yet when it fails are not transcribed either)
+    backend = FlakyBackend(failing_chunk=chunks[3].filename)
+    with pytest.raises(RuntimeError):
+        transcribe_audio(backend, chunks, run=PipelineRun(job_dir=job_dir))
+    done = backend.transcribed
+    assert done[:3] == [chunk.filename for chunk in chunks[:3]] and chunks[3].filename not in done
+
+    # Second attempt: only the missing chunks are transcribed, then an extraction fails
+    backend = FlakyBackend()
+    run = PipelineRun(job_dir=job_dir)
+    transcription = meetingMinutes.segments_text(transcribe_audio(backend, chunks, run=run))
+    assert backend.transcribed == [chunk.filename for chunk in chunks if chunk.filename not in done]
+    client = FlakyChatClient()
+    with pytest.raises(RuntimeError):
+        meeting_minutes(client, transcription, 'concurrent', run)
+    assert sorted(client.sections) == ['abstract_summary', 'key_points']
+
+    # Third attempt: nothing is transcribed again and only the failed section is extracted
+    backend = FlakyBackend()
+    run = PipelineRun(job_dir=job_dir)
+    assert meetingMinutes.segments_text(transcribe_audio(backend, chunks, run=run)) == transcription
+    assert backend.transcribed == []
+    client.sections = []
+    minutes = meeting_minutes(client, transcription, 'concurrent', run)
+    assert client.sections == ['action_items']
+    assert {section: minutes[section] for section in extractions} == {
+        section: f"{section}内容" for section in extractions}
+
+
+class SplitStop(Exception):
+    """
+    Raised by the stub splitter, once the encoding profile of the chunks is known.
+    """
+
+
+@pytest.mark.parametrize('ready', [False, True])
+def test_only_prepared_recordings_are_split_without_encoding(make_wav, monkeypatch, ready):
+    # A recording with the extension of the upload format may have any codec, rate or channels
+    path = make_wav(np.zeros(16000), name="recording.ogg")
+    if ready:
+        AudioCache().put(audio_key(file_digest(path), upload=upload_profile))
+    profiles = []
+
+    def split_audio_stream(file_path, profile=None):
+        profiles.append(profile)
+        raise SplitStop()
+
+    monkeypatch.setattr(meetingMinutes, 'split_audio_stream', split_audio_stream)
+    monkeypatch.setattr(meetingMinutes, 'create_backend', lambda backend, client: None)
+    monkeypatch.setattr(meetingMinutes, 'silence_trimming', False)
+    with pytest.raises(SplitStop):
+        meetingMinutes.meeting_minutes_main(path, 'Transcription', run=PipelineRun(), backend='local')
+    assert profiles == [None if ready else upload_profile]
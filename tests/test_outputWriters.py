@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from outputWriters import MinutesOutput, output_writers
+from transcriptSegments import Segment
+
+formats = list(output_writers)
+
+
+def test_files_are_renamed_once_complete(work_dir):
+    output = MinutesOutput(str(work_dir / "output" / "minutes"), formats)
+    output.add_segments([Segment(0.0, 2.0, "会议开始。"), Segment(2.0, 4.0, "讨论预算。")])
+    assert sorted(os.listdir(work_dir / "output")) == sorted(f"minutes.{name}.part" for name in formats
+                                                             if name != 'docx')
+    output.add_sections({'complete_transcription': "会议开始。 讨论预算。", 'key_points': "- 预算"})
+    output.close()
+
+    assert sorted(os.listdir(work_dir / "output")) == sorted(f"minutes.{name}" for name in formats)
+    with open(work_dir / "output" / "minutes.txt", encoding='utf-8') as f:
+        assert f.read().startswith("[00:00:00] 会议开始。\n[00:00:02] 讨论预算。\n")
+
+
+def test_failed_run_leaves_no_files(work_dir):
+    output = MinutesOutput(str(work_dir / "output" / "minutes"), formats)
+    with pytest.raises(RuntimeError):
+        try:
+            output.add_segments([Segment(0.0, 2.0, "会议开始。")])
+            raise RuntimeError("transcription failed")
+        except BaseException:
+            output.discard()
+            raise
+    assert os.listdir(work_dir / "output") == []
@@ -0,0 +1,63 @@
+from searchIndex import SearchIndex
+from transcriptSegments import Segment
+
+
+def add_meetings(index):
+    index.add_meeting("weekly", [Segment(0.0, 5.0, "下周的预算由财务部门确认。", speaker="张三"),
+                                 Segment(5.0, 9.0, "会议到此结束。", speaker="李四")],
+                      {'key_points': "- 预算待确认"})
+    index.add_meeting("review", [Segment(0.0, 4.0, "客户对方案很满意。")])
+
+
+def test_long_terms_are_found_through_the_index():
+    index = SearchIndex("index.sqlite3")
+    add_meetings(index)
+
+    results = index.search("财务部门")
+    assert [(result['meeting'], result['start'], result['speaker']) for result in results] == [("weekly", 0.0, "张三")]
+    assert results[0]['snippet'] == "下周的预算由[财务部门]确认。"
+    assert index.search("财务部门 客户满意") == []
+
+
+def test_two_character_terms_are_found_through_the_pairs():
+    index = SearchIndex("index.sqlite3")
+    add_meetings(index)
+
+    results = index.search("预算")
+    assert sorted((result['meeting'], result['kind']) for result in results) == [
+        ("weekly", 'key_points'), ("weekly", 'transcript')]
+    assert all("[预算]" in result['snippet'] for result in results)
+    # All the terms must appear in the same passage, whatever their length
+    assert [result['start'] for result in index.search("预算 财务部门")] == [0.0]
+    assert [result['meeting'] for result in index.search("方案 客户")] == ["review"]
+    assert index.search("预算 客户") == []
+    # The pairs are compared without case, like the trigrams
+    index.add_meeting("english", [Segment(0.0, 2.0, "Go live in Q3")])
+    assert [result['meeting'] for result in index.search("q3")] == ["english"]
+    # Shorter terms are found by a scan of the passages
+    assert [result['meeting'] for result in index.search("满")] == ["review"]
+
+
+def test_reindexed_meeting_replaces_its_passages():
+    index = SearchIndex("index.sqlite3")
+    add_meetings(index)
+    index.add_meeting("weekly", [Segment(0.0, 3.0, "新的议程已经发出。")])
+
+    assert index.search("预算") == []
+    assert index.search("财务部门") == []
+    assert [result['meeting'] for result in index.search("议程")] == ["weekly"]
+    assert [result['meeting'] for result in index.search("已经发出")] == ["weekly"]
+    assert index.stats() == {'meetings': 2, 'passages': 2}
+    assert index.connection.execute(
+        "SELECT COUNT(*) FROM passage_bigrams WHERE bigram = '预算'").fetchone()[0] == 0
+
+
+def test_index_without_pairs_is_completed():
+    index = SearchIndex("index.sqlite3")
+    add_meetings(index)
+    with index.connection:
+        index.connection.execute("DROP TABLE passage_bigrams")
+    index.close()
+
+    index = SearchIndex("index.sqlite3")
+    assert [result['meeting'] for result in index.search("方案")] == ["review"]
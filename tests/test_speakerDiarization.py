@@ -0,0 +1,65 @@
+import time
+import shutil
+import threading
+
+import numpy as np
+import pytest
+
+from pipelineRun import PipelineRun, PipelineCancelled
+from speakerDiarization import diarize
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+
+
+def voices_samples(voices, duration=180, sample_rate=16000):
+    """
+    Make a meeting of synthetic voices taking turns every 9 seconds, like the diarization benchmark.
+    Each voice has its own pitch and harmonics, and speaks for 7 seconds of its turn, over a steady noise.
+    """
+    rng = np.random.default_rng(0)
+    t = np.arange(duration * sample_rate) / sample_rate
+    voice = np.floor(t / 9) % voices
+    pitch = 110 + 80 * voice
+    signal = (np.sin(2 * np.pi * pitch * t) + 0.5 * (voice == 1) * np.sin(4 * np.pi * pitch * t)
+              + 0.6 * (voice == 2) * np.sin(6 * np.pi * pitch * t))
+    envelope = (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)) * (t % 9 < 7)
+    return 0.3 * 32767 * signal * envelope + rng.uniform(-300, 300, len(t))
+
+
+@pytest.mark.parametrize('voices', [1, 2])
+def test_speakers_are_counted(make_wav, voices):
+    turns = diarize(make_wav(voices_samples(voices)))
+    assert len({turn['speaker'] for turn in turns}) == voices
+    # One turn per 7 seconds of speech, the voice of a turn is never split
+    assert len(turns) == 20
+
+
+def test_cancelled_diarization_stops_decoding(make_wav):
+    # Two hours of a tone in noise, which takes several seconds to diarize
+    sample_rate = 8000
+    rng = np.random.default_rng(0)
+    t = np.arange(7200 * sample_rate) / sample_rate
+    samples = 3000 * np.sin(2 * np.pi * 180 * t) + rng.normal(0, 300, len(t))
+    path = make_wav(samples, sample_rate=sample_rate)
+
+    run = PipelineRun()
+    errors = []
+
+    def target():
+        try:
+            diarize(path, run=run)
+        except PipelineCancelled as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    time.sleep(0.5)
+    start = time.perf_counter()
+    run.cancel()
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    # The decoding is stopped within a block, instead of going on to the end of the recording
+    assert time.perf_counter() - start < 1.5
+    assert not run.processes
@@ -0,0 +1,34 @@
+from transcriptSegments import Segment, segments_text, segments_from_response
+from meetingMinutes import merge_chunk_segments
+from speakerDiarization import speaker_turns
+
+
+def test_segments_text_separates_segments():
+    segments = [Segment(0.0, 2.0, "We agreed on the plan."), Segment(2.0, 4.0, "Next item is budget."),
+                Segment(4.0, 6.0, " Any questions?")]
+    assert segments_text(segments) == "We agreed on the plan. Next item is budget. Any questions?"
+
+
+def test_chunks_without_timestamps_are_not_glued():
+    # Backends without timestamps return each chunk as one segment, without leading space
+    merged = []
+    for index, text in enumerate(["We agreed on the plan.", "Next item is budget."]):
+        raw_segments = [{'start': 0.0, 'end': None, 'text': text}]
+        segments = segments_from_response(raw_segments, index, offset=index * 9.0, duration=10.0)
+        merge_chunk_segments(merged, segments, overlaps=index > 0)
+    assert segments_text(merged) == "We agreed on the plan. Next item is budget."
+
+
+def test_overlap_join_removes_repeated_text():
+    merged = [Segment(0.0, 10.0, " We agreed on the plan for the budget", 0)]
+    merge_chunk_segments(merged, [Segment(9.0, 15.0, " for the budget and the hiring.", 1)])
+    assert segments_text(merged) == "We agreed on the plan for the budget and the hiring."
+
+
+def test_speaker_turns_are_not_glued():
+    segments = [Segment(0.0, 2.0, "We agreed on the plan.", speaker="A"),
+                Segment(2.0, 4.0, "Next item is budget.", speaker="A"),
+                Segment(4.0, 6.0, "Fine.", speaker="B")]
+    turns = speaker_turns(segments)
+    assert [(turn.speaker, turn.start, turn.end, turn.text) for turn in turns] == [
+        ("A", 0.0, 4.0, "We agreed on the plan. Next item is budget."), ("B", 4.0, 6.0, "Fine.")]
@@ -0,0 +1,66 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from audioCache import AudioCache
+from convertMKVtoMP3 import ingest_audio
+from meetingMinutes import prepare_recording
+from pipelineRun import PipelineRun
+from voiceActivity import trim_silence
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+
+
+def meeting_samples():
+    """
+    Make a recording of 20 s of tone, one minute of silence and 20 s of tone.
+    """
+    tone = (8000 * np.sin(2 * np.pi * 200 * np.arange(20 * 16000) / 16000)).astype(np.int16)
+    return np.concatenate([tone, np.zeros(60 * 16000, dtype=np.int16), tone])
+
+
+def test_silent_recording_is_not_trimmed(make_wav):
+    # One minute of silence, long enough to be trimmed but without any speech region
+    path = make_wav(np.zeros(60 * 16000))
+    run = PipelineRun()
+
+    assert trim_silence(path, "trimmed.ogg", 'speech-opus', run) is None
+    assert not os.path.exists("trimmed.ogg")
+    event, = [event for event in run.events if event['operation'] == 'silence_trimming']
+    assert event['saved_seconds'] == 0.0
+
+
+def test_trimmed_recording_is_reused(make_wav):
+    path = make_wav(meeting_samples())
+    first_run = PipelineRun()
+    trimmed_path, time_map, ready = prepare_recording(path, first_run, trim=True)
+    assert trimmed_path != path and ready
+    assert 95 < time_map.pieces[-1][0] + time_map.pieces[-1][1] <= 100
+    assert time_map.duration < 45
+
+    # The following run finds the trimmed recording in the cache instead of trimming it again
+    second_run = PipelineRun()
+    reused_path, reused_map, _ = prepare_recording(path, second_run, trim=True)
+    assert reused_path == trimmed_path
+    assert reused_map.pieces == time_map.pieces
+    operations = [event['operation'] for event in second_run.events]
+    assert 'silence_trimming' not in operations
+    assert 'audio_cache_hit' in operations
+
+
+def test_ingested_recording_is_trimmed_once(make_wav):
+    path = make_wav(meeting_samples())
+    ingest_run = PipelineRun()
+    audio_path = ingest_audio(path, "meeting", run=ingest_run, trim=True, cache=AudioCache())
+    event, = [event for event in ingest_run.events if event['operation'] == 'silence_trimming']
+    assert event['saved_seconds'] > 50
+
+    # The ingested file is split as it is, with the time map of its trimming
+    run = PipelineRun()
+    prepared_path, time_map, ready = prepare_recording(audio_path, run, trim=True)
+    assert prepared_path == audio_path and ready
+    assert 95 < time_map.pieces[-1][0] + time_map.pieces[-1][1] <= 100
+    assert 'silence_trimming' not in [event['operation'] for event in run.events]
+